@@ -0,0 +1,373 @@
+import argparse
+import builtins
+import contextlib
+import gc
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import license_inventory as inventory
+
+# Get directory of current script
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(SCRIPT_DIR, "license_inventory.py")
+
+# Text that shows the program is waiting for input (login menu, or the
+# first-time setup when there are no users yet)
+PROMPTS = [b"choice: ", b"username: "]
+
+# ------------------ STARTUP ------------------
+
+# Seconds taken by "import license_inventory" in a fresh interpreter
+def time_import(env):
+    code = ("import time; start = time.perf_counter(); import license_inventory; "
+            "print(time.perf_counter() - start)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return float(out)
+
+# Seconds from launching the program until its first prompt is printed
+def time_first_prompt(command, env):
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=SCRIPT_DIR, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = b""
+    try:
+        while not any(prompt in output for prompt in PROMPTS):
+            chunk = os.read(proc.stdout.fileno(), 65536)
+            if not chunk:
+                raise RuntimeError("program exited before prompting: " + output.decode(errors="replace")[-200:])
+            output += chunk
+        return time.perf_counter() - start
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        proc.stdin.close()
+
+# Startup scenarios: (name, what to run, extra environment)
+def startup_scenarios(banner_file):
+    no_banners = os.path.join(tempfile.gettempdir(), "softwhere-no-banners.json")
+    script = [sys.executable, SCRIPT]
+    return [
+        ("default", script, {"SOFTWHERE_BANNERS": no_banners}),
+        ("precomputed banners", script, {"SOFTWHERE_BANNERS": banner_file}),
+        ("plain", script + ["--plain"], {}),
+    ]
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 2)
+
+def run_startup(runs):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        banner_file = os.path.join(tmp, "banners.json")
+        env = dict(os.environ, SOFTWHERE_BANNERS=banner_file)
+        subprocess.run([sys.executable, SCRIPT, "banners"], env=env, check=True, capture_output=True)
+
+        results["import"] = median_ms([time_import(dict(os.environ)) for _ in range(runs)])
+        for name, command, extra in startup_scenarios(banner_file):
+            env = dict(os.environ, **extra)
+            results["first prompt: " + name] = median_ms([time_first_prompt(command, env) for _ in range(runs)])
+    return results
+
+# ------------------ DATASET ------------------
+
+# Software in the generated inventory: (name, key suffix, usage limit)
+CATALOG = [
+    ("AutoCAD", "ACAD", 100), ("MATLAB", "MATLAB", 50), ("SolidWorks", "SLDW", 40),
+    ("LabVIEW", "NI", 25), ("ANSYS", "CAE", 20), ("Proteus", "PCB", 30),
+    ("Visual Studio", "MSDN", 200), ("Fusion 360", "ADSK", 60), ("Code::Blocks", "CODE", 500),
+    ("Multisim", "CIR", 30), ("Microsoft Office", "O365", 1000), ("Adobe Photoshop", "PSD", 80),
+    ("IntelliJ IDEA", "JB", 150), ("Tableau", "TBL", 40), ("SPSS", "IBM", 35), ("Zoom", "ZM", 800),
+]
+DEVICE_TYPES = ["Laptop", "Desktop", "Workstation", "LabPC", "SimRig", "DevPC", "BoardDev", "CNC"]
+# Password of every generated user
+PASSWORD = "benchmark"
+
+# "1k", "100k", "1m" or a plain number
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+def size_name(size):
+    if size % 1000000 == 0:
+        return f"{size // 1000000}M"
+    if size % 1000 == 0:
+        return f"{size // 1000}k"
+    return str(size)
+
+# One admin ("admin") and an employee for about every five licenses. The
+# password is hashed once and shared, since hashing each would take longer
+# than the benchmark itself.
+def generate_users(count):
+    password = inventory.hash_password(PASSWORD)
+    users = [{"username": "admin", "password": password, "role": "admin"}]
+    users.extend({"username": f"employee{i:06d}", "password": password, "role": "employee"}
+                 for i in range(1, count))
+    return users
+
+# Licenses spread over the catalog and the users, installed over the last
+# three years for one to three years. Most past-expiry licenses are
+# already marked expired; about 1% are stale, for the expiry check to fix.
+def generate_licenses(count, usernames, seed=0):
+    rng = random.Random(seed)
+    today = date.today()
+    licenses = []
+    for i in range(count):
+        software, suffix, limit = rng.choice(CATALOG)
+        installed = today - timedelta(days=rng.randrange(3 * 365))
+        expires = installed + timedelta(days=365 * rng.randint(1, 3))
+        stale = rng.random() < 0.01
+        licenses.append({
+            "software": software,
+            "license_key": f"{rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ') * 3}-{i:07d}-{suffix}",
+            "user": rng.choice(usernames),
+            "assigned_device": f"{rng.choice(DEVICE_TYPES)}-{rng.randrange(count // 4 + 1):06d}",
+            "install_date": installed.isoformat(),
+            "expiry_date": expires.isoformat(),
+            "usage_limit": limit,
+            "current_usage": rng.randint(0, limit),
+            "status": "expired" if expires < today and not stale else "active",
+        })
+    return licenses
+
+# Write licenses.json and users.json for `size` licenses into directory,
+# in the same layout the program writes them
+def write_dataset(directory, size, seed=0):
+    users = generate_users(max(10, size // 5))
+    licenses = generate_licenses(size, [u["username"] for u in users[1:]], seed)
+    for name, data in [("users.json", users), ("licenses.json", licenses)]:
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(data, f, indent=4)
+    return len(users), len(licenses)
+
+# ------------------ OPERATIONS ------------------
+
+# Work done per size by the repeated operations
+QUERIES = 20
+EDITS = 20
+DELETES = 20
+LOOKUPS = 10000
+
+# Point license_inventory at the data files in directory and forget any
+# backend or store it has already opened
+def use_data_dir(directory, backend):
+    inventory.USER_FILE = os.path.join(directory, "users.json")
+    inventory.LICENSE_FILE = os.path.join(directory, "licenses.json")
+    inventory.JOURNAL_FILE = os.path.join(directory, "licenses.journal")
+    inventory.CHANGE_FEED_FILE = os.path.join(directory, "licenses.changes.jsonl")
+    inventory.LOCK_FILE = inventory.LICENSE_FILE + ".lock"
+    inventory.DB_FILE = os.path.join(directory, "softwhere.db")
+    inventory.USAGE_HISTORY_FILE = os.path.join(directory, "usage_history.jsonl")
+    inventory.STORAGE_BACKEND = "json"
+    inventory.PLAIN = True
+    inventory._backend = None
+    inventory._store = None
+    if backend == "sqlite":
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            inventory.migrate_json_to_sqlite(inventory.DB_FILE)
+        inventory.STORAGE_BACKEND = "sqlite"
+        inventory._backend = inventory.SqliteBackend(inventory.DB_FILE)
+
+# Run one of the menu functions headlessly: input() (and so
+# validate_input) answers from the script, and output is discarded
+def run_scripted(func, answers):
+    answers = iter(answers)
+
+    def scripted_input(prompt=""):
+        try:
+            return next(answers)
+        except StopIteration:
+            raise RuntimeError(f"{func.__name__} asked for more input than scripted: {prompt!r}") from None
+
+    original = builtins.input
+    builtins.input = scripted_input
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return func()
+    finally:
+        builtins.input = original
+
+# Time one operation; work() returns how many records (or queries) it
+# handled. With trace_memory, also the peak memory it allocated.
+def measure(work, trace_memory=False):
+    import tracemalloc
+
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        records = work()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    result = {"ms": round(seconds * 1000, 2), "records": records,
+              "per_second": round(records / seconds, 1) if seconds else None}
+    if peak is not None:
+        result["peak_mb"] = round(peak / 1024 / 1024, 2)
+    return result
+
+# The core operations, in the order they run. Save comes right after the
+# load, while the journal is still empty, so it rewrites the whole file.
+def operations(sample):
+    def load():
+        inventory._store = None
+        return len(inventory.get_store())
+
+    def save():
+        store = inventory.get_store()
+        store.backend.save_licenses(list(store.licenses.values()))
+        return len(store)
+
+    def search():
+        for lic in sample[:QUERIES]:
+            run_scripted(inventory.search_license, [f"user:{lic['user']} software:{lic['software']}"])
+        return QUERIES
+
+    def expiry():
+        run_scripted(inventory.check_expired, [])
+        return len(inventory.get_store())
+
+    # Set the usage of a license: filter by key, pick row 1, field 8
+    # (current usage), new value, no further edits
+    def edit():
+        for lic in sample[QUERIES:QUERIES + EDITS]:
+            run_scripted(inventory.edit_license, [f"key:{lic['license_key']}", "1", "8", "1", "n"])
+        return EDITS
+
+    def delete():
+        for lic in sample[QUERIES + EDITS:QUERIES + EDITS + DELETES]:
+            run_scripted(inventory.delete_license, [f"key:{lic['license_key']}", "1", "y"])
+        return DELETES
+
+    def export():
+        run_scripted(inventory.export_to_csv, ["csv", ""])
+        return len(inventory.get_store())
+
+    def login_lookup():
+        usernames = [lic["user"] for lic in sample]
+        for i in range(LOOKUPS):
+            if inventory.find_user(usernames[i % len(usernames)]) is None:
+                raise RuntimeError("generated user not found")
+        return LOOKUPS
+
+    return [("load", load), ("save", save), ("search", search), ("expiry check", expiry),
+            ("edit", edit), ("delete", delete), ("export", export), ("login lookup", login_lookup)]
+
+# Peak resident memory of this process so far, if the platform reports it
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+# Generate a dataset of each size in a temporary directory and time the
+# operations on it. Sizes run smallest first, so the process peak memory
+# reported after each one belongs to that size.
+def run_operations(sizes, backend="json", trace_memory=False, seed=0):
+    results = {"backend": backend, "sizes": {}}
+    cwd = os.getcwd()
+    for size in sorted(sizes):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_dataset(tmp, size, seed)
+            use_data_dir(tmp, backend)
+            with open(inventory.LICENSE_FILE) as f:
+                sample = random.Random(seed).sample(json.load(f), min(size, QUERIES + EDITS + DELETES))
+            gc.collect()
+
+            os.chdir(tmp)  # the export is written to the working directory
+            try:
+                ops = {name: measure(work, trace_memory) for name, work in operations(sample)}
+            finally:
+                os.chdir(cwd)
+                inventory._store = None
+                inventory._backend = None
+            results["sizes"][size_name(size)] = {"licenses": size, "operations": ops, "peak_rss_mb": peak_rss_mb()}
+    return results
+
+# Change of each operation's time against an earlier --json result, as a
+# percentage (positive means slower), for the sizes and operations both have
+def compare(results, baseline):
+    changes = {}
+    for size, current in results["sizes"].items():
+        before = baseline.get("sizes", {}).get(size)
+        if not before:
+            continue
+        for name, op in current["operations"].items():
+            old = before["operations"].get(name)
+            if old and old["ms"]:
+                changes[(size, name)] = round(100 * (op["ms"] - old["ms"]) / old["ms"], 1)
+    return changes
+
+def print_operations(results, changes):
+    for size, current in results["sizes"].items():
+        rss = current["peak_rss_mb"]
+        print(f"\n{size} licenses ({results['backend']})" + (f", peak RSS {rss} MB" if rss else ""))
+        for name, op in current["operations"].items():
+            line = f"  {name:<14}{op['ms']:>11.2f} ms{op['per_second'] or 0:>14,.0f}/s"
+            if "peak_mb" in op:
+                line += f"{op['peak_mb']:>10.1f} MB"
+            if (size, name) in changes:
+                line += f"   {changes[(size, name)]:+.1f}% vs baseline"
+            print(line)
+
+# ------------------ ENTRY POINT ------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark license_inventory.py startup and its core operations.")
+    parser.add_argument("--runs", type=int, default=10, help="runs per startup measurement; the median is reported")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    suites = parser.add_subparsers(dest="suite", metavar="SUITE")
+    startup = suites.add_parser("startup", help="import and first-prompt times (the default)")
+    ops = suites.add_parser("operations", help="time load, save, search, expiry, edit, delete, export and login lookup")
+    for suite in [startup, ops]:
+        suite.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="print the results as JSON")
+    ops.add_argument("--sizes", default="1k,100k", help="comma-separated license counts (default: 1k,100k; e.g. 1k,100k,1m)")
+    ops.add_argument("--backend", choices=["json", "sqlite"], default="json", help="storage backend to measure")
+    ops.add_argument("--memory", action="store_true", help="report each operation's peak allocation (slower)")
+    ops.add_argument("--baseline", metavar="FILE", help="compare against the output of an earlier --json run")
+    ops.add_argument("--seed", type=int, default=0, help="seed for the generated data")
+    gen = suites.add_parser("generate", help="write a synthetic licenses.json and users.json")
+    gen.add_argument("size", help="number of licenses, e.g. 1k, 100k or 1m")
+    gen.add_argument("directory", help="where to write the files")
+    gen.add_argument("--seed", type=int, default=0, help="seed for the generated data")
+    args = parser.parse_args()
+
+    if args.suite == "generate":
+        os.makedirs(args.directory, exist_ok=True)
+        users, licenses = write_dataset(args.directory, parse_size(args.size), args.seed)
+        print(f"Wrote {licenses} licenses and {users} users (password '{PASSWORD}') to {args.directory}")
+    elif args.suite == "operations":
+        results = run_operations([parse_size(s) for s in args.sizes.split(",")], args.backend, args.memory, args.seed)
+        changes = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                changes = compare(results, json.load(f))
+        if args.json:
+            if changes:
+                results["vs_baseline_percent"] = {f"{size} {name}": change for (size, name), change in changes.items()}
+            print(json.dumps(results, indent=4))
+        else:
+            print_operations(results, changes)
+    else:
+        results = run_startup(args.runs)
+        if args.json:
+            print(json.dumps(results, indent=4))
+        else:
+            for name, ms in results.items():
+                print(f"{name:<36}{ms:>10.2f} ms")
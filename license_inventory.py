@@ -1,10 +1,24 @@
 import json
-from datetime import datetime
+from array import array
+from datetime import datetime, date
 import hashlib
+import hmac
 import os   
-import pyfiglet
-from termcolor import colored
-import stdiomask
+import bisect
+import contextlib
+import difflib
+import enum
+import functools
+import shlex
+import sqlite3
+import sys
+import threading
+import time
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # Get directory of current script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +27,255 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 USER_FILE = os.path.join(SCRIPT_DIR, "users.json")
 LICENSE_FILE = os.path.join(SCRIPT_DIR, "licenses.json")
 
+# Append-only log of license changes, replayed on top of LICENSE_FILE at
+# startup and folded back into it once it grows past JOURNAL_COMPACT_BYTES.
+# Set SOFTWHERE_JOURNAL=0 to rewrite LICENSE_FILE on every save instead.
+JOURNAL_FILE = os.path.join(SCRIPT_DIR, "licenses.journal")
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+USE_JOURNAL = os.environ.get("SOFTWHERE_JOURNAL", "1") != "0"
+
+# Every saved license change, numbered with a sequence that only grows,
+# so other systems can fetch just what changed since their last sync
+# ("python license_inventory.py changes --since N"). Unlike the journal
+# it is never folded away, unless SOFTWHERE_CHANGE_FEED_KEEP sets how many
+# of the latest changes to keep (older ones are trimmed once there are
+# twice that many, and asking for them is an error).
+CHANGE_FEED_FILE = os.environ.get("SOFTWHERE_CHANGE_FEED", os.path.join(SCRIPT_DIR, "licenses.changes.jsonl"))
+CHANGE_FEED_KEEP = int(os.environ.get("SOFTWHERE_CHANGE_FEED_KEEP", 0))
+
+# Format LICENSE_FILE is written in: "pretty" (indented JSON), "compact"
+# (JSON without whitespace) or "binary" (columnar, see
+# encode_binary_snapshot). Reading detects the format, and saving keeps
+# the one the file already has unless SOFTWHERE_SNAPSHOT names one.
+# "python license_inventory.py convert FORMAT" rewrites the files.
+SNAPSHOT_FORMATS = ["pretty", "compact", "binary"]
+SNAPSHOT_FORMAT = os.environ.get("SOFTWHERE_SNAPSHOT")
+
+# Lock file taken around every read-modify-write of the JSON files so
+# several sessions can share them
+LOCK_FILE = LICENSE_FILE + ".lock"
+
+# Storage backend: "json" uses the files above, "sqlite" keeps users and
+# licenses in DB_FILE. Run "python license_inventory.py migrate" once to
+# copy the JSON data into the database before switching.
+STORAGE_BACKEND = os.environ.get("SOFTWHERE_BACKEND", "json")
+DB_FILE = os.environ.get("SOFTWHERE_DB", os.path.join(SCRIPT_DIR, "softwhere.db"))
+# Writes kept in the database's change log for other sessions to catch up
+# from; a session further behind than that reloads everything
+SQLITE_CHANGE_LOG_WRITES = 1000
+
+# Daily usage history recorded by the usage meter (append-only, compacted
+# once it grows past USAGE_HISTORY_COMPACT_BYTES)
+USAGE_HISTORY_FILE = os.path.join(SCRIPT_DIR, "usage_history.jsonl")
+USAGE_HISTORY_COMPACT_BYTES = 1024 * 1024
+
+# Login sessions for the command line: hashes of the issued tokens, so
+# scripted runs can skip the (deliberately slow) password check. Tokens
+# expire after SESSION_TTL seconds.
+SESSION_FILE = os.environ.get("SOFTWHERE_SESSIONS", os.path.join(SCRIPT_DIR, "sessions.json"))
+SESSION_TTL = int(os.environ.get("SOFTWHERE_SESSION_TTL", 3600))
+
+# Precomputed menu banners (see "python license_inventory.py banners"),
+# used instead of rendering them with pyfiglet at startup
+BANNER_FILE = os.environ.get("SOFTWHERE_BANNERS", os.path.join(SCRIPT_DIR, "banners.json"))
+BANNER_TITLES = ["SOFTWHERE", "Admin License Inventory Menu", "Employee License Inventory Menu"]
+
+# Plain mode: no colours, no ASCII-art banners and no masked password
+# prompt, so pyfiglet, termcolor and stdiomask are never imported. Turned
+# on by --plain or SOFTWHERE_PLAIN=1.
+PLAIN = os.environ.get("SOFTWHERE_PLAIN") == "1"
+
+# Opt-in profiling (SOFTWHERE_PROFILE or --profile): "cpu" saves cProfile
+# stats to PROFILE_FILE, "memory" saves the top tracemalloc allocations to
+# MEMORY_PROFILE_FILE, "all" does both. SOFTWHERE_METRICS (or --metrics)
+# names a file the operation metrics are written to on exit (.json for
+# JSON, anything else for Prometheus text).
+PROFILE_MODES = ["cpu", "memory", "all"]
+PROFILE_MODE = os.environ.get("SOFTWHERE_PROFILE", "")
+PROFILE_FILE = os.path.join(SCRIPT_DIR, "softwhere.prof")
+MEMORY_PROFILE_FILE = os.path.join(SCRIPT_DIR, "softwhere_memory.txt")
+METRICS_FILE = os.environ.get("SOFTWHERE_METRICS", "")
+
+# License fields in display/file order
+LICENSE_FIELDS = [
+    "software", "license_key", "user", "assigned_device",
+    "install_date", "expiry_date", "usage_limit", "current_usage", "status"
+]
+
+# ------------------ Display Helpers ------------------
+
+# The decorative modules are imported on first use instead of at startup;
+# pyfiglet alone costs more than the rest of the program to import.
+_termcolor = None
+_banners = None
+
+# termcolor.colored(), or the plain text in plain mode or if termcolor
+# isn't installed
+def colored(text, color=None, *args, **kwargs):
+    global _termcolor
+    if PLAIN:
+        return text
+    if _termcolor is None:
+        try:
+            from termcolor import colored as _termcolor
+        except ImportError:
+            _termcolor = False
+    if not _termcolor:
+        return text
+    return _termcolor(text, color, *args, **kwargs)
+
+# Render every banner title with pyfiglet
+def render_banners():
+    import pyfiglet
+    return {title: pyfiglet.figlet_format(title) for title in BANNER_TITLES}
+
+# ASCII-art banner for a menu title. Rendered once per run, or read from
+# BANNER_FILE when it has been precomputed.
+def banner(title):
+    global _banners
+    if PLAIN:
+        return f"=== {title} ===\n"
+    if _banners is None:
+        try:
+            with open(BANNER_FILE) as f:
+                _banners = json.load(f)
+        except (OSError, ValueError):
+            _banners = {}
+    if title not in _banners:
+        try:
+            import pyfiglet
+            _banners[title] = pyfiglet.figlet_format(title)
+        except ImportError:
+            _banners[title] = f"=== {title} ===\n"
+    return _banners[title]
+
+# Write the rendered banners to BANNER_FILE so later runs skip pyfiglet
+def save_banners():
+    write_json_atomic(BANNER_FILE, render_banners())
+    print(colored(f"Banners written to {BANNER_FILE}", "green"))
+
+# Password prompt showing asterisks (stdiomask), or nothing at all in
+# plain mode
+def getpass_masked(prompt):
+    if not PLAIN:
+        try:
+            import stdiomask
+            return stdiomask.getpass(prompt, mask='*')
+        except ImportError:
+            pass
+    import getpass
+    return getpass.getpass(prompt)
+
+# ------------------ INSTRUMENTATION ------------------
+
+# Call count, time and named counters (bytes, records, hits, ...) per
+# operation, for the whole process
+class Metrics:
+    def __init__(self):
+        self.ops = {}  # name -> {"calls", "seconds", "max_seconds", counters...}
+
+    def _op(self, name):
+        op = self.ops.get(name)
+        if op is None:
+            op = self.ops[name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+        return op
+
+    def record(self, name, seconds):
+        op = self._op(name)
+        op["calls"] += 1
+        op["seconds"] += seconds
+        if seconds > op["max_seconds"]:
+            op["max_seconds"] = seconds
+
+    def add(self, name, counter, amount=1):
+        op = self._op(name)
+        op[counter] = op.get(counter, 0) + amount
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def to_json(self):
+        ops = {}
+        for name, op in sorted(self.ops.items()):
+            ops[name] = dict(op, avg_ms=round(1000 * op["seconds"] / op["calls"], 3) if op["calls"] else None)
+        return json.dumps(ops, indent=4)
+
+    # Prometheus text exposition format
+    def to_prometheus(self):
+        series = {}  # metric name -> [(op, value)]
+        for name, op in sorted(self.ops.items()):
+            for counter, value in op.items():
+                if counter == "max_seconds":
+                    metric = "softwhere_operation_seconds_max"
+                else:
+                    metric = f"softwhere_operation_{counter}_total"
+                series.setdefault(metric, []).append((name, value))
+        lines = []
+        for metric, values in series.items():
+            lines.append(f"# TYPE {metric} {'gauge' if metric.endswith('_max') else 'counter'}")
+            lines.extend(f'{metric}{{op="{name}"}} {value}' for name, value in values)
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Time every call of a function as operation `name`. With counter set,
+# the length of the result is added to that counter (e.g. search "hits").
+def instrumented(name, counter=None):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+            if counter is not None and result is not None:
+                metrics.add(name, counter, len(result))
+            return result
+        return wrapper
+    return decorate
+
+def write_metrics(path):
+    text = metrics.to_json() if path.endswith(".json") else metrics.to_prometheus()
+    with open(path, "w") as f:
+        f.write(text)
+
+# Start cProfile and/or tracemalloc ("cpu", "memory" or "all"); results
+# are written when the process exits
+def start_profiling(mode):
+    import atexit
+
+    if mode in ["cpu", "all"]:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def save_profile():
+            profiler.disable()
+            profiler.dump_stats(PROFILE_FILE)
+            print(f"CPU profile written to {PROFILE_FILE} (view with: python -m pstats {PROFILE_FILE})", file=sys.stderr)
+        atexit.register(save_profile)
+
+    if mode in ["memory", "all"]:
+        import tracemalloc
+
+        tracemalloc.start()
+
+        def save_memory_profile():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            with open(MEMORY_PROFILE_FILE, "w") as f:
+                f.write(f"Current: {current / 1024 / 1024:.1f} MiB, peak: {peak / 1024 / 1024:.1f} MiB\n\n")
+                f.write("\n".join(str(stat) for stat in top) + "\n")
+            print(f"Memory profile written to {MEMORY_PROFILE_FILE}", file=sys.stderr)
+        atexit.register(save_memory_profile)
+
 # ------------------ Error Handling and Input Validation ------------------
 
 # Validate user input with checks for passwords and numbers
@@ -20,7 +283,7 @@ def validate_input(prompt, is_password=False, is_number=False, hide_input=False)
     while True:
         if is_password and hide_input:
             # Use stdiomask for password input (shows asterisks)
-            user_input = stdiomask.getpass(prompt, mask='*')
+            user_input = getpass_masked(prompt)
         else:
             user_input = input(prompt).strip()
 
@@ -41,22 +304,1086 @@ def validate_input(prompt, is_password=False, is_number=False, hide_input=False)
 
         return user_input
 
-# ------------------ LOGIN SYSTEM ------------------
+# Parse a YYYY-MM-DD date; returns None if it isn't valid
+def parse_date(date_str):
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
 
-# Load user data from JSON file
-def load_users():
+# ------------------ RECORDS ------------------
+
+# License status and user role. They compare equal to (and serialize as)
+# their plain string values.
+class Status(str, enum.Enum):
+    ACTIVE = "active"
+    EXPIRED = "expired"
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+class Role(str, enum.Enum):
+    ADMIN = "admin"
+    EMPLOYEE = "employee"
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+STATUSES = {status.value: status for status in Status}
+ROLES = {role.value: role for role in Role}
+
+# Fields whose values repeat across many licenses; one shared copy is kept
+INTERNED_FIELDS = {"software", "user", "assigned_device"}
+DATE_FIELDS = {"install_date", "expiry_date"}
+
+# Marks a field the record doesn't have
+MISSING = object()
+
+_iso_dates = {}  # ordinal -> "YYYY-MM-DD", shared by every record
+_ordinals = {}   # date string -> ordinal, or None if not stored as one
+
+def iso_date(ordinal):
+    text = _iso_dates.get(ordinal)
+    if text is None:
+        text = _iso_dates[ordinal] = date.fromordinal(ordinal).isoformat()
+    return text
+
+# A "YYYY-MM-DD" date as a day ordinal, or None if the value isn't exactly
+# in that form (it is then kept as it was)
+def date_ordinal(value):
+    if type(value) is not str:
+        return None
+    if value not in _ordinals:
+        try:
+            ordinal = date.fromisoformat(value).toordinal() if len(value) == 10 else None
+        except ValueError:
+            ordinal = None
+        _ordinals[value] = ordinal if ordinal is not None and iso_date(ordinal) == value else None
+    return _ordinals[value]
+
+# One license, with a slot per field instead of a dict. Dates are kept as
+# day ordinals, the status as a Status, and software, user and device
+# names are interned. Fields outside LICENSE_FIELDS (and field values a
+# slot can't hold exactly) go to `extra`, so a record converts back to the
+# JSON it was read from. Records work like a read/write mapping:
+# lic['expiry_date'] is the "YYYY-MM-DD" string, lic.get(), `in`, keys()
+# and items() work as on a dict, and to_dict() gives the plain dict.
+class License:
+    __slots__ = tuple(LICENSE_FIELDS) + ("extra",)
+
+    @classmethod
+    def from_dict(cls, data):
+        lic = cls.__new__(cls)
+        lic.extra = None
+        get = data.get
+        for field in INTERNED_FIELDS:
+            value = get(field, MISSING)
+            setattr(lic, field, sys.intern(value) if type(value) is str else value)
+        lic.license_key = get("license_key", MISSING)
+        lic.install_date = lic._encode_date("install_date", get("install_date", MISSING))
+        lic.expiry_date = lic._encode_date("expiry_date", get("expiry_date", MISSING))
+        lic.usage_limit = get("usage_limit", MISSING)
+        lic.current_usage = get("current_usage", MISSING)
+        status = get("status", MISSING)
+        lic.status = STATUSES.get(status, status) if type(status) is str else status
+        if len(data) != len(LICENSE_FIELDS) or not LICENSE_SLOTS.issuperset(data):
+            for field, value in data.items():
+                if field not in LICENSE_SLOTS:
+                    lic._set_extra(field, value)
+        return lic
+
+    # From slot values in LICENSE_FIELDS order, as a binary snapshot has them
+    @classmethod
+    def from_slots(cls, software, license_key, user, assigned_device, install_date, expiry_date,
+                   usage_limit, current_usage, status):
+        lic = cls.__new__(cls)
+        lic.software = software
+        lic.license_key = license_key
+        lic.user = user
+        lic.assigned_device = assigned_device
+        lic.install_date = install_date
+        lic.expiry_date = expiry_date
+        lic.usage_limit = usage_limit
+        lic.current_usage = current_usage
+        lic.status = status
+        lic.extra = None
+        return lic
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in LICENSE_FIELDS}
+        for field in DATE_FIELDS:
+            if type(data[field]) is int:
+                data[field] = iso_date(data[field])
+        if self.extra is None and MISSING not in data.values():
+            return data
+
+        extra = self.extra or {}
+        result = {}
+        for field, value in data.items():
+            if value is not MISSING:
+                result[field] = value
+            elif field in extra:
+                result[field] = extra[field]
+        result.update((field, value) for field, value in extra.items() if field not in LICENSE_SLOTS)
+        return result
+
+    # Slots hold dates as ints; a value that isn't a string is kept aside
+    # in extra as-is
+    def _encode_date(self, field, value):
+        if value is MISSING or value is None:
+            return value
+        ordinal = date_ordinal(value)
+        if ordinal is not None:
+            return ordinal
+        if type(value) is not str:
+            self._set_extra(field, value)
+            return MISSING
+        return value
+
+    def _set_extra(self, field, value):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[field] = value
+
+    def __getitem__(self, field):
+        if field in LICENSE_SLOTS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                if type(value) is int and field in DATE_FIELDS:
+                    return _iso_dates.get(value) or iso_date(value)
+                return value
+        if self.extra is not None and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field not in LICENSE_SLOTS:
+            self._set_extra(field, value)
+            return
+        if self.extra is not None:
+            self.extra.pop(field, None)
+        if field in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        elif field in DATE_FIELDS:
+            value = self._encode_date(field, value)
+        elif field == "status" and type(value) is str:
+            value = STATUSES.get(value, value)
+        setattr(self, field, value)
+
+    def get(self, field, default=None):
+        if field in LICENSE_SLOTS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                if type(value) is int and field in DATE_FIELDS:
+                    return _iso_dates.get(value) or iso_date(value)
+                return value
+        if self.extra is not None:
+            return self.extra.get(field, default)
+        return default
+
+    # Day ordinal of a date field, or None if it is missing or not a date
+    def ordinal(self, field):
+        value = getattr(self, field)
+        if type(value) is int:
+            return value
+        if self.extra is not None and field in self.extra:
+            value = self.extra[field]
+        parsed = parse_date(value)
+        return parsed.toordinal() if parsed else None
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def values(self):
+        return self.to_dict().values()
+
+    def __contains__(self, field):
+        if field in LICENSE_SLOTS and getattr(self, field) is not MISSING:
+            return True
+        return self.extra is not None and field in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (License, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"License({self.to_dict()!r})"
+
+LICENSE_SLOTS = frozenset(LICENSE_FIELDS)
+
+# One user account; works like the {"username", "password", "role"} dict
+# it is stored as. Other fields are kept in `extra`.
+class User:
+    __slots__ = ("username", "password", "role", "extra")
+
+    def __init__(self, username, password, role, extra=None):
+        self.username = sys.intern(username) if type(username) is str else username
+        self.password = password
+        self.role = ROLES.get(role, role) if type(role) is str else role
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        extra = {k: v for k, v in data.items() if k not in USER_FIELDS} if len(data) > 3 else None
+        return cls(data.get("username"), data.get("password"), data.get("role"), extra or None)
+
+    def to_dict(self):
+        data = {"username": self.username, "password": self.password, "role": self.role}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, field):
+        if field in USER_FIELDS:
+            return getattr(self, field)
+        if self.extra is not None and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field in USER_FIELDS:
+            if field == "role" and type(value) is str:
+                value = ROLES.get(value, value)
+            setattr(self, field, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[field] = value
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __contains__(self, field):
+        return field in USER_FIELDS or self.extra is not None and field in self.extra
+
+    def keys(self):
+        return list(self.to_dict())
+
+    def items(self):
+        return list(self.to_dict().items())
+
+    def __repr__(self):
+        return f"User({self.username!r}, role={str(self.role)!r})"
+
+USER_FIELDS = ("username", "password", "role")
+
+# json.load() object_hook turning license records into Licenses
+def license_hook(obj):
+    return License.from_dict(obj) if "license_key" in obj else obj
+
+# json.dump(s) default= hook for License and User records
+def json_default(obj):
+    if isinstance(obj, (License, User)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# ------------------ SNAPSHOT FORMATS ------------------
+
+SNAPSHOT_MAGIC = b"SWSNAP1\n"
+
+# orjson, if installed, reads and writes JSON several times faster than
+# the json module
+@functools.lru_cache(maxsize=None)
+def load_orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+# True if value holds a whole-number float outside the 64-bit integer
+# range: what orjson makes of an integer too long for 64 bits
+def has_wide_float(value):
+    if type(value) is float:
+        return value.is_integer() and abs(value) >= 2 ** 63
+    if type(value) is dict:
+        value = value.values()
+    elif type(value) is not list:
+        return False
+    return any(map(has_wide_float, value))
+
+WIDE_FLOAT_TYPES = {float, dict, list}
+
+# Parse JSON text (bytes); license records become Licenses. orjson reads
+# integers beyond 64 bits as floats (10**30 comes back as 1e+30), so if a
+# record has such a float the text is parsed again with json, which keeps
+# them exact. Only records holding a float or a nested value are looked
+# into.
+def read_json_snapshot(data):
+    orjson = load_orjson()
+    if orjson is not None:
+        try:
+            licenses = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            licenses = None  # e.g. NaN, which only json accepts
+        if isinstance(licenses, list):
+            for i, lic in enumerate(licenses):
+                if isinstance(lic, dict):
+                    if not WIDE_FLOAT_TYPES.isdisjoint(map(type, lic.values())) and has_wide_float(lic):
+                        break
+                    if "license_key" in lic:
+                        licenses[i] = License.from_dict(lic)
+                elif has_wide_float(lic):
+                    break
+            else:
+                return licenses
+        elif licenses is not None and not has_wide_float(licenses):
+            return licenses
+    # Records become Licenses as they are parsed, so the dicts are never
+    # all in memory at once
+    return json.loads(data, object_hook=license_hook)
+
+def dump_compact_json(data):
+    orjson = load_orjson()
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=json_default)
+        except TypeError:
+            pass  # values orjson can't write exactly (e.g. huge ints)
+    return json.dumps(data, separators=(",", ":"), default=json_default).encode()
+
+# Format of an existing snapshot file (None if there is none). Pretty
+# JSON breaks its first line right after the opening bracket and ends
+# with a newline even when empty; compact JSON has no newlines at all.
+def snapshot_format(path):
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64)
+    except FileNotFoundError:
+        return None
+    if not head:
+        return None
+    if head.startswith(SNAPSHOT_MAGIC):
+        return "binary"
+    return "pretty" if b"\n" in head else "compact"
+
+# Dictionary key for a column value. Strings and None are used as they
+# are; other values also carry their type so 1, 1.0 and True stay apart.
+def snapshot_key(value):
+    if type(value) is str or value is None:
+        return value
+    try:
+        key = (type(value), value)
+        hash(key)
+        return key
+    except TypeError:
+        return (type(value), json.dumps(value, default=json_default))
+
+# Distinct values of a column and an array of codes into them (0 for a
+# license without the field, i for table[i - 1])
+def encode_column(values):
+    table = []
+    index = {}
+    codes = []
+    for value in values:
+        if value is MISSING:
+            codes.append(0)
+            continue
+        key = snapshot_key(value)
+        code = index.get(key)
+        if code is None:
+            table.append(value)
+            code = index[key] = len(table)
+        codes.append(code)
+    typecode = "B" if len(table) < 2 ** 8 else "H" if len(table) < 2 ** 16 else "I"
+    return table, array(typecode, codes)
+
+# Binary snapshot: SNAPSHOT_MAGIC, the header length (4 bytes, little
+# endian), a JSON header, then the columns. Every field is a column of
+# little-endian codes (1, 2 or 4 bytes per license) into the field's
+# distinct values, which the header lists; fields outside LICENSE_FIELDS
+# are one "extra" column of JSON text. Values are stored the way License
+# holds them (dates as day ordinals), so loading needs no parsing per
+# license, and column offsets are 8-byte aligned for reading through mmap.
+def encode_binary_snapshot(licenses):
+    licenses = [lic if isinstance(lic, License) else License.from_dict(lic) for lic in licenses]
+    columns = []
+    for field in LICENSE_FIELDS:
+        columns.append((field, encode_column([getattr(lic, field) for lic in licenses])))
+    extras = [json.dumps(lic.extra, default=json_default) if lic.extra else MISSING for lic in licenses]
+    columns.append(("extra", encode_column(extras)))
+
+    header = {"count": len(licenses), "columns": []}
+    body = bytearray()
+    for field, (table, codes) in columns:
+        if sys.byteorder != "little":
+            codes.byteswap()
+        header["columns"].append({"field": field, "type": codes.typecode, "offset": len(body), "values": table})
+        body += codes.tobytes()
+        body += bytes(-len(body) % 8)
+
+    header = json.dumps(header, separators=(",", ":"), default=json_default).encode()
+    start = len(SNAPSHOT_MAGIC) + 4 + len(header)
+    return b"".join([SNAPSHOT_MAGIC, len(header).to_bytes(4, "little"), header, bytes(-start % 8), body])
+
+# Column values as License stores them, with MISSING for code 0. Each
+# distinct value is already one object shared by every license that has
+# it, so names need no interning.
+def decode_table(field, values):
+    if field == "status":
+        values = [STATUSES.get(v, v) if type(v) is str else v for v in values]
+    return [MISSING] + values
+
+# Collecting garbage while a million new records are created makes the
+# collector rescan them over and over; records hold no reference cycles,
+# so it is paused while loading
+@contextlib.contextmanager
+def gc_paused():
+    import gc
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# Read a binary snapshot from an open file, mapping it instead of reading
+# it into memory
+def read_binary_snapshot(f):
+    import mmap
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        size = int.from_bytes(view[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 4], "little")
+        start = len(SNAPSHOT_MAGIC) + 4
+        header = json.loads(view[start:start + size].tobytes())
+        start += size
+        start += -start % 8
+        count = header["count"]
+        columns = {}
+        for column in header["columns"]:
+            table = decode_table(column["field"], column["values"])
+            offset = start + column["offset"]
+            with view[offset:offset + count * array(column["type"]).itemsize].cast(column["type"]) as codes:
+                if sys.byteorder != "little":
+                    codes = array(column["type"], codes)
+                    codes.byteswap()
+                columns[column["field"]] = list(map(table.__getitem__, codes))
+
+    licenses = list(map(License.from_slots, *(columns[field] for field in LICENSE_FIELDS)))
+    if any(column["field"] == "extra" and column["values"] for column in header["columns"]):
+        for lic, extra in zip(licenses, columns["extra"]):
+            if extra is not MISSING:
+                lic.extra = json.loads(extra)
+    return licenses
+
+# Write licenses to path in the given snapshot format; returns the size
+def write_snapshot(path, licenses, fmt):
+    if fmt == "binary":
+        return write_file_atomic(path, encode_binary_snapshot(licenses))
+    return write_json_atomic(path, licenses, compact=fmt == "compact")
+
+# Rewrite LICENSE_FILE (with the journal folded in) and USER_FILE in
+# another format. Users are always JSON; "binary" writes them compact.
+def convert_snapshot(fmt):
+    global SNAPSHOT_FORMAT
+    SNAPSHOT_FORMAT = fmt
+    backend = JsonBackend()
+    store = LicenseStore(backend)
+    with backend.lock():
+        store.load()
+        backend.save_users(backend.load_users())
+        store.compact()
+    print(colored(f"Saved {len(store)} licenses as {fmt} ({os.path.getsize(LICENSE_FILE):,} bytes)", "green"))
+
+# ------------------ STORAGE BACKENDS ------------------
+
+# Write data to a temp file and rename it over the target, so readers and
+# a crash mid-write never see a half-written file. Returns the size written.
+def write_file_atomic(path, data):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    return len(data)
+
+# Same for JSON, indented unless compact is set
+def write_json_atomic(path, data, compact=False):
+    if compact:
+        return write_file_atomic(path, dump_compact_json(data))
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=4, default=json_default)
+        f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_file, path)
+    return size
+
+# Exclusive advisory lock on LOCK_FILE, held only while a session reads
+# or writes the data files. Re-entrant within one session.
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.file = open(self.path, 'a+')
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            else:
+                self.file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass  # LK_LOCK gives up after 10 seconds; keep waiting
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            self.file.close()
+            self.file = None
+
+# Identifies one version of a snapshot file; changes when it is replaced
+def file_identity(path):
     try:
-        with open(USER_FILE, 'r') as f:
-            return json.load(f)
+        st = os.stat(path)
     except FileNotFoundError:
-        return [] # Return empty list if file doesn't exist
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+# Users and licenses kept in USER_FILE / LICENSE_FILE. License changes go
+# to JOURNAL_FILE and are folded into LICENSE_FILE once it grows too big.
+class JsonBackend:
+    def __init__(self, journal=USE_JOURNAL):
+        self.journal = journal
+        self.file_lock = FileLock(LOCK_FILE)
+        self.snapshot = None     # identity of LICENSE_FILE when loaded
+        self.generation = None   # journal generation when loaded
+        self.offset = 0          # bytes of JOURNAL_FILE already applied
+        self.users_identity = None  # identity of USER_FILE when users_index was built
+        self.users_index = {}       # username -> user
+
+    def lock(self):
+        return self.file_lock
+
+    def load_users(self):
+        try:
+            with open(USER_FILE, 'rb') as f:
+                return [User.from_dict(user) for user in read_json_snapshot(f.read())]
+        except FileNotFoundError:
+            return [] # Return empty list if file doesn't exist
+
+    # Look up one user, re-reading USER_FILE only when it has changed
+    def find_user(self, username):
+        identity = file_identity(USER_FILE)
+        if identity is None or identity != self.users_identity:
+            self.users_index = {user['username']: user for user in self.load_users()}
+            self.users_identity = identity
+        return self.users_index.get(username)
+
+    def save_users(self, users):
+        with self.lock():
+            fmt = SNAPSHOT_FORMAT or snapshot_format(USER_FILE)
+            write_json_atomic(USER_FILE, users, compact=fmt in ["compact", "binary"])
+
+    @instrumented("load_licenses", counter="records")
+    def load_licenses(self):
+        with self.lock():
+            self.snapshot = file_identity(LICENSE_FILE)
+            self.generation = self._journal_generation()
+            self.offset = 0
+            try:
+                with open(LICENSE_FILE, 'rb') as f, gc_paused():
+                    metrics.add("load_licenses", "bytes", os.fstat(f.fileno()).st_size)
+                    if f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC:
+                        return read_binary_snapshot(f)
+                    f.seek(0)
+                    return read_json_snapshot(f.read())
+            except FileNotFoundError:
+                return [] # Return empty list if no file exists
+
+    @instrumented("save_licenses", counter="records")
+    def save_licenses(self, licenses):
+        with self.lock():
+            fmt = SNAPSHOT_FORMAT or snapshot_format(LICENSE_FILE) or "pretty"
+            metrics.add("save_licenses", "bytes", write_snapshot(LICENSE_FILE, licenses, fmt))
+            self.snapshot = file_identity(LICENSE_FILE)
+
+    # Every compaction starts a new journal whose first record names a
+    # fresh generation. File stats alone can't be trusted to notice a
+    # replaced snapshot (inode reuse, coarse mtimes).
+    def _journal_generation(self):
+        try:
+            with open(JOURNAL_FILE, 'rb') as f:
+                first = f.readline()
+            return json.loads(first).get('generation')
+        except (FileNotFoundError, ValueError, AttributeError):
+            return None
 
-def save_users(users):
-    with open(USER_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    # Complete journal records from self.offset on; stops at a last line
+    # without a newline, which is still being written (or was torn by a
+    # crash). A complete line that doesn't parse is the remains of a torn
+    # write that a later append closed off, and is skipped.
+    def _read_journal(self):
+        records = []
+        try:
+            with open(JOURNAL_FILE, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.offset += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    # Journal records to replay over the snapshot just loaded. A torn last
+    # line left by a crash is cut off so new appends start on a clean line;
+    # nothing before it is touched.
+    @instrumented("read_journal", counter="records")
+    def read_changes(self):
+        if not self.journal:
+            return []
+        with self.lock():
+            records = self._read_journal()
+            if os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) != self.offset:
+                with open(JOURNAL_FILE, 'r+b') as f:
+                    f.truncate(self.offset)
+            return records
+
+    # Changes written by other sessions since we last looked, or None if
+    # the snapshot was replaced and everything has to be reloaded
+    def new_changes(self):
+        if file_identity(LICENSE_FILE) != self.snapshot:
+            return None
+        if not self.journal:
+            return []
+        if self._journal_generation() != self.generation:
+            return None
+        records = self._read_journal()
+        if self._journal_generation() != self.generation:
+            return None  # compacted while we were reading
+        return records
+
+    # Append the changes with a single write, or rewrite the whole file
+    # when journaling is off. Callers hold the lock and are caught up.
+    @instrumented("write_changes")
+    def write_changes(self, changes, store):
+        metrics.add("write_changes", "records", len(changes))
+        if not self.journal:
+            self.save_licenses(list(store.licenses.values()))
+            return
+        data = "".join(json.dumps(rec, separators=(",", ":"), default=json_default) + "\n" for rec in changes).encode()
+        with open(JOURNAL_FILE, 'a+b') as f:
+            # Start on a new line if a crashed session left the last one
+            # unfinished; readers skip the closed-off fragment
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self.offset = f.tell()
+        metrics.add("write_changes", "bytes", len(data))
+
+    def needs_compaction(self):
+        return (self.journal and os.path.exists(JOURNAL_FILE)
+                and os.path.getsize(JOURNAL_FILE) > JOURNAL_COMPACT_BYTES)
+
+    # Replaying a journal over a snapshot that already contains it is
+    # harmless, so a crash between the two steps loses nothing
+    def compact(self, licenses):
+        with self.lock():
+            self.save_licenses(licenses)
+            self.generation = os.urandom(8).hex()
+            header = (json.dumps({"op": "compacted", "generation": self.generation}) + "\n").encode()
+            with open(JOURNAL_FILE + ".tmp", 'wb') as f:
+                f.write(header)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(JOURNAL_FILE + ".tmp", JOURNAL_FILE)
+            self.offset = len(header)
+
+    def license_exists(self, key):
+        return False
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS licenses (
+    software, license_key UNIQUE NOT NULL, user, assigned_device,
+    install_date, expiry_date, usage_limit, current_usage, status,
+    extra  -- JSON object with any fields not listed above
+);
+CREATE INDEX IF NOT EXISTS idx_licenses_software ON licenses (software COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_licenses_user ON licenses (user);
+CREATE INDEX IF NOT EXISTS idx_licenses_expiry ON licenses (expiry_date);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value
+);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('licenses_version', 0);
+-- Change records of each write, tagged with the licenses_version it
+-- produced. Every write after changes_from is in the log.
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_changes_version ON changes (version);
+INSERT OR IGNORE INTO meta (name, value)
+    SELECT 'changes_from', value FROM meta WHERE name = 'licenses_version';
+"""
+
+# License columns are declared without a type so values come back exactly
+# as stored (no text/number conversion)
+LICENSE_COLUMNS = ", ".join(f'"{field}"' for field in LICENSE_FIELDS) + ", extra"
+# Key in the extra column listing the license fields a license doesn't
+# have at all. A NULL column is an explicit null.
+ABSENT_FIELDS_KEY = "\u0000absent"
+
+def license_to_row(lic):
+    extra = {k: v for k, v in lic.items() if k not in LICENSE_FIELDS}
+    absent = [field for field in LICENSE_FIELDS if field not in lic]
+    if absent:
+        extra[ABSENT_FIELDS_KEY] = absent
+    return tuple(lic.get(field) for field in LICENSE_FIELDS) + (json.dumps(extra) if extra else None,)
+
+def row_to_license(row):
+    lic = dict(zip(LICENSE_FIELDS, row))
+    if row[-1]:
+        extra = json.loads(row[-1])
+        for field in extra.pop(ABSENT_FIELDS_KEY, []):
+            lic.pop(field, None)
+        lic.update(extra)
+    return License.from_dict(lic)
+
+# Users and licenses kept in a SQLite database. Several sessions can share
+# the file: writes are short transactions, and each session catches up
+# with the others' commits from the change log.
+class SqliteBackend:
+    def __init__(self, path=DB_FILE):
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.version = None  # licenses_version when we last loaded or wrote
+
+    # Bumped by every write to the licenses table, so a session can tell
+    # whether someone else has written since it last looked
+    def _licenses_version(self):
+        return self.conn.execute("SELECT value FROM meta WHERE name = 'licenses_version'").fetchall()[0][0]
+
+    def _bump_version(self):
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'licenses_version'")
+        self.version = self._licenses_version()
+
+    def _meta(self, name):
+        return self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchall()[0][0]
+
+    def _set_meta(self, name, value):
+        self.conn.execute("UPDATE meta SET value = ? WHERE name = ?", (value, name))
+
+    # Read transaction so the version and the change log are read from the
+    # same snapshot; nested use joins the outer transaction
+    @contextlib.contextmanager
+    def _reading(self):
+        if self.conn.in_transaction:
+            yield self
+            return
+        self.conn.execute("BEGIN")
+        try:
+            yield self
+        finally:
+            self.conn.execute("COMMIT")
+
+    # Write transaction; nested use joins the outer one
+    @contextlib.contextmanager
+    def lock(self):
+        if self.conn.in_transaction:
+            yield self
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def load_users(self):
+        rows = self.conn.execute("SELECT username, password, role FROM users ORDER BY rowid")
+        return [User(u, p, r) for u, p, r in rows]
+
+    def find_user(self, username):
+        rows = self.conn.execute("SELECT username, password, role FROM users WHERE username = ?", (username,)).fetchall()
+        return User(*rows[0]) if rows else None
+
+    def save_users(self, users):
+        with self.lock():
+            self.conn.execute("DELETE FROM users")
+            self.conn.executemany(
+                "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                [(u['username'], u['password'], u['role']) for u in users])
+
+    @instrumented("load_licenses", counter="records")
+    def load_licenses(self):
+        self.version = self._licenses_version()
+        rows = self.conn.execute(f"SELECT {LICENSE_COLUMNS} FROM licenses ORDER BY rowid")
+        return [row_to_license(row) for row in rows]
+
+    @instrumented("save_licenses", counter="records")
+    def save_licenses(self, licenses):
+        with self.lock():
+            self.conn.execute("DELETE FROM licenses")
+            self.conn.executemany(
+                f"INSERT INTO licenses ({LICENSE_COLUMNS}) VALUES ({', '.join('?' * 10)})",
+                [license_to_row(lic) for lic in licenses])
+            self._bump_version()
+            # Nothing before a full rewrite can be replayed over it
+            self.conn.execute("DELETE FROM changes")
+            self._set_meta('changes_from', self.version)
+
+    def read_changes(self):
+        return []
+
+    # Apply the changes in one transaction and add them to the change log,
+    # dropping writes older than the last SQLITE_CHANGE_LOG_WRITES. A
+    # duplicate key (for example one added by another session) rolls the
+    # whole batch back.
+    @instrumented("write_changes")
+    def write_changes(self, changes, store):
+        metrics.add("write_changes", "records", len(changes))
+        try:
+            with self.lock():
+                for rec in changes:
+                    self._write_change(rec)
+                self._bump_version()
+                self.conn.executemany(
+                    "INSERT INTO changes (version, record) VALUES (?, ?)",
+                    [(self.version, json.dumps(rec, separators=(",", ":"), default=json_default)) for rec in changes])
+                oldest = self.version - SQLITE_CHANGE_LOG_WRITES
+                if oldest > self._meta('changes_from'):
+                    self.conn.execute("DELETE FROM changes WHERE version <= ?", (oldest,))
+                    self._set_meta('changes_from', oldest)
+        except sqlite3.IntegrityError:
+            raise ValueError("A license with this key already exists in the database.")
+
+    def _write_change(self, rec):
+        if rec['op'] == 'add':
+            self.conn.execute(
+                f"INSERT INTO licenses ({LICENSE_COLUMNS}) VALUES ({', '.join('?' * 10)})",
+                license_to_row(rec['license']))
+        elif rec['op'] == 'delete':
+            self.conn.execute("DELETE FROM licenses WHERE license_key = ?", (rec['key'],))
+        elif rec['field'] in LICENSE_FIELDS:
+            # Before the update, which may change the key
+            self._mark_present(rec['key'], rec['field'])
+            self.conn.execute(
+                f'UPDATE licenses SET "{rec["field"]}" = ? WHERE license_key = ?',
+                (rec['value'], rec['key']))
+        else:
+            rows = self.conn.execute("SELECT extra FROM licenses WHERE license_key = ?", (rec['key'],)).fetchall()
+            if rows:
+                extra = json.loads(rows[0][0]) if rows[0][0] else {}
+                extra[rec['field']] = rec['value']
+                self.conn.execute("UPDATE licenses SET extra = ? WHERE license_key = ?",
+                                  (json.dumps(extra), rec['key']))
+
+    # A license field that was absent exists once it is set
+    def _mark_present(self, key, field):
+        rows = self.conn.execute("SELECT extra FROM licenses WHERE license_key = ? AND extra IS NOT NULL",
+                                 (key,)).fetchall()
+        extra = json.loads(rows[0][0]) if rows else {}
+        absent = extra.get(ABSENT_FIELDS_KEY, [])
+        if field in absent:
+            absent.remove(field)
+            if not absent:
+                del extra[ABSENT_FIELDS_KEY]
+            self.conn.execute("UPDATE licenses SET extra = ? WHERE license_key = ?",
+                              (json.dumps(extra) if extra else None, key))
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, licenses):
+        pass
+
+    # Changes other connections have committed since our last load or
+    # write, or None if they are no longer all in the change log
+    def new_changes(self):
+        if self.version is None:
+            return []
+        with self._reading():
+            version = self._licenses_version()
+            if version == self.version:
+                return []
+            if self._meta('changes_from') > self.version:
+                return None
+            rows = self.conn.execute(
+                "SELECT record FROM changes WHERE version > ? ORDER BY rowid", (self.version,)).fetchall()
+        self.version = version
+        return [json.loads(record) for record, in rows]
+
+    # Checked when adding, as the duplicate-key guard for keys another
+    # session may have added since we last caught up. Searches and expiry
+    # queries go through the store's in-memory indexes instead.
+    def license_exists(self, key):
+        # fetchall() so the statement finishes and doesn't pin a read snapshot
+        rows = self.conn.execute("SELECT 1 FROM licenses WHERE license_key = ?", (key,)).fetchall()
+        return bool(rows)
+
+_backend = None
+
+# Backend selected by STORAGE_BACKEND, created on first use
+def get_backend():
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "sqlite":
+            _backend = SqliteBackend()
+        else:
+            _backend = JsonBackend()
+    return _backend
+
+# One-shot import of users.json and licenses.json (including any journal)
+# into the SQLite database
+def migrate_json_to_sqlite(db_file=DB_FILE):
+    source = JsonBackend()
+    users = source.load_users()
+    store = LicenseStore(source)
+    store.load()
+
+    target = SqliteBackend(db_file)
+    target.save_users(users)
+    target.save_licenses(list(store.licenses.values()))
+    print(colored(f"Migrated {len(users)} users and {len(store)} licenses to {db_file}", "green"))
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# ------------------ LOGIN SYSTEM ------------------
+
+# Load user data from storage
+def load_users():
+    return get_backend().load_users()
+
+def save_users(users):
+    get_backend().save_users(users)
+
+def find_user(username):
+    return get_backend().find_user(username)
+
+# Key derivation functions for stored passwords
+def scrypt_kdf(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=64 * 1024 * 1024, dklen=32)
+
+def pbkdf2_kdf(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+# Password hashing schemes: name -> (key derivation function, parameters
+# for new hashes). Stored hashes look like "scheme$param...$salt$hash";
+# hashes without a "$" are the old unsalted SHA-256 ones.
+PASSWORD_SCHEMES = {
+    "scrypt": (scrypt_kdf, (2 ** 14, 8, 1)),
+    "pbkdf2_sha256": (pbkdf2_kdf, (600000,)),
+}
+# Scheme for new and rehashed passwords (SOFTWHERE_HASH); scrypt needs
+# Python built against OpenSSL 1.1+
+PASSWORD_SCHEME = os.environ.get("SOFTWHERE_HASH", "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256")
+
+def hash_password(password, scheme=None):
+    scheme = scheme or PASSWORD_SCHEME
+    kdf, params = PASSWORD_SCHEMES[scheme]
+    salt = os.urandom(16)
+    key = kdf(password, salt, *params)
+    return "$".join([scheme, *map(str, params), salt.hex(), key.hex()])
+
+@instrumented("verify_password")
+def verify_password(password, stored):
+    if "$" not in stored:
+        return hmac.compare_digest(stored, hashlib.sha256(password.encode()).hexdigest())
+    scheme, *params, salt, key = stored.split("$")
+    if scheme not in PASSWORD_SCHEMES:
+        return False
+    kdf = PASSWORD_SCHEMES[scheme][0]
+    return hmac.compare_digest(kdf(password, bytes.fromhex(salt), *map(int, params)).hex(), key)
+
+# True if a stored hash uses an old scheme or old parameters
+def needs_rehash(stored):
+    if "$" not in stored:
+        return True
+    scheme, *params = stored.split("$")[:-2]
+    return scheme != PASSWORD_SCHEME or scheme not in PASSWORD_SCHEMES or tuple(params) != tuple(map(str, PASSWORD_SCHEMES[scheme][1]))
+
+# Passwords already verified in this process, kept as a keyed digest
+# (never the password itself) so repeated checks skip the KDF
+_verify_key = os.urandom(32)
+_verified = {}  # (username, stored hash) -> digest
+
+# Check a password against a user record. Legacy hashes are upgraded to
+# the current scheme on a successful check.
+def check_password(user, password):
+    digest = hmac.new(_verify_key, password.encode(), "sha256").digest()
+    cached = _verified.get((user['username'], user['password']))
+    if cached is not None and hmac.compare_digest(cached, digest):
+        return True
+    if not verify_password(password, user['password']):
+        return False
+
+    _verified[(user['username'], user['password'])] = digest
+    if needs_rehash(user['password']):
+        stored = rehash_user(user, password)
+        _verified[(user['username'], stored)] = digest
+    return True
+
+# Replace a user's stored hash with one in the current scheme
+def rehash_user(user, password):
+    stored = hash_password(password)
+    replace_password_hash(user, stored)
+    return stored
+
+# Write a new hash for the password the user record was loaded with.
+# Returns False if the password was changed meanwhile.
+def replace_password_hash(user, stored):
+    with get_backend().lock():
+        users = load_users()
+        for other in users:
+            if other['username'] == user['username'] and other['password'] == user['password']:
+                other['password'] = stored
+                save_users(users)
+                return True
+    return False
+
+# Role of the user if the username and password match, else None
+def authenticate(username, password):
+    user = find_user(username)
+    if user is None or not check_password(user, password):
+        return None
+    return user['role']
 
 def register_user():
     print("\n=== Register New User ===")
@@ -78,48 +1405,42 @@ def register_user():
             break
         print(colored("Error: Role must be either 'admin' or 'employee'", "red"))
 
-    users = load_users()
+    # Hold the lock so a user registered by another session isn't lost
+    with get_backend().lock():
+        users = load_users()
 
-    for user in users:
-        if user['username'] == username:
-            print(colored("Username already exists!", "red"))
-            return
+        for user in users:
+            if user['username'] == username:
+                print(colored("Username already exists!", "red"))
+                return
 
-    users.append({
-        "username": username,
-        "password": hash_password(password),
-        "role": role
-    })
-    save_users(users)
+        users.append(User(username, hash_password(password), role))
+        save_users(users)
     print(colored("User registered successfully!", "green"))
 
 def login_menu():
     while True:
-        title = pyfiglet.figlet_format("SOFTWHERE")
-        print(colored(title, "blue"))
+        print(colored(banner("SOFTWHERE"), "blue"))
         print(colored("[1] Login", "green"))
         print(colored("[2] Exit Program", "red"))
         
         choice = validate_input("Enter your choice: ", is_number=True)
         
         if choice == 1:
-            users = load_users()
             print("\n=== Employee Login ===")
             username = validate_input("Username: ").strip()
             # Password input with asterisks during login
             password = validate_input("Password: ", is_password=True, hide_input=True)
             
-            user_exists = any(user['username'] == username for user in users)
+            user = find_user(username)
             
-            if not user_exists:
+            if user is None:
                 print(colored("Error: Username not found.", "red"))
                 continue
             
-            hashed = hash_password(password)
-            for user in users:
-                if user['username'] == username and user['password'] == hashed:
-                    print(colored(f"Login successful! Welcome, {username} ({user['role']})\n", "green"))
-                    return user['role']
+            if check_password(user, password):
+                print(colored(f"Login successful! Welcome, {username} ({user['role']})\n", "green"))
+                return user['role']
             
             print(colored("Error: Incorrect password.", "red"))
             
@@ -129,27 +1450,853 @@ def login_menu():
         else:
             print(colored("Invalid choice. Please enter 1 or 2.", "red"))
 
+# ------------------ SESSIONS ------------------
+
+SESSION_LOCK = FileLock(SESSION_FILE + ".lock")
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Session records that haven't expired: token hash -> {username, role, expires}
+def load_sessions():
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            sessions = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    now = time.time()
+    return {key: entry for key, entry in sessions.items() if entry['expires'] > now}
+
+def save_sessions(sessions):
+    write_json_atomic(SESSION_FILE, sessions)
+    os.chmod(SESSION_FILE, 0o600)
+
+# Issue a token for a user who has just logged in. Only its hash is
+# stored. Returns (token, expiry time).
+def create_session(username, role, ttl=SESSION_TTL):
+    import secrets
+
+    token = secrets.token_urlsafe(32)
+    expires = time.time() + ttl
+    with SESSION_LOCK:
+        sessions = load_sessions()
+        sessions[token_hash(token)] = {"username": username, "role": role, "expires": expires}
+        save_sessions(sessions)
+    return token, expires
+
+# (username, role) for a valid token, else None
+def check_session(token):
+    entry = load_sessions().get(token_hash(token))
+    if entry is None:
+        return None
+    return entry['username'], entry['role']
+
+def revoke_session(token):
+    with SESSION_LOCK:
+        sessions = load_sessions()
+        found = sessions.pop(token_hash(token), None) is not None
+        save_sessions(sessions)
+    return found
+
 # ------------------ LICENSE SYSTEM ------------------
 
-# Load license records from file
+# Load license records from storage
 def load_licenses():
-    try:
-        with open(LICENSE_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return [] # Return empty list if no file exists
+    return get_backend().load_licenses()
 
-# Save license records to file
+# Save license records to storage
 def save_licenses(licenses):
-    with open(LICENSE_FILE, 'w') as f:
-        json.dump(licenses, f, indent=4)
+    get_backend().save_licenses(licenses)
+
+# ------------------ LICENSE STORE ------------------
+
+# Fields that get a secondary index (value -> licenses)
+INDEXED_FIELDS = ["software", "user", "assigned_device", "expiry_date"]
+
+# Licenses loaded once and kept in memory, indexed by license key and by
+# the fields in INDEXED_FIELDS so lookups don't scan the whole list.
+# Mutations only change memory; call save() to write them to disk.
+class LicenseStore:
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+        self.licenses = {}  # license_key -> license (keeps file order)
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        self.pending = []   # changes not yet written to disk
+        self.rejected = []  # pending changes the last save() couldn't write
+        # Kept in sync with every change through on_add()/on_remove(), and
+        # rebuilt in one go the first time they're used after a load, so
+        # commands that never search or report don't pay for building them
+        self.listeners = {"expiry": ExpiryIndex(), "search_index": SearchIndex(), "reports": ReportEngine()}
+        self.stale = set()
+        self.loading = False
+
+    # Keep another object in sync the same way (see license_watch.py)
+    def add_listener(self, name, listener):
+        self.listeners[name] = listener
+        self.stale.add(name)
+
+    # A listener, rebuilt first if a load has happened since its last use
+    def listener(self, name):
+        listener = self.listeners[name]
+        if name in self.stale:
+            self.stale.discard(name)
+            with gc_paused():
+                listener.rebuild(self.licenses.values())
+        return listener
+
+    @property
+    def expiry(self):
+        return self.listener("expiry")
+
+    @property
+    def search_index(self):
+        return self.listener("search_index")
+
+    @property
+    def reports(self):
+        return self.listener("reports")
+
+    @instrumented("store_load")
+    def load(self):
+        self.licenses = {}
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        self.pending = []
+        self.loading = True
+        try:
+            with self.backend.lock(), gc_paused():
+                for lic in self.backend.load_licenses():
+                    if lic['license_key'] in self.licenses:
+                        print(colored(f"Warning: duplicate license key '{lic['license_key']}' ignored.", "red"))
+                        continue
+                    self._insert(lic)
+                for rec in self.backend.read_changes():
+                    self._apply(rec)
+                self.pending = []
+        finally:
+            self.loading = False
+        self.stale = set(self.listeners)
+        if self.backend.needs_compaction():
+            self.compact()
+
+    # Catch up with changes other sessions have saved since we loaded.
+    # Record objects handed out earlier stay valid unless a full reload
+    # was needed.
+    @instrumented("store_refresh")
+    def refresh(self):
+        if self.pending:
+            return
+        changes = self.backend.new_changes()
+        if changes is None:
+            self.load()
+        else:
+            for rec in changes:
+                self._apply(rec)
+            self.pending = []
+
+    # Write pending changes; only the changes themselves are written.
+    # Other sessions may have saved in the meantime: their changes are
+    # merged in, and any of ours that collide with theirs are rejected.
+    # Returns False if some change was not saved; those changes are left in
+    # self.rejected.
+    @instrumented("store_save")
+    def save(self):
+        ok = True
+        self.rejected = []
+        if self.pending:
+            try:
+                with self.backend.lock():
+                    theirs = self.backend.new_changes()
+                    if theirs is None or self._overlaps(theirs):
+                        ok = self._rebase()
+                    elif theirs:
+                        mine = self.pending
+                        self.pending = []
+                        for rec in theirs:
+                            self._apply(rec)
+                        self.pending = mine
+                    if self.pending:
+                        # Feed first: after a crash in between, a feed entry
+                        # for a change that was never saved only makes a
+                        # consumer re-read that license
+                        append_change_feed(self.pending)
+                        self.backend.write_changes(self.pending, self)
+                    self.pending = []
+                    if self.backend.needs_compaction():
+                        self.compact()
+            except ValueError as e:
+                print(colored(f"Error: {e} Changes were not saved.", "red"))
+                self.rejected = self.pending
+                self.load()
+                return False
+        return ok
+
+    # True if other sessions' changes touch any license we changed
+    def _overlaps(self, theirs):
+        keys = set()
+        for rec in self.pending:
+            keys.add(rec['key'])
+            if rec['op'] == 'set' and rec['field'] == 'license_key':
+                keys.add(rec['value'])
+        for rec in theirs:
+            if rec.get('key') in keys:
+                return True
+            if rec['op'] == 'set' and rec['field'] == 'license_key' and rec['value'] in keys:
+                return True
+        return False
+
+    # Reload the current data and replay our pending changes on top of it.
+    # Each change carries the value it replaced, which acts as the record's
+    # version: if that field has since been changed to something else by
+    # another session, our change is rejected instead of overwriting theirs.
+    # Changes to other fields of the same license merge cleanly.
+    def _rebase(self):
+        mine = self.pending
+        self.load()
+        for rec in mine:
+            lic = self.licenses.get(rec['key'])
+            if rec['op'] == 'add':
+                if not self.add(rec['license']):
+                    print(colored(f"Conflict: license key '{rec['key']}' was added by another session.", "red"))
+                    self.rejected.append(rec)
+            elif rec['op'] == 'delete':
+                if lic is not None:
+                    self.delete(lic)
+            elif lic is None:
+                print(colored(f"Conflict: license '{rec['key']}' was deleted or renamed by another session.", "red"))
+                self.rejected.append(rec)
+            else:
+                current = lic.get(rec['field'])
+                if current == rec['value']:
+                    continue
+                if current != rec.get('old'):
+                    print(colored(f"Conflict: {rec['field'].replace('_', ' ')} of '{rec['key']}' was changed "
+                                  f"by another session (now: {current}). Your change was not saved.", "red"))
+                    self.rejected.append(rec)
+                elif not self.update(lic, rec['field'], rec['value']):
+                    print(colored(f"Conflict: license key '{rec['value']}' already exists.", "red"))
+                    self.rejected.append(rec)
+        return not self.rejected
+
+    # Fold logged changes into a new snapshot
+    def compact(self):
+        self.backend.compact(list(self.licenses.values()))
+
+    # Replay one journal record
+    def _apply(self, rec):
+        lic = self.licenses.get(rec.get('key'))
+        if rec['op'] == 'add':
+            self.add(rec['license'])
+        elif rec['op'] == 'set' and lic is not None:
+            self.update(lic, rec['field'], rec['value'])
+        elif rec['op'] == 'delete' and lic is not None:
+            self.delete(lic)
+
+    def __len__(self):
+        return len(self.licenses)
+
+    def __iter__(self):
+        return iter(list(self.licenses.values()))
+
+    # Software names are indexed lowercased for case-insensitive lookups
+    def _index_value(self, field, lic):
+        value = lic.get(field)
+        if field == "software" and isinstance(value, str):
+            value = value.lower()
+        return value
+
+    def _insert(self, lic):
+        self.licenses[lic['license_key']] = lic
+        self._index(lic)
+
+    def _remove(self, lic):
+        del self.licenses[lic['license_key']]
+        self._unindex(lic)
+
+    def _index(self, lic):
+        key = lic['license_key']
+        for field in INDEXED_FIELDS:
+            bucket = self.indexes[field].setdefault(self._index_value(field, lic), {})
+            bucket[key] = lic
+        if not self.loading:
+            for name, listener in self.listeners.items():
+                if name not in self.stale:
+                    listener.on_add(lic)
+
+    def _unindex(self, lic):
+        key = lic['license_key']
+        if not self.loading:
+            for name, listener in self.listeners.items():
+                if name not in self.stale:
+                    listener.on_remove(lic)
+        for field in INDEXED_FIELDS:
+            value = self._index_value(field, lic)
+            bucket = self.indexes[field].get(value)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self.indexes[field][value]
+
+    def get(self, key):
+        return self.licenses.get(key)
+
+    # Also asks the backend, which may know about keys added by other sessions
+    def has_key(self, key):
+        return key in self.licenses or self.backend.license_exists(key)
+
+    # Exact match on an indexed field
+    def find_by(self, field, value):
+        if field == "software":
+            value = value.lower()
+        return list(self.indexes[field].get(value, {}).values())
+
+    # Case-insensitive substring match on the software name
+    def search_software(self, keyword):
+        return self.search(keyword, fuzzy=False)
+
+    # Ranked search (see SearchIndex.search); returns licenses, best first
+    @instrumented("search", counter="hits")
+    def search(self, query, default_field="software", fuzzy=True):
+        keys = self.search_index.search(query, default_field, fuzzy)
+        return [self.licenses[key] for key in keys]
+
+    # Returns False if a license with the same key already exists. A plain
+    # dict is stored as a License.
+    def add(self, lic):
+        if lic['license_key'] in self.licenses:
+            return False
+        if not isinstance(lic, License):
+            lic = License.from_dict(lic)
+        self._insert(lic)
+        self.pending.append({"op": "add", "key": lic['license_key'], "license": lic})
+        return True
+
+    # Returns False if the change would duplicate another license key
+    def update(self, lic, field, value):
+        if field == "license_key" and value != lic['license_key'] and self.has_key(value):
+            return False
+        self.pending.append({"op": "set", "key": lic['license_key'], "field": field,
+                             "value": value, "old": lic.get(field)})
+        self._unindex(lic)
+        if field == "license_key" and value != lic['license_key']:
+            # A re-keyed license moves to the end, as if deleted and re-added
+            self.licenses[value] = self.licenses.pop(lic['license_key'])
+        lic[field] = value
+        self._index(lic)
+        return True
+
+    def delete(self, lic):
+        self.pending.append({"op": "delete", "key": lic['license_key']})
+        self._remove(lic)
+
+    # Move every license whose user or assigned_device equals old_value to
+    # new_value. Only memory changes, so the caller saves the whole batch in
+    # one write. Returns the moved licenses.
+    def reassign(self, field, old_value, new_value):
+        moved = self.find_by(field, old_value)
+        for lic in moved:
+            self.update(lic, field, new_value)
+        return moved
+
+    # Licenses assigned to a user that isn't in usernames
+    def orphans(self, usernames):
+        found = []
+        for user, bucket in self.indexes["user"].items():
+            if user not in usernames:
+                found.extend(bucket.values())
+        return found
+
+# ------------------ EXPIRY ENGINE ------------------
+
+# Expiry dates (kept as day ordinals by License) in sorted order, so expiry
+# questions are answered with a binary search instead of parsing every
+# license's date. ordinals and keys are parallel; entries with the same
+# date are ordered by key so one can be found again in O(log n).
+class ExpiryIndex:
+    def __init__(self):
+        self.ordinals = array('l')  # sorted expiry dates as date.toordinal()
+        self.keys = []              # license key for each ordinal
+        self.invalid = {}           # license_key -> license with a bad expiry date
+
+    def rebuild(self, licenses):
+        entries = []
+        self.invalid = {}
+        for lic in licenses:
+            ordinal = lic.ordinal('expiry_date')
+            if ordinal is None:
+                self.invalid[lic['license_key']] = lic
+            else:
+                entries.append((ordinal, lic['license_key']))
+        entries.sort()
+        self.ordinals = array('l', (ordinal for ordinal, key in entries))
+        self.keys = [key for ordinal, key in entries]
+
+    # Position of (ordinal, key) within the run of equal ordinals
+    def _position(self, ordinal, key):
+        lo = bisect.bisect_left(self.ordinals, ordinal)
+        hi = bisect.bisect_right(self.ordinals, ordinal, lo)
+        return bisect.bisect_left(self.keys, key, lo, hi)
+
+    def on_add(self, lic):
+        ordinal = lic.ordinal('expiry_date')
+        if ordinal is None:
+            self.invalid[lic['license_key']] = lic
+            return
+        pos = self._position(ordinal, lic['license_key'])
+        self.ordinals.insert(pos, ordinal)
+        self.keys.insert(pos, lic['license_key'])
+
+    def on_remove(self, lic):
+        ordinal = lic.ordinal('expiry_date')
+        if ordinal is None:
+            self.invalid.pop(lic['license_key'], None)
+            return
+        pos = self._position(ordinal, lic['license_key'])
+        if pos < len(self.keys) and self.keys[pos] == lic['license_key']:
+            del self.ordinals[pos]
+            del self.keys[pos]
+
+    # Keys expiring between two dates (inclusive), ordered by expiry date
+    @instrumented("expiry_query", counter="hits")
+    def between(self, start, end):
+        lo = bisect.bisect_left(self.ordinals, start.toordinal())
+        hi = bisect.bisect_right(self.ordinals, end.toordinal())
+        return self.keys[lo:hi]
+
+    # Keys that expired before the given day
+    @instrumented("expiry_query", counter="hits")
+    def expired(self, today):
+        return self.keys[:bisect.bisect_left(self.ordinals, today.toordinal())]
+
+    # Keys expiring from today up to and including today + days
+    def expiring_within(self, days, today):
+        return self.between(today, date.fromordinal(today.toordinal() + days))
+
+# ------------------ SEARCH INDEX ------------------
+
+# Fields covered by the search index, and the short names accepted in
+# "field:value" queries
+SEARCH_FIELDS = ["software", "license_key", "user", "assigned_device"]
+SEARCH_ALIASES = {"key": "license_key", "device": "assigned_device"}
+# Fields whose values repeat across licenses get trigrams for substring
+# and fuzzy matches. Keys and devices are close to unique per license,
+# where trigram sets would take several times the memory of the records
+# themselves: they match exactly or by prefix, from a sorted value list.
+GRAM_FIELDS = ["software", "user"]
+
+# Match scores: exact beats prefix beats substring beats fuzzy (< 1)
+SCORE_EXACT, SCORE_PREFIX, SCORE_SUBSTRING = 3.0, 2.0, 1.0
+FUZZY_CUTOFF = 0.6
+FUZZY_CANDIDATES = 50
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# Index over the distinct lowercased values of SEARCH_FIELDS. In
+# GRAM_FIELDS, substring matches only look at values holding every
+# trigram of the query, and fuzzy matches only at values sharing the most
+# trigrams with it; the other fields are searched by bisecting their
+# sorted values. A search never walks the whole inventory.
+class SearchIndex:
+    def __init__(self):
+        self.values = {field: {} for field in SEARCH_FIELDS}  # value -> {license_key: True}
+        self.grams = {field: {} for field in GRAM_FIELDS}     # trigram -> set of values
+        self.sorted = {field: [] for field in SEARCH_FIELDS if field not in GRAM_FIELDS}
+        self.building = False
+
+    # The sorted lists are filled in one sort at the end rather than by
+    # inserting value by value
+    def rebuild(self, licenses):
+        self.__init__()
+        self.building = True
+        for lic in licenses:
+            self.on_add(lic)
+        self.building = False
+        for field in self.sorted:
+            self.sorted[field] = sorted(self.values[field])
+
+    def on_add(self, lic):
+        for field in SEARCH_FIELDS:
+            if lic.get(field) is None:
+                continue
+            value = str(lic[field]).lower()
+            keys = self.values[field].get(value)
+            if keys is None:
+                keys = self.values[field][value] = {}
+                if field in self.grams:
+                    # Padded so short values and word starts get trigrams too
+                    for gram in trigrams(f" {value} "):
+                        self.grams[field].setdefault(gram, set()).add(value)
+                elif not self.building:
+                    bisect.insort(self.sorted[field], value)
+            keys[lic['license_key']] = True
+
+    def on_remove(self, lic):
+        for field in SEARCH_FIELDS:
+            if lic.get(field) is None:
+                continue
+            value = str(lic[field]).lower()
+            keys = self.values[field].get(value)
+            if keys is None:
+                continue
+            keys.pop(lic['license_key'], None)
+            if not keys:
+                del self.values[field][value]
+                if field not in self.grams:
+                    ordered = self.sorted[field]
+                    i = bisect.bisect_left(ordered, value)
+                    if i < len(ordered) and ordered[i] == value:
+                        del ordered[i]
+                    continue
+                for gram in trigrams(f" {value} "):
+                    values = self.grams[field].get(gram)
+                    if values is not None:
+                        values.discard(value)
+                        if not values:
+                            del self.grams[field][gram]
+
+    # Scores for the distinct values of one field matching text
+    def _match_values(self, field, text, fuzzy):
+        values = self.values[field]
+        matches = {}
+        if text in values:
+            matches[text] = SCORE_EXACT
+
+        if field not in self.grams:
+            ordered = self.sorted[field]
+            for i in range(bisect.bisect_left(ordered, text), len(ordered)):
+                if not ordered[i].startswith(text):
+                    break
+                matches.setdefault(ordered[i], SCORE_PREFIX)
+            return matches
+
+        query_grams = trigrams(text)
+        if query_grams:
+            candidates = None
+            for gram in sorted(query_grams, key=lambda g: len(self.grams[field].get(g, ()))):
+                found = self.grams[field].get(gram, set())
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    break
+        else:
+            candidates = values  # query too short for trigrams
+        for value in candidates or ():
+            if value not in matches and text in value:
+                matches[value] = SCORE_PREFIX if value.startswith(text) else SCORE_SUBSTRING
+
+        if fuzzy and not matches:
+            overlap = {}
+            for gram in trigrams(f" {text} "):
+                for value in self.grams[field].get(gram, ()):
+                    overlap[value] = overlap.get(value, 0) + 1
+            best = sorted(overlap, key=overlap.get, reverse=True)[:FUZZY_CANDIDATES]
+            for value in best:
+                ratio = difflib.SequenceMatcher(None, text, value).ratio()
+                if ratio >= FUZZY_CUTOFF:
+                    matches[value] = ratio * 0.9
+        return matches
+
+    # license_key -> score for one term, keeping each license's best field
+    def _match_term(self, field, text, fuzzy):
+        fields = SEARCH_FIELDS if field is None else [field]
+        scores = {}
+        for field in fields:
+            for value, score in self._match_values(field, text, fuzzy).items():
+                for key in self.values[field][value]:
+                    if score > scores.get(key, 0):
+                        scores[key] = score
+        return scores
+
+    # Split a query into (field, text) terms. "user:JunLorenz software:mat"
+    # gives two terms; text without a field prefix is one term searched in
+    # default_field (every field if None).
+    def parse_query(self, query, default_field):
+        try:
+            tokens = shlex.split(query)
+        except ValueError:
+            tokens = query.split()
+        terms = []
+        plain = []
+        for token in tokens:
+            name, sep, text = token.partition(":")
+            name = SEARCH_ALIASES.get(name.lower(), name.lower())
+            if sep and name in SEARCH_FIELDS and text:
+                terms.append((name, text.lower()))
+            else:
+                plain.append(token)
+        if plain:
+            terms.append((default_field, " ".join(plain).lower()))
+        return terms
+
+    # License keys matching every term of the query, best score first.
+    # Fuzzy matches are only tried for terms with no exact/substring hit.
+    def search(self, query, default_field="software", fuzzy=True):
+        scores = None
+        for field, text in self.parse_query(query, default_field):
+            term_scores = self._match_term(field, text, fuzzy)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: scores[key] + term_scores[key] for key in scores if key in term_scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda key: -scores[key]) if scores else []
+
+# ------------------ REPORTS ------------------
+
+# Report groupings: name -> license field
+REPORT_GROUPS = {"software": "software", "user": "user", "device": "assigned_device"}
+# Aggregate columns kept per group, in report order
+REPORT_COLUMNS = ["licenses", "seats_used", "seats_limit", "over_limit", "idle"]
+# Licenses expiring within this many days count as "near expiry"
+REPORT_EXPIRY_DAYS = 30
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+# Per-software, per-user and per-device totals of REPORT_COLUMNS, kept up
+# to date as licenses change (a change is an on_remove of the old record
+# followed by an on_add of the new one), so a report costs one pass over
+# the groups rather than over every license.
+class ReportEngine:
+    def __init__(self):
+        self.groups = {name: {} for name in REPORT_GROUPS}  # name -> value -> [REPORT_COLUMNS]
+        self.totals = [0] * len(REPORT_COLUMNS)
+        self.over_limit = {}  # license_key -> license using more seats than its limit
+
+    def rebuild(self, licenses):
+        self.__init__()
+        for lic in licenses:
+            self.on_add(lic)
+
+    def _change(self, lic, sign):
+        used = as_int(lic.get('current_usage'))
+        limit = as_int(lic.get('usage_limit'))
+        row = [1, used, limit, used > limit, used == 0]
+        for n, value in enumerate(row):
+            self.totals[n] += sign * value
+        for name, field in REPORT_GROUPS.items():
+            group = self.groups[name]
+            totals = group.get(lic.get(field))
+            if totals is None:
+                totals = group[lic.get(field)] = [0] * len(REPORT_COLUMNS)
+            for n, value in enumerate(row):
+                totals[n] += sign * value
+            if totals[0] == 0:
+                del group[lic.get(field)]
+        if used > limit:
+            if sign > 0:
+                self.over_limit[lic['license_key']] = lic
+            else:
+                self.over_limit.pop(lic['license_key'], None)
+
+    def on_add(self, lic):
+        self._change(lic, 1)
+
+    def on_remove(self, lic):
+        self._change(lic, -1)
+
+# Build a report grouped by "software", "user" or "device". Each group
+# gets REPORT_COLUMNS plus utilization (% of seats used) and the number
+# of licenses expiring within `days`. Also lists over-limit and
+# near-expiry licenses.
+@instrumented("report")
+def build_report(store, by="software", days=REPORT_EXPIRY_DAYS, today=None):
+    if by not in REPORT_GROUPS:
+        raise ValueError(f"Unknown report grouping '{by}'")
+    today = today or datetime.now().date()
+    field = REPORT_GROUPS[by]
+    expiring = [store.get(key) for key in store.expiry.expiring_within(days, today)]
+    expiring_by_group = {}
+    for lic in expiring:
+        expiring_by_group[lic.get(field)] = expiring_by_group.get(lic.get(field), 0) + 1
+
+    def row(name, totals, expiring_count):
+        entry = {by: name, **dict(zip(REPORT_COLUMNS, totals))}
+        entry["utilization"] = round(100 * totals[1] / totals[2], 1) if totals[2] else None
+        entry["expiring"] = expiring_count
+        return entry
+
+    groups = store.reports.groups[by]
+    rows = [row(name, totals, expiring_by_group.get(name, 0))
+            for name, totals in sorted(groups.items(), key=lambda item: str(item[0]).lower())]
+    brief = ["software", "license_key", "user", "current_usage", "usage_limit", "expiry_date"]
+    return {
+        "by": by,
+        "date": today.isoformat(),
+        "expiry_days": days,
+        "groups": rows,
+        "totals": row("TOTAL", store.reports.totals, len(expiring)),
+        "over_limit": [{f: lic.get(f) for f in brief} for lic in store.reports.over_limit.values()],
+        "expiring": [{f: lic.get(f) for f in brief} for lic in expiring],
+    }
+
+# Render a report as "table", "json" or "csv" text. CSV has the group
+# rows and a TOTAL row only.
+def format_report(report, fmt="table"):
+    columns = [report["by"]] + REPORT_COLUMNS + ["utilization", "expiring"]
+    rows = report["groups"] + [report["totals"]]
+    if fmt == "json":
+        return json.dumps(report, indent=4)
+    if fmt == "csv":
+        import csv
+        import io
+
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+    if fmt != "table":
+        raise ValueError(f"Unknown report format '{fmt}'")
+
+    def cell(value):
+        return "-" if value is None else str(value)
+
+    widths = [max(len(c), *(len(cell(r[c])) for r in rows)) for c in columns]
+    rule = "  ".join("-" * w for w in widths)
+    lines = ["  ".join(c.replace("_", " ").title().ljust(w) for c, w in zip(columns, widths)).rstrip(), rule]
+    for r in rows:
+        if r is report["totals"]:
+            lines.append(rule)
+        lines.append("  ".join(cell(r[c]).ljust(w) for c, w in zip(columns, widths)).rstrip())
+
+    for title, licenses in [("Over Limit", report["over_limit"]),
+                            (f"Expiring Within {report['expiry_days']} Days", report["expiring"])]:
+        lines.append(f"\n--- {title} ({len(licenses)}) ---")
+        for lic in licenses:
+            lines.append(f"{lic['software']} - Key: {lic['license_key']} (User: {lic['user']}, "
+                         f"Usage: {lic['current_usage']}/{lic['usage_limit']}, Expires: {lic['expiry_date']})")
+    return "\n".join(lines) + "\n"
+
+# ------------------ LICENSE BROWSER ------------------
+
+# Licenses shown per page by the browser
+PAGE_SIZE = 20
+# Browser sort orders; "added" is the order licenses were added in
+BROWSER_SORTS = ["added", "software", "user", "expiry"]
+
+# Page-at-a-time view of the store, used to list licenses and to pick one
+# for editing or deleting. Only the license keys are put in order up
+# front (from the store's indexes, no per-license sorting); rows are
+# formatted a page at a time and written with a single write per page.
+class LicenseBrowser:
+    def __init__(self, store, sort="added", query=""):
+        self.store = store
+        self.sort = sort
+        self.query = query
+        self.page = 0
+        self.keys = self._ordered_keys()
+
+    def _ordered_keys(self):
+        store = self.store
+        if self.sort == "expiry":
+            keys = store.expiry.keys + list(store.expiry.invalid)
+        elif self.sort in ["software", "user"]:
+            index = store.indexes[self.sort]
+            keys = []
+            for value in sorted(index, key=lambda v: str(v).lower()):
+                keys.extend(index[value])
+        else:
+            keys = list(store.licenses)
+
+        if self.query:
+            matches = {lic['license_key'] for lic in find_licenses(store, self.query)}
+            keys = [key for key in keys if key in matches]
+        return keys
+
+    def pages(self):
+        return max(1, -(-len(self.keys) // PAGE_SIZE))
+
+    def set_view(self, sort=None, query=None):
+        if sort is not None:
+            self.sort = sort
+        if query is not None:
+            self.query = query
+        self.page = 0
+        self.keys = self._ordered_keys()
+
+    def show(self):
+        start = self.page * PAGE_SIZE
+        heading = f"\n--- Licenses (page {self.page + 1}/{self.pages()}, {len(self.keys)} total, sorted by {self.sort}"
+        if self.query:
+            heading += f", filter '{self.query}'"
+        lines = [heading + ") ---"]
+        for i, key in enumerate(self.keys[start:start + PAGE_SIZE], start + 1):
+            lic = self.store.get(key)
+            lines.append(f"{i}. {lic['software']} - Key: {lic['license_key']} (User: {lic['user']}, Expires: {lic['expiry_date']})")
+        if not self.keys:
+            lines.append("No licenses found.")
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    # Interactive paging. Returns the chosen license when pick is set (a
+    # bare number selects that row), otherwise None; a bare number then
+    # jumps to that page.
+    def run(self, pick=False):
+        while True:
+            self.show()
+            if not pick and self.pages() == 1 and not self.query and self.sort == "added":
+                return None
+
+            number = "N = select row" if pick else "N = go to page"
+            command = input(f"[Enter] next, [p] previous, [{number}], [g N] go to page, "
+                            f"[s {'/'.join(BROWSER_SORTS)}] sort, [f TEXT] filter, [q] quit: ").strip()
+            action, _, arg = command.partition(" ")
+            arg = arg.strip()
+            action = action.lower()
+
+            if action == "":
+                if self.page == self.pages() - 1 and not pick:
+                    return None  # Enter on the last page closes the view
+                self.page = min(self.page + 1, self.pages() - 1)
+            elif action == "p":
+                self.page = max(self.page - 1, 0)
+            elif action == "q":
+                return None
+            elif action == "s" and arg.lower() in BROWSER_SORTS:
+                self.set_view(sort=arg.lower())
+            elif action == "f":
+                self.set_view(query=arg)
+            elif action == "g" and arg.isdigit():
+                self.page = min(max(int(arg), 1), self.pages()) - 1
+            elif action.isdigit() and not arg:
+                choice = int(action)
+                if not pick:
+                    self.page = min(max(choice, 1), self.pages()) - 1
+                elif 1 <= choice <= len(self.keys):
+                    return self.store.get(self.keys[choice - 1])
+                else:
+                    print(colored(f"Please enter a number between 1 and {len(self.keys)}.", "red"))
+            else:
+                print(colored("Invalid command.", "red"))
+
+# Let the user find and choose one license through the browser
+def pick_license(store, action):
+    query = input(f"\nFilter licenses to {action} (software name, field:value, or blank for all): ").strip()
+    browser = LicenseBrowser(store, query=query)
+    if not browser.keys:
+        print(colored("No matching license found.", "red"))
+        return None
+    return browser.run(pick=True)
+
+_store = None
+
+# Shared store, loaded from disk on first use
+def get_store():
+    global _store
+    if _store is None:
+        _store = LicenseStore()
+        _store.load()
+    else:
+        _store.refresh()
+    return _store
 
 # Add a new software license to the system  
 def add_license():
+    store = get_store()
     while True:
-        licenses = load_licenses()
-        users = load_users()  # Load users for validation
-        
         print("\n--- Add New License ---")
         
         # Collect license details from user
@@ -161,8 +2308,7 @@ def add_license():
         # Validate assigned user exists in users.json
         while True:
             assigned_user = validate_input("Assigned To (Username): ")
-            user_exists = any(user['username'] == assigned_user for user in users)
-            if user_exists:
+            if find_user(assigned_user) is not None:
                 license["user"] = assigned_user
                 break
             print(colored(f"Error: User '{assigned_user}' not found in system. Please enter a valid username.", "red"))
@@ -171,11 +2317,9 @@ def add_license():
         def validate_date(prompt):
             while True:
                 date_str = validate_input(prompt)
-                try:
-                    datetime.strptime(date_str, "%Y-%m-%d")
+                if parse_date(date_str):
                     return date_str
-                except ValueError:
-                    print(colored("Error: Invalid date format. Please use YYYY-MM-DD format (e.g., 2023-12-31)", "red"))
+                print(colored("Error: Invalid date format. Please use YYYY-MM-DD format (e.g., 2023-12-31)", "red"))
         
         # Get and validate install date
         license["install_date"] = validate_date("Install Date (YYYY-MM-DD): ")
@@ -183,8 +2327,8 @@ def add_license():
         # Get and validate expiry date (must be after install date)
         while True:
             license["expiry_date"] = validate_date("Expiry Date (YYYY-MM-DD): ")
-            install_date = datetime.strptime(license["install_date"], "%Y-%m-%d")
-            expiry_date = datetime.strptime(license["expiry_date"], "%Y-%m-%d")
+            install_date = parse_date(license["install_date"])
+            expiry_date = parse_date(license["expiry_date"])
             
             if expiry_date <= install_date:
                 print(colored("Error: Expiry date must be after install date.", "red"))
@@ -210,11 +2354,9 @@ def add_license():
             print(colored("License not saved.", "red"))
         else:
             # Check if license already exists
-            if any(lic['license_key'] == license['license_key'] for lic in licenses):
+            if not store.add(license):
                 print(colored("License with this key already exists!", "red"))
-            else:
-                licenses.append(license)
-                save_licenses(licenses)
+            elif store.save():
                 print(colored("License added successfully!", "green"))
 
         # Ask user if they want to add more licenses
@@ -223,112 +2365,157 @@ def add_license():
 
 # Display all licenses
 def view_licenses():
-    licenses = load_licenses()
-    if not licenses:
+    store = get_store()
+    if not store:
         print(colored("\nNo licenses found in the system.", "red"))
         return
 
-    print("\n--- All Licenses ---")
-    for i, lic in enumerate(licenses, 1):
-        print(f"{i}. {lic['software']} - Key: {lic['license_key']} (User: {lic['user']})")
+    LicenseBrowser(store).run()
 
 # Search licenses by software name
 def search_license():
-    licenses = load_licenses()
-    if not licenses:
+    store = get_store()
+    if not store:
         print(colored("\nNo licenses found in the system.", "red"))
         return
 
-    # Convert user input to lowercase for case-insensitive search
-    keyword = validate_input("\nEnter software name to search: ").strip().lower()
-    found = [lic for lic in licenses if keyword in lic['software'].lower()]
+    # Search is case-insensitive; field:value terms narrow it down
+    keyword = validate_input("\nEnter software name to search (or e.g. user:JunLorenz software:mat): ").strip()
+    found = find_licenses(store, keyword)
     
     if found:
         print("\n--- Search Results ---")
         for lic in found:
-            print(json.dumps(lic, indent=4))
+            print(json.dumps(lic, indent=4, default=json_default))
     else:
         print(colored("No license found.", "red"))
 
+# Ranked search that falls back to close (fuzzy) matches, with a notice,
+# when nothing contains the query
+def find_licenses(store, query):
+    found = store.search(query, fuzzy=False)
+    if not found:
+        found = store.search(query)
+        if found:
+            print(colored("No exact match. Closest matches:", "yellow"))
+    return found
+
 # Check and display expired licenses
 def check_expired():
-    licenses = load_licenses()
-    if not licenses:
+    store = get_store()
+    if not store:
         print(colored("\nNo licenses found in the system.", "red"))
         return
 
     today = datetime.now().date()
     print("\n--- Expired Licenses ---")
-    expired_found = False
+    expired = [store.get(key) for key in store.expiry.expired(today)]
 
-    for lic in licenses:
-        try:
-            expiry = datetime.strptime(lic['expiry_date'], "%Y-%m-%d").date()
-            if expiry < today:
-                lic['status'] = 'expired' # Update status to expired
-                print(f"{lic['software']} expired on {lic['expiry_date']}")
-                expired_found = True
-        except ValueError:
-            print(f"Invalid date format for {lic['software']}")
+    changed = False
+    for lic in expired:
+        if lic['status'] != 'expired':
+            store.update(lic, 'status', 'expired') # Update status to expired
+            changed = True
+        print(f"{lic['software']} expired on {lic['expiry_date']}")
 
-    if not expired_found:
+    for lic in store.expiry.invalid.values():
+        print(f"Invalid date format for {lic['software']}")
+
+    if not expired:
         print(colored("No expired licenses found.", "red"))
 
-    save_licenses(licenses) # Save any status changes
+    if changed:
+        store.save() # Save only the licenses whose status changed
+
+# Print licenses found by an expiry query, soonest first
+def print_expiry_results(store, keys, title):
+    print(f"\n--- {title} ---")
+    if not keys:
+        print(colored("No licenses found.", "red"))
+        return
+    for key in keys:
+        lic = store.get(key)
+        print(f"{lic['expiry_date']}  {lic['software']} - Key: {lic['license_key']} (User: {lic['user']})")
+
+# Upcoming and past expirations over a date range
+def expiry_queries():
+    store = get_store()
+    if not store:
+        print(colored("\nNo licenses found in the system.", "red"))
+        return
+
+    print("\n[1] Licenses expiring in the next N days")
+    print("[2] Licenses that expired between two dates")
+    choice = validate_input("Enter your choice: ", is_number=True)
+
+    if choice == 1:
+        days = validate_input("Number of days: ", is_number=True)
+        keys = store.expiry.expiring_within(days, datetime.now().date())
+        print_expiry_results(store, keys, f"Expiring in the Next {days} Days")
+    elif choice == 2:
+        start = parse_date(validate_input("From date (YYYY-MM-DD): "))
+        end = parse_date(validate_input("To date (YYYY-MM-DD): "))
+        if start is None or end is None:
+            print(colored("Invalid date format! Use YYYY-MM-DD.", "red"))
+            return
+        keys = store.expiry.between(start, end)
+        print_expiry_results(store, keys, f"Expired Between {start} and {end}")
+    else:
+        print(colored("Invalid choice. Please enter 1 or 2.", "red"))
 
 # Update the usage count for a specific software
 def update_usage_count():
-    licenses = load_licenses()
-    if not licenses:
+    store = get_store()
+    if not store:
         print(colored("\nNo licenses found in the system.", "red"))
         return
 
-    software = validate_input("\nEnter software name to update usage: ").strip().lower()
-    found = False
-
-    for lic in licenses:
-        # Compare with lowercase version of stored software name
-        if software in lic['software'].lower():
-            new_usage = validate_input("New usage count: ", is_number=True)
-            lic['current_usage'] = new_usage
-            save_licenses(licenses)
-            print("Usage updated.")
-            found = True
-            break
+    software = validate_input("\nEnter software name to update usage: ").strip()
+    found = find_licenses(store, software)
 
     if not found:
         print(colored("Software not found.", "red"))
+        return
+
+    # Make the user pick when the name matches more than one license
+    lic = found[0]
+    if len(found) > 1:
+        print("\n--- Matching Licenses ---")
+        for i, match in enumerate(found, 1):
+            print(f"{i}. {match['software']} (Key: {match['license_key']}, Usage: {match['current_usage']})")
+        choice = validate_input("\nSelect license to update (number): ", is_number=True)
+        if choice < 1 or choice > len(found):
+            print(colored("Invalid selection.", "red"))
+            return
+        lic = found[choice-1]
+
+    new_usage = validate_input("New usage count: ", is_number=True)
+    store.update(lic, 'current_usage', new_usage)
+    if store.save():
+        print("Usage updated.")
 
 def edit_license():
-    licenses = load_licenses()
-    if not licenses:
+    store = get_store()
+    if not store:
         print(colored("\nNo licenses found in the system.", "red"))
         return
 
-    # Search for licenses (case-insensitive)
-    keyword = validate_input("\nEnter software name to edit: ").strip().lower()
-    found = [lic for lic in licenses if keyword in lic['software'].lower()]
-    
-    if not found:
-        print(colored("No licenses found with that name.", "red"))
-        return
-    
-    # Display matching licenses
-    print("\n--- Matching Licenses ---")
-    for i, lic in enumerate(found, 1):
-        print(f"{i}. {lic['software']} (Key: {lic['license_key']})")
-    
     # Select license to edit
-    choice = validate_input("\nSelect license to edit (number): ", is_number=True)
-    if choice < 1 or choice > len(found):
-        print(colored("Invalid selection.", "red"))
+    selected = pick_license(store, "edit")
+    if selected is None:
         return
     
-    license_to_edit = found[choice-1]
-    original_key = license_to_edit['license_key']
+    license_key = selected['license_key']
 
     # Continuous editing loop
     while True:
+        # Pick up changes other sessions saved while we were editing
+        store.refresh()
+        license_to_edit = store.get(license_key)
+        if license_to_edit is None:
+            print(colored("This license was deleted by another session.", "red"))
+            return
+
         # Display editable fields
         print("\n--- Editable Fields ---")
         fields = [
@@ -349,111 +2536,1258 @@ def edit_license():
         field_name = fields[field_choice-1]
         new_value = validate_input(f"Enter new {field_name.replace('_', ' ')} (current: {license_to_edit[field_name]}): ")
 
-        # Special validation for key fields
-        if field_name == "license_key" and new_value != original_key:
-            if any(lic['license_key'] == new_value for lic in licenses):
-                print(colored("Error: This license key already exists!", "red"))
-                continue
-
-        # Validate date formats
-        if field_name in ["install_date", "expiry_date"]:
-            try:
-                datetime.strptime(new_value, "%Y-%m-%d")
-            except ValueError:
-                print(colored("Invalid date format! Use YYYY-MM-DD.", "red"))
-                continue
-
-        # Validate number fields
-        if field_name in ["usage_limit", "current_usage"]:
-            if not new_value.isdigit():
-                print(colored("Error: Must be a number!", "red"))
-                continue
-            new_value = int(new_value)
-
-        # Validate status field
-        if field_name == "status":
-            if new_value.lower() not in ["active", "expired"]:
-                print(colored("Error: Status must be 'active' or 'expired'", "red"))
-                continue
-            new_value = new_value.lower()
+        new_value, error = check_field_value(store, license_to_edit, field_name, new_value)
+        if error:
+            print(colored(error, "red"))
+            continue
 
         # Update and save
-        license_to_edit[field_name] = new_value
-        save_licenses(licenses)
-        print(colored("License updated successfully!", "green"))
+        store.update(license_to_edit, field_name, new_value)
+        if store.save():
+            if field_name == "license_key":
+                license_key = new_value
+            print(colored("License updated successfully!", "green"))
 
         # Ask for another edit
         if input("\nEdit another field? (y/n): ").lower() != 'y':
             break
 
+# Validate a new value for one field of a license, converting it to the
+# stored type. Returns (value, error); error is None if the value is fine.
+def check_field_value(store, lic, field_name, new_value):
+    # Special validation for key fields
+    if field_name == "license_key" and new_value != lic['license_key']:
+        if store.has_key(new_value):
+            return new_value, "Error: This license key already exists!"
+
+    # Licenses may only be assigned to registered users
+    if field_name == "user" and new_value != lic['user'] and find_user(new_value) is None:
+        return new_value, f"Error: User '{new_value}' not found in system."
+
+    # Validate date formats
+    if field_name in ["install_date", "expiry_date"]:
+        if parse_date(new_value) is None:
+            return new_value, "Invalid date format! Use YYYY-MM-DD."
+
+    # Validate number fields
+    if field_name in ["usage_limit", "current_usage"]:
+        if not new_value.isdigit():
+            return new_value, "Error: Must be a number!"
+        new_value = int(new_value)
+
+    # Validate status field
+    if field_name == "status":
+        if new_value.lower() not in ["active", "expired"]:
+            return new_value, "Error: Status must be 'active' or 'expired'"
+        new_value = new_value.lower()
+
+    return new_value, None
+
 # Delete license entries based on software name
 def delete_license():
-    licenses = load_licenses()
-    if not licenses:
-        print(colored("\nNo licenses found in the system.", "orange"))
+    store = get_store()
+    if not store:
+        print(colored("\nNo licenses found in the system.", "red"))
         return
 
-    view_licenses()
-    software = validate_input("\nEnter software name to delete: ").strip().lower()
-    # Find all matching licenses (case-insensitive)
-    matching_licenses = [lic for lic in licenses if software in lic['software'].lower()]
-
-    if not matching_licenses:
-        print(colored("No matching license found.", "orange"))
+    lic = pick_license(store, "delete")
+    if lic is None:
         return
 
-    if len(matching_licenses) == 1:
-        # If only one match, show details and confirm deletion
-        lic = matching_licenses[0]
-        print("\n--- Matching License ---")
-        print(f"Software: {lic['software']}")
-        print(f"License Key: {lic['license_key']}")
-        print(f"Assigned To: {lic['user']}")
-        print(f"Expiry Date: {lic['expiry_date']}")
-        
-        confirm = validate_input("\nAre you sure you want to delete this license? (y/n): ").lower()
-        if confirm == 'y':
-            licenses.remove(lic)
-            save_licenses(licenses)
+    print("\n--- Selected License ---")
+    print(f"Software: {lic['software']}")
+    print(f"License Key: {lic['license_key']}")
+    print(f"Assigned To: {lic['user']}")
+    print(f"Expiry Date: {lic['expiry_date']}")
+
+    confirm = validate_input("\nAre you sure you want to delete this license? (y/n): ").lower()
+    if confirm == 'y':
+        store.delete(lic)
+        if store.save():
             print(colored("License deleted successfully!", "green"))
+
+# Print the licenses a user holds or a device has, one per line
+def print_holdings(licenses, title):
+    print(f"\n--- {title} ---")
+    for lic in licenses:
+        print(f"{lic['software']} - Key: {lic['license_key']} (User: {lic['user']}, Device: {lic['assigned_device']})")
+
+# Offboarding: hand all of a user's licenses to someone else, free the
+# licenses of a retired device, or find licenses of users that no longer
+# exist. Each move is saved as one write.
+def reassign_licenses():
+    store = get_store()
+    if not store:
+        print(colored("\nNo licenses found in the system.", "red"))
+        return
+
+    print("\n[1] Move all licenses of a user to another user")
+    print("[2] Retire a device")
+    print("[3] Find licenses of unknown users")
+    choice = validate_input("Enter your choice: ", is_number=True)
+
+    if choice == 1:
+        old_user = validate_input("Move licenses from (Username): ")
+        held = store.find_by("user", old_user)
+        if not held:
+            print(colored(f"User '{old_user}' holds no licenses.", "red"))
+            return
+        print_holdings(held, f"{len(held)} License(s) Held by {old_user}")
+        new_user = validate_input("Move them to (Username): ")
+        if new_user == old_user:
+            print(colored("Error: Choose a different user.", "red"))
+            return
+        if find_user(new_user) is None:
+            print(colored(f"Error: User '{new_user}' not found in system. Please enter a valid username.", "red"))
+            return
+        field, old_value, new_value = "user", old_user, new_user
+    elif choice == 2:
+        device = validate_input("Device to retire: ")
+        held = store.find_by("assigned_device", device)
+        if not held:
+            print(colored(f"No licenses are assigned to '{device}'.", "red"))
+            return
+        print_holdings(held, f"{len(held)} License(s) on {device}")
+        new_device = input("Move them to device (blank to leave unassigned): ").strip()
+        if new_device == device:
+            print(colored("Error: Choose a different device.", "red"))
+            return
+        field, old_value, new_value = "assigned_device", device, new_device
+    elif choice == 3:
+        orphans = store.orphans({user['username'] for user in load_users()})
+        if not orphans:
+            print(colored("Every license is assigned to a registered user.", "green"))
+            return
+        print_holdings(orphans, f"{len(orphans)} License(s) of Unknown Users")
+        print("Use option 1 to move them to a registered user.")
+        return
     else:
-        # If multiple matches, show list and let user choose
-        print("\n--- Multiple Matching Licenses ---")
-        for i, lic in enumerate(matching_licenses, 1):
-            print(f"\n{i}. Software: {lic['software']}")
-            print(f"   License Key: {lic['license_key']}")
-            print(f"   Assigned To: {lic['user']}")
-            print(f"   Expiry Date: {lic['expiry_date']}")
+        print(colored("Invalid choice. Please enter 1, 2 or 3.", "red"))
+        return
 
-        while True:
-            choice = validate_input("\nEnter the number of the license to delete (or 0 to cancel): ", is_number=True)
-            if choice == 0:
-                return
-            if 1 <= choice <= len(matching_licenses):
-                selected_license = matching_licenses[choice-1]
-                confirm = validate_input(f"Are you sure you want to delete license '{selected_license['software']}' (Key: {selected_license['license_key']})? (y/n): ").lower()
-                if confirm == 'y':
-                    licenses.remove(selected_license)
-                    save_licenses(licenses)
-                    print(colored("License deleted successfully!", "green"))
-                break
+    confirm = validate_input(f"\nMove {len(held)} license(s)? (y/n): ").lower()
+    if confirm != 'y':
+        print(colored("Nothing was changed.", "red"))
+        return
+    moved = store.reassign(field, old_value, new_value)
+    if store.save():
+        print(colored(f"{len(moved)} license(s) moved.", "green"))
+
+# Utilization and compliance report, shown on screen or saved to a file
+def usage_report():
+    store = get_store()
+    if not store:
+        print(colored("\nNo licenses found in the system.", "red"))
+        return
+
+    by = input("Group by (software/user/device) [software]: ").strip().lower() or "software"
+    fmt = input("Format (table/json/csv) [table]: ").strip().lower() or "table"
+    if by not in REPORT_GROUPS or fmt not in ["table", "json", "csv"]:
+        print(colored("Error: Unknown grouping or format.", "red"))
+        return
+
+    text = format_report(build_report(store, by), fmt)
+    if fmt == "table":
+        print("\n--- License Report by " + by.title() + " ---")
+        print(text)
+    else:
+        path = "license_report." + fmt
+        with open(path, "w", newline='') as f:
+            f.write(text)
+        print(colored(f"Report saved to {path}", "green"))
+
+# ------------------ USAGE METER ------------------
+
+# Days of usage history kept per license
+USAGE_HISTORY_DAYS = 90
+# Pending usage changes are written once this many seconds have passed
+# or this many events have been recorded, whichever comes first
+USAGE_FLUSH_SECONDS = 5
+USAGE_FLUSH_EVENTS = 10000
+
+# Per-day counters kept by UsageHistory, in slot order after the day
+USAGE_COUNTERS = ["checkouts", "checkins", "denied", "peak"]
+USAGE_SLOT = 1 + len(USAGE_COUNTERS)
+
+# Rolling daily usage per license. Each license with activity gets one
+# flat array('l') ring buffer of USAGE_HISTORY_DAYS slots; a slot holds
+# the day ordinal followed by USAGE_COUNTERS, and is reused when the same
+# position comes round again on a later day.
+class UsageHistory:
+    def __init__(self, days=USAGE_HISTORY_DAYS):
+        self.days = days
+        self.buffers = {}  # license_key -> array('l')
+
+    # Add counts for one license and day ("peak" keeps the maximum).
+    # Days older than what the buffer already holds for that slot are dropped.
+    def record(self, key, day, counts):
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = array('l', [0]) * (self.days * USAGE_SLOT)
+        i = (day % self.days) * USAGE_SLOT
+        if buf[i] > day:
+            return
+        if buf[i] < day:
+            buf[i:i + USAGE_SLOT] = array('l', [day] + [0] * len(USAGE_COUNTERS))
+        for n, name in enumerate(USAGE_COUNTERS, 1):
+            if name == "peak":
+                buf[i + n] = max(buf[i + n], counts.get(name, 0))
             else:
-                print(colored(f"Please enter a number between 1 and {len(matching_licenses)} or 0 to cancel.", "red"))
+                buf[i + n] += counts.get(name, 0)
+
+    # Recorded days for a license, oldest first, as dicts with "date" and
+    # USAGE_COUNTERS
+    def days_for(self, key, today=None):
+        today = (today or date.today()).toordinal()
+        buf = self.buffers.get(key)
+        rows = []
+        if buf is None:
+            return rows
+        for i in range(0, len(buf), USAGE_SLOT):
+            day = buf[i]
+            if today - self.days < day <= today:
+                rows.append((day, buf[i + 1:i + USAGE_SLOT]))
+        rows.sort()
+        return [{"date": date.fromordinal(day).isoformat(), **dict(zip(USAGE_COUNTERS, counts))}
+                for day, counts in rows]
+
+    # Every recorded (key, day, counts), for writing the history file
+    def entries(self):
+        for key, buf in self.buffers.items():
+            for i in range(0, len(buf), USAGE_SLOT):
+                if buf[i]:
+                    yield key, buf[i], dict(zip(USAGE_COUNTERS, buf[i + 1:i + USAGE_SLOT]))
+
+# Check-out/check-in events against license usage limits. Events only
+# touch memory: changes to current_usage are summed per license and
+# written as one batch by flush(), which runs every USAGE_FLUSH_SECONDS /
+# USAGE_FLUSH_EVENTS (checked as events arrive) and should be called
+# once more before exiting (or only then, with auto_flush=False).
+#
+# The limit is checked against the stored usage plus unflushed changes
+# under a thread lock. For an exact answer with several processes
+# metering the same license, hold the storage lock from a refresh() before
+# checkout() until after flush() (as the command line and the API server
+# do). Otherwise flush() re-checks the limit: seats granted past it are
+# taken back and listed in self.revoked instead of being written.
+class UsageMeter:
+    def __init__(self, store, history_file=USAGE_HISTORY_FILE, auto_flush=True):
+        self.store = store
+        self.auto_flush = auto_flush
+        self.lock = threading.Lock()
+        self.deltas = {}       # license_key -> unflushed change to current_usage
+        self.unwritten = {}    # (license_key, day) -> counts not yet in history_file
+        self.holders = {}      # license_key -> {(user, device): open check-outs}
+        self.granted = {}      # license_key -> [(user, device)] checked out since the last flush
+        self.revoked = []      # (license_key, user, device) of grants flush() had to take back
+        self.events = 0
+        self.last_flush = time.monotonic()
+        self.history = UsageHistory()
+        self.history_file = history_file
+        self.history_lock = FileLock(history_file + ".lock")
+        self.load_history()
+
+    def load_history(self):
+        try:
+            with open(self.history_file, 'r') as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        entry = json.loads(line)
+                        self.history.record(entry['key'], date.fromisoformat(entry['date']).toordinal(), entry)
+        except FileNotFoundError:
+            pass
+
+    def _get(self, key):
+        lic = self.store.get(key)
+        if lic is None:
+            raise ValueError(f"License '{key}' not found.")
+        return lic
+
+    # Usage including changes not flushed yet
+    def usage(self, key):
+        return int(self._get(key)['current_usage']) + self.deltas.get(key, 0)
+
+    def _count(self, key, name, peak):
+        day = date.today().toordinal()
+        counts = {name: 1, "peak": peak}
+        self.history.record(key, day, counts)
+        pending = self.unwritten.setdefault((key, day), dict.fromkeys(USAGE_COUNTERS, 0))
+        pending[name] += 1
+        pending["peak"] = max(pending["peak"], peak)
+        self.events += 1
+
+    # Take one seat of a license for user on device. Returns False (and
+    # counts a denial) if the license is already at its usage limit.
+    def checkout(self, key, user, device):
+        with self.lock:
+            lic = self._get(key)
+            usage = self.usage(key)
+            if usage >= int(lic['usage_limit']):
+                self._count(key, "denied", usage)
+                granted = False
+            else:
+                self.deltas[key] = self.deltas.get(key, 0) + 1
+                held = self.holders.setdefault(key, {})
+                held[(user, device)] = held.get((user, device), 0) + 1
+                self.granted.setdefault(key, []).append((user, device))
+                self._count(key, "checkouts", usage + 1)
+                granted = True
+        self.maybe_flush()
+        return granted
+
+    # Give back a seat. Seats checked out before this meter started can be
+    # returned too; returns False only if the license shows no usage.
+    def checkin(self, key, user, device):
+        with self.lock:
+            usage = self.usage(key)
+            held = self.holders.get(key, {})
+            if held.get((user, device)):
+                held[(user, device)] -= 1
+            elif usage <= 0:
+                return False
+            self.deltas[key] = self.deltas.get(key, 0) - 1
+            self._count(key, "checkins", usage - 1)
+        self.maybe_flush()
+        return True
+
+    def maybe_flush(self):
+        if self.auto_flush and (self.events >= USAGE_FLUSH_EVENTS
+                or time.monotonic() - self.last_flush >= USAGE_FLUSH_SECONDS):
+            self.flush()
+
+    # A seat granted since the last flush turned out to be over the limit:
+    # count it as denied and forget its holder
+    def _revoke(self, key, user, device):
+        held = self.holders.get(key, {})
+        if held.get((user, device)):
+            held[(user, device)] -= 1
+        day = date.today().toordinal()
+        self.history.record(key, day, {"checkouts": -1, "denied": 1})
+        pending = self.unwritten.setdefault((key, day), dict.fromkeys(USAGE_COUNTERS, 0))
+        pending["checkouts"] -= 1
+        pending["denied"] += 1
+        self.revoked.append((key, user, device))
+        print(colored(f"Seat of '{key}' for {user} could not be granted: "
+                      "the usage limit was reached by another session.", "red"))
+
+    # Write the summed usage changes in one save and append the day
+    # counters to the history file. Returns False if the save failed.
+    @instrumented("usage_flush")
+    def flush(self):
+        with self.lock:
+            deltas, self.deltas = self.deltas, {}
+            granted, self.granted = self.granted, {}
+            self.events = 0
+            self.last_flush = time.monotonic()
+
+            store = self.store
+            with store.backend.lock():
+                # Save anything else first, then apply the changes to the
+                # latest data so they can't conflict with another session
+                store.save()
+                store.refresh()
+                for key, delta in deltas.items():
+                    lic = store.get(key)
+                    if lic is None or not delta:
+                        continue
+                    current = int(lic['current_usage'])
+                    if delta > 0:
+                        # Never push usage past the limit (other processes may
+                        # have taken seats since we checked); the newest grants
+                        # are the ones taken back
+                        usage = min(current + delta, max(current, int(lic['usage_limit'])))
+                        grants = granted.get(key, [])
+                        for user, device in grants[len(grants) - (current + delta - usage):]:
+                            self._revoke(key, user, device)
+                    else:
+                        usage = max(current + delta, 0)
+                    if usage != current:
+                        store.update(lic, 'current_usage', usage)
+                ok = store.save()
+            unwritten, self.unwritten = self.unwritten, {}
+            self.write_history(unwritten)
+        return ok
+
+    def write_history(self, unwritten):
+        if not unwritten:
+            return
+        lines = "".join(json.dumps({"key": key, "date": date.fromordinal(day).isoformat(), **counts}) + "\n"
+                        for (key, day), counts in unwritten.items())
+        with self.history_lock:
+            with open(self.history_file, 'a') as f:
+                f.write(lines)
+            if os.path.getsize(self.history_file) > USAGE_HISTORY_COMPACT_BYTES:
+                self.compact_history()
+
+    # Rewrite the history file with one line per license and day, dropping
+    # days that have rolled out of the window. Re-reads the file first since
+    # other processes append to it too. Call with history_lock held.
+    def compact_history(self):
+        self.history = UsageHistory(self.history.days)
+        self.load_history()
+        tmp_file = self.history_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            for key, day, counts in self.history.entries():
+                f.write(json.dumps({"key": key, "date": date.fromordinal(day).isoformat(), **counts}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.history_file)
+
+# ------------------ EXPORT ------------------
+
+# Rows buffered before each write during export
+EXPORT_CHUNK_ROWS = 1000
+
+# Licenses matching the given filters, one at a time. Uses the store's
+# field and expiry indexes instead of scanning everything. The matches
+# are taken up front, so the store may change (e.g. the API server adding
+# licenses) while the result is being streamed.
+#   user: exact username, software: exact name in any case,
+#   status: "active"/"expired", expired: expiry date before today
+def iter_licenses(store, user=None, software=None, status=None, expired=False):
+    today = date.today()
+    if user is not None:
+        licenses = store.find_by("user", user)
+    elif software is not None:
+        licenses = store.find_by("software", software)
+    elif expired:
+        licenses = [store.get(key) for key in store.expiry.expired(today)]
+    else:
+        licenses = list(store.licenses.values())
 
-# Export license data to a CSV file
-def export_to_csv():
+    software = software.lower() if software is not None else None
+    for lic in licenses:
+        if software is not None and str(lic.get('software', '')).lower() != software:
+            continue
+        if status is not None and lic.get('status') != status:
+            continue
+        if expired:
+            expiry = lic.ordinal('expiry_date')
+            if expiry is None or expiry >= today.toordinal():
+                continue
+        yield lic
+
+# Columns asked for by name; an unknown name is an error rather than an
+# empty column
+def check_columns(columns):
+    unknown = [column for column in columns or [] if column not in LICENSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}. Choose from {', '.join(LICENSE_FIELDS)}.")
+
+# Licenses rendered as CSV or JSONL text, EXPORT_CHUNK_ROWS rows at a
+# time so memory use doesn't grow with the inventory. Only the given
+# columns are written; fields a license doesn't have are left empty.
+# Yields (rows, text) pairs; the CSV header comes with the first chunk.
+def export_chunks(licenses, fmt="csv", columns=None):
     import csv
-    licenses = load_licenses()
-    if not licenses:
+    import io
+
+    columns = columns or LICENSE_FIELDS
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.DictWriter(buf, fieldnames=columns, restval='', extrasaction='ignore')
+        writer.writeheader()
+        write_chunk = writer.writerows
+    elif fmt == "jsonl":
+        def write_chunk(chunk):
+            buf.write("".join(json.dumps({c: lic[c] for c in columns if c in lic}) + "\n" for lic in chunk))
+    else:
+        raise ValueError(f"Unknown export format '{fmt}'")
+
+    chunk = []
+    for lic in licenses:
+        chunk.append(lic)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            write_chunk(chunk)
+            yield len(chunk), buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            chunk = []
+    write_chunk(chunk)
+    if buf.tell():
+        yield len(chunk), buf.getvalue()
+
+# Stream licenses to a CSV or JSONL file (gzip-compressed if compress is
+# set). Returns (rows, seconds).
+@instrumented("export")
+def export_licenses(path, fmt="csv", columns=None, compress=False, **filters):
+    import gzip
+
+    check_columns(columns)
+    chunks = export_chunks(iter_licenses(get_store(), **filters), fmt, columns)
+    opener = gzip.open if compress else open
+    start = time.perf_counter()
+    rows = 0
+
+    with opener(path, "wt", newline='') as f:
+        for count, text in chunks:
+            f.write(text)
+            rows += count
+
+    metrics.add("export", "records", rows)
+    return rows, time.perf_counter() - start
+
+# Export license data to a CSV (or JSONL) file
+def export_to_csv():
+    if not get_store():
         print(colored("\nNo licenses found to export.", "red"))
         return
 
-    # Write license data to CSV file
-    with open("licenses_export.csv", "w", newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=licenses[0].keys())
-        writer.writeheader()
-        writer.writerows(licenses)
-    print(colored("Licenses exported to licenses_export.csv", "green"))
+    fmt = input("Export format (csv/jsonl, add .gz to compress) [csv]: ").strip().lower() or "csv"
+    compress = fmt.endswith(".gz")
+    fmt = fmt[:-3] if compress else fmt
+    if fmt not in ["csv", "jsonl"]:
+        print(colored("Error: Format must be 'csv' or 'jsonl'.", "red"))
+        return
+
+    # Optional filter: only expired licenses or only one user's licenses,
+    # or only what changed after a sequence number
+    filters = {}
+    choice = input("Filter ('expired', 'user:USERNAME', 'since:SEQUENCE' or blank for all): ").strip()
+    if choice.lower().startswith("since:"):
+        since = choice[6:].strip()
+        if not since.isdigit():
+            print(colored("Error: Sequence must be a number.", "red"))
+            return
+        path = "licenses_changes." + fmt + (".gz" if compress else "")
+        try:
+            rows, seq = export_changes(path, int(since), fmt, compress)
+        except ValueError as e:
+            print(colored(f"Error: {e}", "red"))
+            return
+        print(colored(f"{rows} changed licenses exported to {path}. Use since:{seq} next time.", "green"))
+        return
+    if choice.lower() == "expired":
+        filters["expired"] = True
+    elif choice.lower().startswith("user:"):
+        filters["user"] = choice[5:].strip()
+    elif choice:
+        print(colored("Error: Unknown filter.", "red"))
+        return
+
+    path = "licenses_export." + fmt + (".gz" if compress else "")
+    rows, seconds = export_licenses(path, fmt, compress=compress, **filters)
+    rate = rows / seconds if seconds else rows
+    print(colored(f"{rows} licenses exported to {path} in {seconds:.2f}s ({rate:,.0f} rows/s)", "green"))
+
+# ------------------ CHANGE FEED ------------------
+
+# Columns of a change export: the sequence of the last change to the
+# license, "upsert" or "delete", then the license fields (empty for
+# deletions)
+CHANGE_COLUMNS = ["seq", "op"] + LICENSE_FIELDS
+
+# Sequence number of the last complete record in the feed, read from the
+# end of the file (0 if there is none yet)
+def last_change_sequence():
+    try:
+        with open(CHANGE_FEED_FILE, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            block = 4096
+            while True:
+                start = max(size - block, 0)
+                f.seek(start)
+                lines = f.read(size - start).split(b"\n")
+                # lines[-1] is whatever follows the last newline
+                for line in reversed(lines[1 if start else 0:-1]):
+                    try:
+                        return json.loads(line)['seq']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                if not start:
+                    return 0
+                block *= 4
+    except FileNotFoundError:
+        return 0
+
+# Number the changes and append them with a single write. Called by
+# LicenseStore.save() while it holds the backend lock, so sequences from
+# different sessions never collide.
+def append_change_feed(changes):
+    seq = last_change_sequence()
+    stamp = datetime.now().isoformat(timespec="seconds")
+    lines = []
+    for rec in changes:
+        seq += 1
+        lines.append(json.dumps({"seq": seq, "time": stamp, **rec}, separators=(",", ":"), default=json_default))
+    with open(CHANGE_FEED_FILE, 'a+b') as f:
+        # Start on a new line if a crash left the last one unfinished
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                lines.insert(0, "")
+        f.write(("\n".join(lines) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+    if CHANGE_FEED_KEEP and seq - first_change_sequence() >= 2 * CHANGE_FEED_KEEP:
+        trim_change_feed(seq - CHANGE_FEED_KEEP)
+
+# Sequence the feed starts after: that of its first record, less one, or
+# that of the trim marker (0 if there is no feed)
+def first_change_sequence():
+    try:
+        with open(CHANGE_FEED_FILE, 'rb') as f:
+            rec = json.loads(f.readline())
+        return rec['seq'] if rec['op'] == 'trimmed' else rec['seq'] - 1
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return 0
+
+# Drop the changes up to sequence cut. The new file starts with a
+# "trimmed" marker so that readers asking for older changes find out
+# instead of silently missing them. Call with the backend lock held.
+def trim_change_feed(cut):
+    import shutil
+
+    tmp_file = CHANGE_FEED_FILE + ".tmp"
+    with open(CHANGE_FEED_FILE, 'rb') as f, open(tmp_file, 'wb') as out:
+        out.write((json.dumps({"seq": cut, "op": "trimmed"}) + "\n").encode())
+        f.seek(change_feed_offset(f, cut))
+        shutil.copyfileobj(f, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_file, CHANGE_FEED_FILE)
+
+# Offset of the first record with a sequence above since. Sequences grow
+# with the file, so this is a binary search over byte offsets.
+def change_feed_offset(f, since):
+    size = f.seek(0, os.SEEK_END)
+
+    # Start of the first line at or after offset
+    def line_start(offset):
+        if offset == 0:
+            return 0
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
+
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = line_start(mid)
+        line = f.readline()
+        try:
+            above = json.loads(line)['seq'] > since
+        except (ValueError, KeyError, TypeError):
+            above = True  # end of file, or a torn last line
+        if above:
+            hi = mid
+        else:
+            lo = start + len(line)
+    return line_start(lo)
+
+# Feed records with a sequence above since, oldest first
+def read_change_feed(since=0):
+    try:
+        with open(CHANGE_FEED_FILE, 'rb') as f:
+            f.seek(change_feed_offset(f, since))
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # cut short by a crash
+                if rec['seq'] > since:
+                    yield rec
+    except FileNotFoundError:
+        return
+
+# What changed after sequence since, one row per license in the order of
+# its last change: the license as it is now, or a tombstone if it was
+# deleted (or renamed away). Returns (rows, last sequence read). The feed
+# is read before the store is refreshed, so a row is never older than
+# the sequence reported for it. Raises ValueError if changes after since
+# have been trimmed from the feed.
+def changed_since(since):
+    last = {}  # license_key -> sequence of its last change
+    seq = since
+    for rec in read_change_feed(since):
+        if rec['op'] == 'trimmed':
+            raise ValueError(f"Changes up to {rec['seq']} are no longer kept. Start again from a full "
+                             f"export and since={last_change_sequence()}.")
+        seq = rec['seq']
+        keys = [rec['key']]
+        if rec['op'] == 'set' and rec['field'] == 'license_key':
+            keys.append(rec['value'])
+        for key in keys:
+            last.pop(key, None)
+            last[key] = seq
+
+    store = get_store()
+    rows = []
+    for key, key_seq in last.items():
+        lic = store.get(key)
+        if lic is None:
+            rows.append({"seq": key_seq, "op": "delete", "license_key": key})
+        else:
+            rows.append({"seq": key_seq, "op": "upsert", **lic.to_dict()})
+    return rows, seq
+
+# Write the changes after sequence since to a CSV or JSONL file (gzip-
+# compressed if compress is set). Returns (rows, last sequence); pass
+# the last sequence as since next time.
+@instrumented("export_changes")
+def export_changes(path, since=0, fmt="jsonl", compress=False):
+    import gzip
+
+    rows, seq = changed_since(since)
+    opener = gzip.open if compress else open
+    with opener(path, "wt", newline='') as f:
+        for count, text in export_chunks(rows, fmt, CHANGE_COLUMNS):
+            f.write(text)
+    metrics.add("export_changes", "records", len(rows))
+    return len(rows), seq
+
+# ------------------ IMPORT ------------------
+
+# License rows of a CSV, JSONL or JSON (one array) file, optionally .gz,
+# as (row number, row, error). JSONL rows are numbered by line, and a
+# line that isn't valid JSON comes with an error instead of a row.
+def read_license_file(path, fmt=None):
+    import csv
+    import gzip
+
+    if fmt is None:
+        name = path[:-3] if path.endswith(".gz") else path
+        fmt = "jsonl" if name.endswith(".jsonl") else "json" if name.endswith(".json") else "csv"
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline='') as f:
+        if fmt == "csv":
+            for number, row in enumerate(csv.DictReader(f), 1):
+                yield number, row, None
+        elif fmt == "json":
+            try:
+                rows = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"{path} is not valid JSON: {e}")
+            if not isinstance(rows, list):
+                raise ValueError(f"{path} must hold a JSON array of licenses")
+            for number, row in enumerate(rows, 1):
+                yield number, row, None
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row, error = json.loads(line), None
+                except ValueError as e:
+                    row, error = None, f"invalid JSON: {e}"
+                yield number, row, error
+
+# Check one imported row against the same rules add_license applies.
+# Dates are parsed through a cache since imports repeat the same few dates.
+def check_import_row(row, usernames, seen_keys, store, date_cache):
+    if not isinstance(row, dict):
+        return None, ["not a JSON object"]
+    errors = []
+    for field in LICENSE_FIELDS:
+        if field != "status" and row.get(field) in (None, ""):
+            errors.append(f"missing {field}")
+    if errors:
+        return None, errors
+
+    lic = {field: row[field] for field in LICENSE_FIELDS if field in row}
+    for field in ["software", "license_key", "user", "assigned_device", "install_date", "expiry_date"]:
+        lic[field] = str(lic[field]).strip()
+
+    key = lic['license_key']
+    if key in seen_keys:
+        errors.append("duplicate license key in file")
+    elif store.has_key(key):
+        errors.append("license key already exists")
+
+    if lic['user'] not in usernames:
+        errors.append(f"user '{lic['user']}' not found")
+
+    dates = []
+    for field in ["install_date", "expiry_date"]:
+        if lic[field] not in date_cache:
+            date_cache[lic[field]] = parse_date(lic[field])
+        dates.append(date_cache[lic[field]])
+        if dates[-1] is None:
+            errors.append(f"invalid {field} (use YYYY-MM-DD)")
+    if None not in dates and dates[1] <= dates[0]:
+        errors.append("expiry date must be after install date")
+
+    for field in ["usage_limit", "current_usage"]:
+        value = lic[field]
+        if isinstance(value, str) and value.strip().isdigit():
+            lic[field] = int(value)
+        elif not (isinstance(value, int) and not isinstance(value, bool) and value >= 0):
+            errors.append(f"{field} must be a number")
+
+    status = str(lic.get('status') or "active").strip().lower()
+    if status not in ["active", "expired"]:
+        errors.append("status must be 'active' or 'expired'")
+    lic['status'] = status
+
+    return lic, errors
+
+# Validate every row of a CSV/JSONL/JSON file and add the valid ones in one
+# save. Rows with problems are skipped and reported instead of aborting
+# the import, as are rows that clash with another session's changes when
+# saving. Returns {"imported": n, "errors": [{row, license_key, errors}]}.
+# With save=False the rows are only added to the store (for batch runs).
+@instrumented("import")
+def import_licenses(path, fmt=None, save=True):
+    store = get_store()
+    usernames = {user['username'] for user in load_users()}
+    seen_keys = set()
+    date_cache = {}
+    report = {"imported": 0, "errors": []}
+    added = []  # (row number, pending record) of each row added
+
+    for row_number, row, error in read_license_file(path, fmt):
+        if error:
+            lic, errors = None, [error]
+        else:
+            lic, errors = check_import_row(row, usernames, seen_keys, store, date_cache)
+        if lic is not None:
+            seen_keys.add(lic['license_key'])
+        if errors:
+            key = row.get('license_key') if isinstance(row, dict) else None
+            report["errors"].append({"row": row_number, "license_key": key, "errors": errors})
+        else:
+            store.add(lic)
+            added.append((row_number, store.pending[-1]))
+            report["imported"] += 1
+
+    if save and added and not store.save():
+        rejected = {id(rec) for rec in store.rejected}
+        for row_number, rec in added:
+            if id(rec) in rejected:
+                report["imported"] -= 1
+                report["errors"].append({"row": row_number, "license_key": rec['key'],
+                                         "errors": ["not saved: clashes with a change by another session"]})
+        report["errors"].sort(key=lambda error: error["row"])
+    metrics.add("import", "records", report["imported"])
+    metrics.add("import", "errors", len(report["errors"]))
+    return report
+
+# ------------------ COMMAND LINE ------------------
+
+# Commands only admins may run; the rest are open to employees too
+ADMIN_COMMANDS = {"add", "edit", "delete", "export", "changes", "import", "reassign", "retire-device"}
+
+# Where command results go; everything else printed while a command runs
+# (warnings, conflicts) is sent to stderr so stdout stays valid JSON
+CLI_OUTPUT = sys.stdout
+
+class CommandError(Exception):
+    pass
+
+# State shared by the commands of one run: the logged-in user, the store
+# and, in batch mode, the deferred save
+class CliSession:
+    def __init__(self, username, role, batch=False):
+        self.username = username
+        self.role = role
+        self.batch = batch
+        self.store = get_store()
+        self._usernames = None
+        self.usage_meter = None
+
+    # Usage meter for checkout/checkin; a batch flushes it once at the end
+    def meter(self):
+        if self.usage_meter is None:
+            self.usage_meter = UsageMeter(self.store, auto_flush=not self.batch)
+        return self.usage_meter
+
+    # Registered usernames, loaded once per run
+    def usernames(self):
+        if self._usernames is None:
+            self._usernames = {user['username'] for user in load_users()}
+        return self._usernames
+
+    def get(self, license_key):
+        lic = self.store.get(license_key)
+        if lic is None:
+            raise CommandError(f"license '{license_key}' not found")
+        return lic
+
+    # Save now, or leave it to the end of the batch
+    def commit(self):
+        if not self.batch and not self.store.save():
+            raise CommandError("save failed, changes were discarded")
+
+def cmd_add(session, args):
+    row = {
+        "software": args.software, "license_key": args.key, "user": args.assigned_user,
+        "assigned_device": args.device, "install_date": args.install, "expiry_date": args.expiry,
+        "usage_limit": args.limit, "current_usage": args.usage, "status": args.status,
+    }
+    lic, errors = check_import_row(row, session.usernames(), set(), session.store, {})
+    if errors:
+        raise CommandError("; ".join(errors))
+    session.store.add(lic)
+    session.commit()
+    return {"license": lic}
+
+def cmd_search(session, args):
+    store = session.store
+    found = store.search(args.query, fuzzy=False)
+    if not found and args.fuzzy:
+        found = store.search(args.query)
+    return {"count": len(found), "licenses": found}
+
+def cmd_expired(session, args):
+    store = session.store
+    today = datetime.now().date()
+    if args.within is not None:
+        keys = store.expiry.expiring_within(args.within, today)
+    else:
+        keys = store.expiry.expired(today)
+    found = [store.get(key) for key in keys]
+
+    changed = 0
+    if args.mark and args.within is None:
+        for lic in found:
+            if lic['status'] != 'expired':
+                store.update(lic, 'status', 'expired')
+                changed += 1
+        if changed:
+            session.commit()
+    return {"count": len(found), "marked": changed, "licenses": found}
+
+def cmd_usage(session, args):
+    lic = session.get(args.key)
+    if args.count < 0:
+        raise CommandError("usage count must not be negative")
+    session.store.update(lic, 'current_usage', args.count)
+    session.commit()
+    return {"license": lic}
+
+# Run a seat change. Outside a batch the limit check and the write happen
+# under one hold of the storage lock, on freshly read data, so two
+# sessions can't both take the last seat.
+def seat_change(session, change):
+    meter = session.meter()
+    if session.batch:
+        return change(meter)
+    with session.store.backend.lock():
+        session.store.refresh()
+        result = change(meter)
+        if not meter.flush():
+            raise CommandError("save failed, changes were discarded")
+    return result
+
+def cmd_checkout(session, args):
+    user = args.assigned_user or session.username
+    granted = seat_change(session, lambda meter: meter.checkout(args.key, user, args.device))
+    result = {"granted": granted, "usage": session.meter().usage(args.key)}
+    if not granted:
+        result.update(ok=False, error="usage limit reached")
+    return result
+
+def cmd_checkin(session, args):
+    user = args.assigned_user or session.username
+    returned = seat_change(session, lambda meter: meter.checkin(args.key, user, args.device))
+    return {"returned": returned, "usage": session.meter().usage(args.key)}
+
+def cmd_history(session, args):
+    session.get(args.key)
+    return {"license_key": args.key, "days": session.meter().history.days_for(args.key)}
+
+def cmd_report(session, args):
+    report = build_report(session.store, args.by, args.days)
+    if not args.output:
+        if args.format != "json":
+            raise CommandError(f"{args.format} reports need --output")
+        return {"report": report}
+    with open(args.output, "w", newline='') as f:
+        f.write(format_report(report, args.format))
+    return {"path": args.output, "groups": len(report["groups"])}
+
+def cmd_edit(session, args):
+    lic = session.get(args.key)
+    if args.field not in LICENSE_FIELDS:
+        raise CommandError(f"unknown field '{args.field}'")
+    value, error = check_field_value(session.store, lic, args.field, args.value)
+    if error:
+        raise CommandError(error)
+    session.store.update(lic, args.field, value)
+    session.commit()
+    return {"license": lic}
+
+def cmd_delete(session, args):
+    lic = session.get(args.key)
+    session.store.delete(lic)
+    session.commit()
+    return {"deleted": args.key}
+
+def cmd_reassign(session, args):
+    if args.to_user == args.from_user:
+        raise CommandError("the new user must differ from the old one")
+    if args.to_user not in session.usernames():
+        raise CommandError(f"user '{args.to_user}' not found")
+    moved = session.store.reassign("user", args.from_user, args.to_user)
+    if moved:
+        session.commit()
+    return {"moved": len(moved), "licenses": [lic['license_key'] for lic in moved]}
+
+def cmd_retire_device(session, args):
+    if args.to == args.device:
+        raise CommandError("the new device must differ from the retired one")
+    moved = session.store.reassign("assigned_device", args.device, args.to)
+    if moved:
+        session.commit()
+    return {"moved": len(moved), "licenses": [lic['license_key'] for lic in moved]}
+
+def cmd_orphans(session, args):
+    found = session.store.orphans(session.usernames())
+    return {"count": len(found), "licenses": found}
+
+def cmd_export(session, args):
+    filters = {"user": args.assigned_user, "software": args.software,
+               "status": args.status, "expired": args.expired}
+    columns = args.columns.split(",") if args.columns else None
+    rows, seconds = export_licenses(args.path, args.format, columns, args.gzip, **filters)
+    return {"path": args.path, "rows": rows, "seconds": round(seconds, 3)}
+
+def cmd_changes(session, args):
+    if args.since < 0:
+        raise CommandError("--since must not be negative")
+    try:
+        rows, seq = export_changes(args.path, args.since, args.format, args.gzip)
+    except ValueError as e:
+        raise CommandError(str(e))
+    return {"path": args.path, "rows": rows, "since": args.since, "last_seq": seq}
+
+def cmd_import(session, args):
+    report = import_licenses(args.path, args.format, save=not session.batch)
+    if report["errors"]:
+        report["ok"] = False
+    return report
+
+# Argument parser for the command line. Batch files use the same command
+# syntax, one command per line.
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="license_inventory.py",
+        description="Run license inventory commands without the menus. Results are printed as JSON. "
+                    "The password is read from SOFTWHERE_PASSWORD, or prompted for.")
+    parser.add_argument("--user", default=os.environ.get("SOFTWHERE_USER"),
+                        help="username to run as (default: $SOFTWHERE_USER)")
+    parser.add_argument("--token", default=os.environ.get("SOFTWHERE_TOKEN"),
+                        help="session token from the login command instead of a password (default: $SOFTWHERE_TOKEN)")
+    parser.add_argument("--plain", action="store_true",
+                        help="no colours or banners (also SOFTWHERE_PLAIN=1)")
+    parser.add_argument("--profile", choices=PROFILE_MODES, nargs="?", const="all",
+                        help=f"profile the run (also SOFTWHERE_PROFILE); see {os.path.basename(PROFILE_FILE)}")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write operation metrics to FILE on exit, JSON if it ends in .json (also SOFTWHERE_METRICS)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) against one loaded store and save once")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    add = commands.add_parser("add", help="add a license")
+    add.add_argument("--software", required=True)
+    add.add_argument("--key", required=True)
+    add.add_argument("--assigned-user", required=True, metavar="USERNAME")
+    add.add_argument("--device", required=True)
+    add.add_argument("--install", required=True, metavar="YYYY-MM-DD")
+    add.add_argument("--expiry", required=True, metavar="YYYY-MM-DD")
+    add.add_argument("--limit", required=True, type=int)
+    add.add_argument("--usage", default=0, type=int)
+    add.add_argument("--status", default="active", choices=["active", "expired"])
+    add.set_defaults(func=cmd_add)
+
+    search = commands.add_parser("search", help="search licenses, e.g. 'user:JunLorenz software:mat'")
+    search.add_argument("query")
+    search.add_argument("--fuzzy", action="store_true", help="fall back to close matches")
+    search.set_defaults(func=cmd_search)
+
+    expired = commands.add_parser("expired", help="list expired licenses")
+    expired.add_argument("--within", type=int, metavar="DAYS", help="list licenses expiring in the next DAYS days instead")
+    expired.add_argument("--mark", action="store_true", help="set the status of expired licenses to 'expired'")
+    expired.set_defaults(func=cmd_expired)
+
+    usage = commands.add_parser("usage", help="set the usage count of a license")
+    usage.add_argument("key")
+    usage.add_argument("count", type=int)
+    usage.set_defaults(func=cmd_usage)
+
+    for name, help_text in [("checkout", "take one seat of a license (fails at the usage limit)"),
+                            ("checkin", "give back one seat of a license")]:
+        seat = commands.add_parser(name, help=help_text)
+        seat.add_argument("key")
+        seat.add_argument("--assigned-user", metavar="USERNAME", help="who holds the seat (default: --user)")
+        seat.add_argument("--device", default="")
+        seat.set_defaults(func=cmd_checkout if name == "checkout" else cmd_checkin)
+
+    history = commands.add_parser("history", help=f"daily usage of a license over the last {USAGE_HISTORY_DAYS} days")
+    history.add_argument("key")
+    history.set_defaults(func=cmd_history)
+
+    report = commands.add_parser("report", help="seats used, over-limit, idle and near-expiry licenses per group")
+    report.add_argument("--by", default="software", choices=list(REPORT_GROUPS))
+    report.add_argument("--days", type=int, default=REPORT_EXPIRY_DAYS, help="near-expiry window in days")
+    report.add_argument("--format", default="json", choices=["json", "csv", "table"])
+    report.add_argument("--output", metavar="FILE", help="write the report to FILE (required for csv/table)")
+    report.set_defaults(func=cmd_report)
+
+    edit = commands.add_parser("edit", help="change one field of a license")
+    edit.add_argument("key")
+    edit.add_argument("field", choices=LICENSE_FIELDS)
+    edit.add_argument("value")
+    edit.set_defaults(func=cmd_edit)
+
+    delete = commands.add_parser("delete", help="delete a license")
+    delete.add_argument("key")
+    delete.set_defaults(func=cmd_delete)
+
+    reassign = commands.add_parser("reassign", help="move every license of one user to another user")
+    reassign.add_argument("from_user", metavar="FROM_USER")
+    reassign.add_argument("to_user", metavar="TO_USER")
+    reassign.set_defaults(func=cmd_reassign)
+
+    retire = commands.add_parser("retire-device", help="unassign (or move) every license of a device")
+    retire.add_argument("device")
+    retire.add_argument("--to", default="", metavar="DEVICE", help="move the licenses to DEVICE instead")
+    retire.set_defaults(func=cmd_retire_device)
+
+    orphans = commands.add_parser("orphans", help="list licenses assigned to users that are not registered")
+    orphans.set_defaults(func=cmd_orphans)
+
+    export = commands.add_parser("export", help="export licenses to CSV or JSONL")
+    export.add_argument("path")
+    export.add_argument("--format", default="csv", choices=["csv", "jsonl"])
+    export.add_argument("--columns", help="comma-separated list of columns")
+    export.add_argument("--gzip", action="store_true")
+    export.add_argument("--assigned-user", metavar="USERNAME")
+    export.add_argument("--software", help="exact software name (any case)")
+    export.add_argument("--status", choices=["active", "expired"])
+    export.add_argument("--expired", action="store_true")
+    export.set_defaults(func=cmd_export)
+
+    changes = commands.add_parser("changes", help="export licenses changed or deleted after a change sequence number")
+    changes.add_argument("path")
+    changes.add_argument("--since", type=int, default=0, metavar="SEQ",
+                         help="last_seq printed by the previous run (default: everything)")
+    changes.add_argument("--format", default="jsonl", choices=["csv", "jsonl"])
+    changes.add_argument("--gzip", action="store_true")
+    changes.set_defaults(func=cmd_changes)
+
+    imp = commands.add_parser("import", help="import licenses from CSV, JSONL or a JSON array")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=["csv", "jsonl", "json"])
+    imp.set_defaults(func=cmd_import)
+
+    login = commands.add_parser("login", help="check the password once and print a session token for later commands")
+    login.add_argument("--ttl", type=int, default=SESSION_TTL, metavar="SECONDS", help="how long the token is valid")
+    commands.add_parser("logout", help="revoke the session token given with --token")
+
+    commands.add_parser("migrate", help="copy the JSON data into the SQLite database")
+    convert = commands.add_parser("convert", help="rewrite licenses.json and users.json in another snapshot format")
+    convert.add_argument("format", choices=SNAPSHOT_FORMATS)
+    commands.add_parser("banners", help=f"precompute the menu banners into {os.path.basename(BANNER_FILE)}")
+    return parser
+
+# Run one parsed command. Returns its JSON result; failures are reported
+# as {"ok": false, "error": ...} rather than raised.
+def run_command(session, args):
+    if args.command in ADMIN_COMMANDS and session.role != "admin":
+        return {"ok": False, "command": args.command, "error": "admin access required"}
+    try:
+        result = args.func(session, args)
+    except (CommandError, ValueError, OSError) as e:
+        return {"ok": False, "command": args.command, "error": str(e)}
+    return {"ok": result.pop("ok", True), "command": args.command, **result}
+
+# Run every command in a batch file, saving once at the end. Each
+# command's result is printed as one JSON line, tagged with its line
+# number in the file, then the summary is returned.
+def run_batch(session, parser, path):
+    f = sys.stdin if path == "-" else open(path)
+    commands = failed = 0
+    with f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            commands += 1
+            try:
+                args = parser.parse_args(shlex.split(line))
+            except (SystemExit, ValueError):
+                args = None
+            if args is None or args.batch or not getattr(args, "func", None):
+                result = {"ok": False, "error": "invalid command"}
+            else:
+                result = run_command(session, args)
+            if not result["ok"]:
+                failed += 1
+            print(json.dumps({"line": line_number, **result}, default=json_default), file=CLI_OUTPUT)
+
+    saved = session.usage_meter.flush() if session.usage_meter else session.store.save()
+    result = {"ok": saved and not failed, "commands": commands, "failed": failed, "saved": saved}
+    # Seats reported as granted above that were over the limit after all
+    if session.usage_meter and session.usage_meter.revoked:
+        result["ok"] = False
+        result["revoked"] = [{"license_key": key, "user": user, "device": device}
+                             for key, user, device in session.usage_meter.revoked]
+    return result
+
+# Entry point for "python license_inventory.py COMMAND ...". Returns the
+# process exit code.
+def run_cli(argv):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrate_json_to_sqlite()
+        return 0
+    if args.command == "convert":
+        convert_snapshot(args.format)
+        return 0
+    if args.command == "banners":
+        save_banners()
+        return 0
+    if args.batch and args.command:
+        parser.error("--batch cannot be combined with a command")
+    if not args.batch and not args.command:
+        parser.error("a command or --batch is required")
+    if args.command == "logout":
+        if not args.token:
+            parser.error("logout needs --token (or SOFTWHERE_TOKEN)")
+        found = revoke_session(args.token)
+        print(json.dumps({"ok": found, "command": "logout"}), file=CLI_OUTPUT)
+        return 0 if found else 1
+
+    # A session token skips the password check; login always asks for it
+    if args.token and args.command != "login":
+        session_user = check_session(args.token)
+        if session_user is None or (args.user and args.user != session_user[0]):
+            print(json.dumps({"ok": False, "error": "invalid or expired session token"}), file=CLI_OUTPUT)
+            return 1
+        username, role = session_user
+    else:
+        if not args.user:
+            parser.error("--user (or SOFTWHERE_USER) is required")
+        password = os.environ.get("SOFTWHERE_PASSWORD")
+        if password is None:
+            password = getpass_masked("Password: ")
+        username, role = args.user, authenticate(args.user, password)
+        if role is None:
+            print(json.dumps({"ok": False, "error": "invalid username or password"}), file=CLI_OUTPUT)
+            return 1
+
+    if args.command == "login":
+        token, expires = create_session(username, role, args.ttl)
+        result = {"ok": True, "command": "login", "token": token,
+                  "expires": datetime.fromtimestamp(expires).isoformat(timespec="seconds")}
+        print(json.dumps(result, default=json_default), file=CLI_OUTPUT)
+        return 0
+
+    with contextlib.redirect_stdout(sys.stderr):
+        session = CliSession(username, role, batch=bool(args.batch))
+        if args.batch:
+            result = run_batch(session, parser, args.batch)
+        else:
+            result = run_command(session, args)
+    print(json.dumps(result, default=json_default), file=CLI_OUTPUT)
+    return 0 if result["ok"] else 1
 
 # ------------------ MAIN MENU ------------------
 
@@ -461,8 +3795,7 @@ def export_to_csv():
 def admin_menu():
     while True:
         try:
-            menu_gui = pyfiglet.figlet_format("Admin License Inventory Menu")
-            print(colored(menu_gui, "green"))
+            print(colored(banner("Admin License Inventory Menu"), "green"))
 
             print("[1] Register New User")
             print("[2] Add New License")
@@ -473,7 +3806,10 @@ def admin_menu():
             print("[7] Edit License")
             print("[8] Delete License")
             print("[9] Export to CSV")
-            print(colored("[10] Logout", "red"))  # Updated logout number
+            print("[10] Expiry Queries")
+            print("[11] Usage Report")
+            print("[12] Reassign Licenses")
+            print(colored("[13] Logout", "red"))  # Updated logout number
 
             choice = validate_input("\nEnter your choice: ", is_number=True)
             if choice == 1:
@@ -494,11 +3830,17 @@ def admin_menu():
                 delete_license()
             elif choice == 9:
                 export_to_csv()
-            elif choice == 10:  # Updated from 9
+            elif choice == 10:
+                expiry_queries()
+            elif choice == 11:
+                usage_report()
+            elif choice == 12:
+                reassign_licenses()
+            elif choice == 13:  # Updated from 12
                 print(colored("Logging out...", "red"))
                 return
             else:
-                print(colored("Invalid choice. Please enter a number between 1-10.", "red"))
+                print(colored("Invalid choice. Please enter a number between 1-13.", "red"))
         except ValueError:
             print(colored("Invalid input. Please try again.", "red"))
 
@@ -506,15 +3848,15 @@ def employee_menu():
     while True:
         try:
             # Display ASCII-style header
-            menu_gui = pyfiglet.figlet_format("Employee License Inventory Menu")
-            print(menu_gui)
+            print(banner("Employee License Inventory Menu"))
 
             # Employee options
             print("[1] View All Licenses")
             print("[2] Search License")
             print("[3] Check Expired Licenses")
             print("[4] Update Usage Count")
-            print(colored("[5] Logout", "red"))
+            print("[5] Expiry Queries")
+            print(colored("[6] Logout", "red"))
 
             # Get user input
             choice = validate_input("Enter your choice: ", is_number=True)
@@ -528,23 +3870,54 @@ def employee_menu():
             elif choice == 4:
                 update_usage_count()
             elif choice == 5:
+                expiry_queries()
+            elif choice == 6:
                 print(colored("Logging out...", "red"))
                 return  # Return to login menu
             else:
-                print(colored("Invalid choice. Please enter a number between 1-5.", "red"))
+                print(colored("Invalid choice. Please enter a number between 1-6.", "red"))
         except ValueError:
             print(colored("Invalid input. Please try again.", "red"))
 
 # ------------------ ENTRY POINT ------------------
 
 if __name__ == "__main__":
+    if "--plain" in sys.argv[1:]:
+        PLAIN = True
+        sys.argv.remove("--plain")
+    # --profile and --metrics cover the menus too, so they are taken out
+    # here in either form (--metrics FILE or --metrics=FILE). Anything
+    # malformed is left for run_cli's parser to report.
+    i = 1
+    while i < len(sys.argv):
+        name, equals, value = sys.argv[i].partition("=")
+        if name == "--profile" and (not equals or value in PROFILE_MODES):
+            del sys.argv[i]
+            if not equals and sys.argv[i:i + 1] and sys.argv[i] in PROFILE_MODES:
+                value = sys.argv.pop(i)
+            PROFILE_MODE = value or "all"
+        elif name == "--metrics" and (equals or i + 1 < len(sys.argv)):
+            del sys.argv[i]
+            METRICS_FILE = value if equals else sys.argv.pop(i)
+        else:
+            i += 1
+
+    if PROFILE_MODE:
+        start_profiling(PROFILE_MODE)
+    if METRICS_FILE:
+        import atexit
+        atexit.register(write_metrics, METRICS_FILE)
+
+    # Any other arguments run a single command (or batch) instead of the menus
+    if sys.argv[1:]:
+        sys.exit(run_cli(sys.argv[1:]))
+
     # Initial user check for first-time setup
     users = load_users()
 
     # If no users exist, force admin creation
     if not users:
-        title = pyfiglet.figlet_format("SOFTWHERE")
-        print(colored(title, "blue"))
+        print(colored(banner("SOFTWHERE"), "blue"))
         print("\n=== FIRST-TIME SETUP ===")
         print(colored("No existing accounts found. Create an admin account.", "blue"))
         username = validate_input("Admin username: ")
@@ -0,0 +1,581 @@
+import argparse
+import asyncio
+import base64
+import hmac
+import json
+import os
+import re
+import signal
+import sys
+import time
+from datetime import date
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from license_inventory import (
+    ADMIN_COMMANDS, BROWSER_SORTS, LICENSE_FIELDS, METRICS_FILE, PAGE_SIZE, PROFILE_MODE,
+    PROFILE_MODES, REPORT_EXPIRY_DAYS, REPORT_GROUPS, USAGE_FLUSH_SECONDS, LicenseBrowser,
+    CHANGE_COLUMNS, UsageMeter, build_report, changed_since, check_columns, check_field_value,
+    check_import_row, check_session, export_chunks, find_user, get_store, iter_licenses, json_default,
+    hash_password, load_users, metrics, needs_rehash, replace_password_hash, start_profiling,
+    verify_password, write_metrics,
+)
+
+# Default address; only local clients unless told otherwise
+DEFAULT_HOST = os.environ.get("SOFTWHERE_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("SOFTWHERE_PORT", 8080))
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1024 * 1024
+# How often the shared store picks up changes saved by other processes
+REFRESH_SECONDS = 1.0
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 410: "Gone",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# One parsed request, with the authenticated user
+class Request:
+    def __init__(self, method, path, params, body, match):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.match = match
+        self.username = None
+        self.role = None
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "request body must be a JSON object")
+        return data
+
+    def int_param(self, name, default):
+        value = self.params.get(name, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HttpError(400, f"'{name}' must be a number")
+
+# JSON API over the shared license store. Every request is handled on the
+# event loop: reads go straight to the in-memory store and its indexes,
+# and changes are queued to a single writer task that applies whatever
+# has queued up and saves it in one write.
+class LicenseServer:
+    def __init__(self):
+        self.store = get_store()
+        self.meter = UsageMeter(self.store, auto_flush=False)
+        self.queue = asyncio.Queue()
+        self.verify_key = os.urandom(32)
+        self.verified = {}  # (username, stored hash) -> keyed digest of the password
+        self.last_refresh = time.monotonic()
+        self.reload = False  # the store holds changes that were never saved
+
+    # ------------------ WRITER ------------------
+
+    # Run fn(store) in the writer task and return its result once the
+    # change has been saved. metered: fn takes or returns seats through the
+    # usage meter, which the writer flushes with the batch.
+    async def write(self, fn, metered=False):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, future, metered))
+        return await future
+
+    async def writer(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # The storage lock is held for the whole batch, from a refresh
+            # to the save, so seat limits and other checks see the latest
+            # data and no other process can change it in between. Each
+            # request's changes are remembered so that only the requests
+            # whose changes were rejected fail.
+            results = []
+            try:
+                with self.store.backend.lock():
+                    if self.reload:
+                        self.store.load()
+                        self.reload = False
+                    else:
+                        self.store.refresh()
+                    for fn, future, metered in batch:
+                        start = len(self.store.pending)
+                        try:
+                            result, error = fn(self.store), None
+                        except Exception as e:
+                            result, error = None, e
+                        results.append((future, result, error, metered, self.store.pending[start:]))
+                    self.store.save()
+                    rejected = {id(rec) for rec in self.store.rejected}
+                    usage_saved = not self.meter.deltas or self.meter.flush()
+            except Exception as e:
+                # The storage failed (full disk, unreadable file, ...): this
+                # batch fails, its unsaved changes are dropped and the
+                # writer carries on with the next one
+                metrics.add("writer", "failures")
+                print(f"Write failed: {type(e).__name__}: {e}", file=sys.stderr)
+                for fn, future, metered in batch:
+                    if not future.done():
+                        future.set_exception(HttpError(503, "the change could not be saved, try again"))
+                self.store.pending = []
+                try:
+                    self.store.load()
+                except Exception:
+                    self.reload = True  # tried again before the next batch
+                continue
+
+            for future, result, error, metered, changes in results:
+                if future.done():
+                    continue
+                if error is None and any(id(rec) in rejected for rec in changes):
+                    error = HttpError(409, "conflicting change by another session, not saved")
+                if error is None and metered and not usage_saved:
+                    error = HttpError(409, "save failed, changes were discarded")
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    # Write the usage history every USAGE_FLUSH_SECONDS (seat changes
+    # themselves are written with the writer's batch)
+    async def flush_usage(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_SECONDS)
+            if self.meter.deltas or self.meter.unwritten:
+                await self.write(lambda store: self.meter.flush())
+
+    # The shared store, refreshed with other processes' changes at most
+    # every REFRESH_SECONDS
+    def current_store(self):
+        now = time.monotonic()
+        if now - self.last_refresh >= REFRESH_SECONDS and self.queue.empty():
+            self.last_refresh = now
+            self.store.refresh()
+        return self.store
+
+    # ------------------ AUTHENTICATION ------------------
+
+    # (username, role) from a Bearer session token or Basic credentials.
+    # Passwords are checked in a worker thread so a slow KDF doesn't stall
+    # other requests, and remembered (as a keyed digest) afterwards.
+    async def authenticate(self, header):
+        scheme, _, value = header.partition(" ")
+        if scheme.lower() == "bearer":
+            return check_session(value.strip())
+        if scheme.lower() != "basic":
+            return None
+        try:
+            username, _, password = base64.b64decode(value.strip()).decode().partition(":")
+        except ValueError:
+            return None
+
+        user = find_user(username)
+        if user is None:
+            return None
+        digest = hmac.new(self.verify_key, password.encode(), "sha256").digest()
+        cached = self.verified.get((username, user['password']))
+        if cached is None or not hmac.compare_digest(cached, digest):
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, verify_password, password, user['password']):
+                return None
+            stored = user['password']
+            if needs_rehash(stored):
+                # Only the hashing runs in a thread; the users file or
+                # database is written by the writer task
+                stored = await loop.run_in_executor(None, hash_password, password)
+                await self.write(lambda store: replace_password_hash(user, stored))
+            self.verified[(username, stored)] = digest
+        return username, user['role']
+
+    # ------------------ HANDLERS ------------------
+
+    def get_license(self, key):
+        lic = self.current_store().get(key)
+        if lic is None:
+            raise HttpError(404, f"license '{key}' not found")
+        return lic
+
+    async def list_licenses(self, request):
+        sort = request.params.get("sort", "added")
+        if sort not in BROWSER_SORTS:
+            raise HttpError(400, f"sort must be one of {', '.join(BROWSER_SORTS)}")
+        page = request.int_param("page", 1)
+        per_page = min(max(request.int_param("per_page", PAGE_SIZE), 1), 1000)
+        store = self.current_store()
+        keys = LicenseBrowser(store, sort).keys
+        start = (max(page, 1) - 1) * per_page
+        return 200, {"total": len(keys), "page": page, "per_page": per_page,
+                     "licenses": [store.get(key) for key in keys[start:start + per_page]]}
+
+    async def show_license(self, request):
+        return 200, {"license": self.get_license(request.match["key"])}
+
+    async def search(self, request):
+        query = request.params.get("q", "")
+        store = self.current_store()
+        found = store.search(query, fuzzy=False)
+        if not found and request.params.get("fuzzy") == "1":
+            found = store.search(query)
+        return 200, {"count": len(found), "licenses": found}
+
+    async def add_license(self, request):
+        row = request.json()
+        usernames = {user['username'] for user in load_users()}
+
+        def add(store):
+            lic, errors = check_import_row(row, usernames, set(), store, {})
+            if errors:
+                raise HttpError(400, "; ".join(errors))
+            store.add(lic)
+            return lic
+
+        return 201, {"license": await self.write(add)}
+
+    async def edit_license(self, request):
+        changes = request.json()
+        key = request.match["key"]
+        for field in changes:
+            if field not in LICENSE_FIELDS:
+                raise HttpError(400, f"unknown field '{field}'")
+
+        def edit(store):
+            lic = store.get(key)
+            if lic is None:
+                raise HttpError(404, f"license '{key}' not found")
+            values = {}
+            for field, value in changes.items():
+                value, error = check_field_value(store, lic, field, str(value))
+                if error:
+                    raise HttpError(400, error)
+                values[field] = value
+            for field, value in values.items():
+                store.update(lic, field, value)
+            return lic
+
+        return 200, {"license": await self.write(edit)}
+
+    async def delete_license(self, request):
+        key = request.match["key"]
+
+        def delete(store):
+            lic = store.get(key)
+            if lic is None:
+                raise HttpError(404, f"license '{key}' not found")
+            store.delete(lic)
+            return key
+
+        return 200, {"deleted": await self.write(delete)}
+
+    # Set current_usage outright ({"count": n}) or change it ({"delta": n})
+    async def set_usage(self, request):
+        data = request.json()
+        key = request.match["key"]
+        for field in ["count", "delta"]:
+            value = data.get(field, 0)
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise HttpError(400, "usage must be a number of at least 0")
+
+        def update(store):
+            lic = store.get(key)
+            if lic is None:
+                raise HttpError(404, f"license '{key}' not found")
+            if "count" in data:
+                count = data["count"]
+            else:
+                count = int(lic['current_usage']) + data.get("delta", 0)
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                raise HttpError(400, "usage must be a number of at least 0")
+            store.update(lic, 'current_usage', count)
+            return lic
+
+        return 200, {"license": await self.write(update)}
+
+    # Seat check-out/check-in through the usage meter; usage is written
+    # in batches by flush_usage()
+    async def seat(self, request):
+        data = request.json()
+        key = request.match["key"]
+        self.get_license(key)
+        user = data.get("user", request.username)
+        device = data.get("device", "")
+        if request.match["action"] == "checkout":
+            revoked = len(self.meter.revoked)
+            granted = await self.write(lambda store: self.meter.checkout(key, user, device), metered=True)
+            # Taken back by the flush if another process got there first
+            granted = granted and (key, user, device) not in self.meter.revoked[revoked:]
+            result = {"granted": granted, "usage": self.meter.usage(key)}
+            if not granted:
+                result.update(ok=False, error="usage limit reached")
+            return (200 if granted else 409), result
+        returned = await self.write(lambda store: self.meter.checkin(key, user, device), metered=True)
+        return 200, {"returned": returned, "usage": self.meter.usage(key)}
+
+    async def history(self, request):
+        key = request.match["key"]
+        self.get_license(key)
+        return 200, {"license_key": key, "days": self.meter.history.days_for(key)}
+
+    async def expired(self, request):
+        store = self.current_store()
+        today = date.today()
+        return 200, {"licenses": [store.get(key) for key in store.expiry.expired(today)]}
+
+    async def expiring(self, request):
+        store = self.current_store()
+        keys = store.expiry.expiring_within(request.int_param("days", REPORT_EXPIRY_DAYS), date.today())
+        return 200, {"licenses": [store.get(key) for key in keys]}
+
+    async def report(self, request):
+        by = request.params.get("by", "software")
+        if by not in REPORT_GROUPS:
+            raise HttpError(400, f"by must be one of {', '.join(REPORT_GROUPS)}")
+        days = request.int_param("days", REPORT_EXPIRY_DAYS)
+        return 200, {"report": build_report(self.current_store(), by, days)}
+
+    # Licenses changed or deleted after sequence ?since=, in the order of
+    # their last change. The X-Last-Seq header is the since= to use next.
+    async def changes(self, request):
+        fmt = request.params.get("format", "jsonl")
+        if fmt not in ["csv", "jsonl"]:
+            raise HttpError(400, "format must be csv or jsonl")
+        since = request.int_param("since", 0)
+        self.current_store()
+        try:
+            rows, seq = changed_since(since)
+        except ValueError as e:
+            raise HttpError(410, str(e))
+        content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return 200, (content_type, (text for count, text in export_chunks(rows, fmt, CHANGE_COLUMNS)),
+                     [f"X-Last-Seq: {seq}"])
+
+    # Move every license of one user to another ({"to": username}) in one write
+    async def reassign_user(self, request):
+        old_user = request.match["username"]
+        new_user = request.json().get("to")
+        if not new_user or new_user == old_user:
+            raise HttpError(400, "'to' must name a different user")
+        if find_user(new_user) is None:
+            raise HttpError(400, f"user '{new_user}' not found")
+
+        def reassign(store):
+            return [lic['license_key'] for lic in store.reassign("user", old_user, new_user)]
+
+        moved = await self.write(reassign)
+        return 200, {"moved": len(moved), "licenses": moved}
+
+    # Unassign every license of a device, or move them ({"to": device})
+    async def retire_device(self, request):
+        device = request.match["device"]
+        new_device = request.json().get("to", "")
+        if not isinstance(new_device, str) or new_device == device:
+            raise HttpError(400, "'to' must name a different device")
+
+        def retire(store):
+            return [lic['license_key'] for lic in store.reassign("assigned_device", device, new_device)]
+
+        moved = await self.write(retire)
+        return 200, {"moved": len(moved), "licenses": moved}
+
+    async def orphans(self, request):
+        usernames = {user['username'] for user in load_users()}
+        found = self.current_store().orphans(usernames)
+        return 200, {"count": len(found), "licenses": found}
+
+    # Streamed CSV/JSONL export with the same filters as the command line
+    async def export(self, request):
+        fmt = request.params.get("format", "csv")
+        if fmt not in ["csv", "jsonl"]:
+            raise HttpError(400, "format must be csv or jsonl")
+        columns = request.params["columns"].split(",") if request.params.get("columns") else None
+        try:
+            check_columns(columns)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        filters = {"user": request.params.get("user"), "software": request.params.get("software"),
+                   "status": request.params.get("status"), "expired": request.params.get("expired") == "1"}
+        licenses = iter_licenses(self.current_store(), **filters)
+        content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return 200, (content_type, (text for rows, text in export_chunks(licenses, fmt, columns)))
+
+    # Operation metrics of this server process, as Prometheus text (or
+    # JSON with ?format=json)
+    async def show_metrics(self, request):
+        if request.params.get("format") == "json":
+            return 200, ("application/json", iter([metrics.to_json()]))
+        return 200, ("text/plain; version=0.0.4", iter([metrics.to_prometheus()]))
+
+    # (method, path pattern, handler, command name used for the admin check)
+    ROUTES = [
+        ("GET", r"/licenses", list_licenses, "view"),
+        ("POST", r"/licenses", add_license, "add"),
+        ("GET", r"/licenses/(?P<key>[^/]+)", show_license, "view"),
+        ("PATCH", r"/licenses/(?P<key>[^/]+)", edit_license, "edit"),
+        ("DELETE", r"/licenses/(?P<key>[^/]+)", delete_license, "delete"),
+        ("POST", r"/licenses/(?P<key>[^/]+)/usage", set_usage, "usage"),
+        ("POST", r"/licenses/(?P<key>[^/]+)/(?P<action>checkout|checkin)", seat, "usage"),
+        ("GET", r"/licenses/(?P<key>[^/]+)/history", history, "history"),
+        ("GET", r"/search", search, "search"),
+        ("GET", r"/expired", expired, "expired"),
+        ("GET", r"/expiring", expiring, "expired"),
+        ("GET", r"/report", report, "report"),
+        ("GET", r"/export", export, "export"),
+        ("GET", r"/changes", changes, "changes"),
+        ("POST", r"/users/(?P<username>[^/]+)/reassign", reassign_user, "reassign"),
+        ("POST", r"/devices/(?P<device>[^/]+)/retire", retire_device, "retire-device"),
+        ("GET", r"/orphans", orphans, "orphans"),
+        ("GET", r"/metrics", show_metrics, "metrics"),
+    ]
+
+    # ------------------ HTTP ------------------
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        allowed = False
+        for route_method, pattern, handler, command in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match is None:
+                continue
+            allowed = True
+            if route_method == method:
+                break
+        else:
+            if allowed:
+                raise HttpError(405, f"{method} is not supported here")
+            raise HttpError(404, f"no such endpoint '{path}'")
+
+        request = Request(method, path, dict(parse_qsl(url.query)), body,
+                          {name: unquote(value) for name, value in match.groupdict().items()})
+        identity = await self.authenticate(headers.get("authorization", ""))
+        if identity is None:
+            raise HttpError(401, "valid credentials required")
+        request.username, request.role = identity
+        if command in ADMIN_COMMANDS and request.role != "admin":
+            raise HttpError(403, "admin access required")
+        return await handler(self, request)
+
+    async def respond(self, writer, status, payload, keep_alive, extra_headers=()):
+        headers = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                   "Connection: " + ("keep-alive" if keep_alive else "close"), *extra_headers]
+        if isinstance(payload, tuple):
+            # Streamed body: (content type, iterator of text chunks), and
+            # optionally a list of extra headers
+            content_type, chunks, *more = payload
+            headers += [f"Content-Type: {content_type}", "Transfer-Encoding: chunked", *(more[0] if more else [])]
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+            for text in chunks:
+                data = text.encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        else:
+            payload = {"ok": payload.pop("ok", status < 400), **payload}
+            data = json.dumps(payload, default=json_default).encode()
+            headers += ["Content-Type: application/json", f"Content-Length: {len(data)}"]
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + data)
+        await writer.drain()
+
+    # Serve requests on one connection until the client closes it
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "malformed request line"}, False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "invalid Content-Length"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                extra = []
+                start = time.perf_counter()
+                try:
+                    status, payload = await self.dispatch(method, target, headers, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                    if e.status == 401:
+                        extra.append('WWW-Authenticate: Basic realm="SoftWhere"')
+                except ValueError as e:
+                    status, payload = 400, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                await self.respond(writer, status, payload, keep_alive, extra)
+                metrics.record("http_request", time.perf_counter() - start)
+                if status >= 400:
+                    metrics.add("http_request", "errors")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        tasks = [asyncio.create_task(self.writer()), asyncio.create_task(self.flush_usage())]
+        print(f"Serving {len(self.store)} licenses on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.meter.flush()
+
+# ------------------ ENTRY POINT ------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the license inventory as a JSON API.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--profile", choices=PROFILE_MODES, nargs="?", const="all", default=PROFILE_MODE or None,
+                        help="profile the server until it stops (also SOFTWHERE_PROFILE)")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_FILE or None,
+                        help="write operation metrics to FILE on exit (also SOFTWHERE_METRICS)")
+    args = parser.parse_args()
+
+    if args.profile:
+        start_profiling(args.profile)
+    if args.metrics:
+        import atexit
+        atexit.register(write_metrics, args.metrics)
+    # Stop the same way as on Ctrl+C so the usage meter flushes and the
+    # metrics/profile get written
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        asyncio.run(LicenseServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,356 @@
+import argparse
+import heapq
+import json
+import os
+import signal
+import sys
+import time
+from datetime import date, datetime
+
+import license_inventory
+from license_inventory import (
+    METRICS_FILE, PROFILE_MODE, PROFILE_MODES, as_int, get_store, metrics, start_profiling,
+    write_json_atomic, write_metrics,
+)
+
+# Days before the expiry date on which a warning is sent
+DEFAULT_WARN_DAYS = [30, 7, 1]
+# How often licenses.json and the journal are checked for changes saved
+# by other sessions, in seconds
+POLL_SECONDS = float(os.environ.get("SOFTWHERE_WATCH_POLL", 5))
+# Name of the file, next to licenses.json, that remembers the warnings and
+# over-limit alerts already sent, so a restart or the next --once run
+# doesn't repeat them or miss those due in between
+STATE_FILE_NAME = "watch_state.json"
+
+# Local midnight at the start of a day, as a timestamp
+def day_start(ordinal):
+    return datetime.combine(date.fromordinal(ordinal), datetime.min.time()).timestamp()
+
+# ------------------ SCHEDULE ------------------
+
+# The next expiry or warning of every active license in a heap ordered by
+# the day it is due, kept in sync with the store as a listener. A license
+# has one live entry at a time; when it changes a new entry is pushed and
+# the old one is skipped when it comes up. Alerts are queued in
+# self.alerts for the watcher to send.
+#
+# self.warned and self.over_limit record the alerts sent so far and can be
+# saved and restored (state()/restore()). After a restore, the startup
+# check sends the warnings and over-limit alerts that became due while no
+# watcher was running, and only those.
+class ExpirySchedule:
+    def __init__(self, warn_days=DEFAULT_WARN_DAYS, initial=False):
+        self.warn_days = sorted(set(warn_days), reverse=True)
+        self.initial = initial  # also alert about the state found at startup
+        self.heap = []          # (day ordinal, sequence, kind, license_key)
+        self.sequence = 0
+        self.live = {}          # license_key -> sequence of its live entry
+        self.known = {}         # license_key -> (expiry ordinal, status) last scheduled
+        self.warned = {}        # license_key -> (expiry ordinal, days) of its last warning
+        self.over_limit = set()
+        self.alerts = []
+        self.started = False
+        self.restored = False
+
+    # Alerts sent so far, as JSON-ready data
+    def state(self):
+        warned = {key: list(self.warned[key]) for key in sorted(self.warned) if key in self.live}
+        return {"warned": warned, "over_limit": sorted(self.over_limit)}
+
+    # Pick up the alerts sent by an earlier run (ignored with --initial,
+    # which alerts about everything found at startup)
+    def restore(self, state):
+        if self.initial or self.started:
+            return
+        self.warned = {key: tuple(warned) for key, warned in state.get("warned", {}).items()}
+        self.over_limit = set(state.get("over_limit", []))
+        self.restored = True
+
+    # Called after a full load. Only licenses that are new or whose expiry
+    # or status changed count as changes; the rest are rescheduled without
+    # repeating alerts already sent.
+    def rebuild(self, licenses):
+        known, over_limit = self.known, self.over_limit
+        self.heap, self.live, self.known, self.over_limit = [], {}, {}, set()
+        today = date.today().toordinal()
+        startup_alerts = self.initial or self.restored
+        for lic in licenses:
+            key = lic['license_key']
+            changed = known.get(key) != self._state(lic) if self.started else startup_alerts
+            self._schedule(lic, today, alert=changed, push=list.append)
+            self._check_usage(lic, alert=(self.started or startup_alerts) and key not in over_limit)
+        heapq.heapify(self.heap)
+        self.started = True
+
+    def on_add(self, lic):
+        if self.known.get(lic['license_key']) != self._state(lic):
+            self._schedule(lic, date.today().toordinal(), alert=True)
+        self._check_usage(lic, alert=True)
+
+    def on_remove(self, lic):
+        pass
+
+    def _state(self, lic):
+        return lic.ordinal('expiry_date'), lic['status']
+
+    def _push(self, day, kind, key, push=heapq.heappush):
+        self.sequence += 1
+        self.live[key] = self.sequence
+        push(self.heap, (day, self.sequence, kind, key))
+
+    # Most urgent warning whose day has come (days before expiry), or None
+    # outside the warning window
+    def _threshold(self, expiry, today):
+        reached = [days for days in self.warn_days if expiry - days <= today <= expiry]
+        return min(reached) if reached else None
+
+    # First warning day still ahead, or else the day after expiry, when
+    # the license counts as expired
+    def _next(self, expiry, today):
+        for days in self.warn_days:
+            if expiry - days > today:
+                return expiry - days, "expiring"
+        return expiry + 1, "expired"
+
+    # Queue the license's next event. With alert set, a license already
+    # inside its warning window gets a warning today, unless that warning
+    # was already sent. Without it, a license found inside its window at
+    # startup counts as warned.
+    def _schedule(self, lic, today, alert, push=heapq.heappush):
+        key = lic['license_key']
+        expiry, status = self.known[key] = self._state(lic)
+        self.live.pop(key, None)
+        if expiry is None or status == "expired":
+            return
+        threshold = self._threshold(expiry, today)
+        if alert and threshold is not None and self.warned.get(key) != (expiry, threshold):
+            self._push(today, "expiring", key, push)
+        else:
+            if threshold is not None and not self.started:
+                self.warned[key] = (expiry, threshold)
+            self._push(*self._next(expiry, today), key, push)
+
+    def _check_usage(self, lic, alert):
+        key = lic['license_key']
+        over = as_int(lic.get('current_usage')) > as_int(lic.get('usage_limit'))
+        if not over:
+            self.over_limit.discard(key)
+        elif key not in self.over_limit:
+            self.over_limit.add(key)
+            if alert:
+                self.alerts.append(make_alert("over_limit", lic))
+
+    # Day the next entry is due, or None if nothing is scheduled
+    def next_day(self):
+        return self.heap[0][0] if self.heap else None
+
+    # Pop the live entries due by today as (kind, license). A warning
+    # schedules the license's next event straight away.
+    def due(self, store, today):
+        found = []
+        while self.heap and self.heap[0][0] <= today:
+            day, sequence, kind, key = heapq.heappop(self.heap)
+            lic = store.get(key)
+            if lic is None or self.live.get(key) != sequence:
+                continue
+            del self.live[key]
+            if kind == "expiring":
+                expiry = lic.ordinal('expiry_date')
+                self.warned[key] = (expiry, self._threshold(expiry, today))
+                self._push(*self._next(expiry, today), key)
+            found.append((kind, lic))
+        return found
+
+def make_alert(kind, lic, **details):
+    alert = {"time": datetime.now().isoformat(timespec="seconds"), "kind": kind}
+    for field in ["license_key", "software", "user", "assigned_device", "expiry_date",
+                  "usage_limit", "current_usage"]:
+        alert[field] = lic.get(field)
+    alert.update(details)
+    return alert
+
+# ------------------ ALERT SINKS ------------------
+
+# Every sink has send(alert)
+
+# One JSON object per line on stdout
+class StdoutSink:
+    def send(self, alert):
+        print(json.dumps(alert), flush=True)
+
+# Human-readable lines appended to a log file
+class LogSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        if alert["kind"] == "expired":
+            text = f"expired on {alert['expiry_date']}"
+        elif alert["kind"] == "expiring":
+            text = f"expires on {alert['expiry_date']} ({alert['days_left']} day(s) left)"
+        else:
+            text = f"over its limit ({alert['current_usage']} of {alert['usage_limit']} seats used)"
+        with open(self.path, "a") as f:
+            f.write(f"{alert['time']} {alert['kind'].upper()} {alert['software']} "
+                    f"(key {alert['license_key']}, user {alert['user']}) {text}\n")
+
+# Stand-in for a webhook: each alert is written to its own JSON file in a
+# directory for another process to pick up and delete. Files appear
+# complete (written under a temporary name, then renamed).
+class WebhookDirSink:
+    def __init__(self, directory):
+        self.directory = directory
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, alert):
+        self.sequence += 1
+        stamp = alert["time"].replace(":", "")
+        name = f"{stamp}-{os.getpid()}-{self.sequence:06d}-{alert['kind']}.json"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(alert, f)
+        os.replace(path + ".tmp", path)
+
+# ------------------ WATCHER ------------------
+
+# Keeps the store loaded, marks licenses expired the day after their
+# expiry date and sends alerts. Sleeps until the next scheduled day or
+# the next poll for changes, whichever comes first.
+#
+# state_file keeps the alerts sent between runs (see ExpirySchedule); None
+# keeps them in memory only.
+class LicenseWatcher:
+    def __init__(self, sinks, warn_days=DEFAULT_WARN_DAYS, poll=POLL_SECONDS, initial=False, state_file=None):
+        self.sinks = sinks
+        self.poll = poll
+        self.state_file = state_file
+        self.saved_state = None
+        self.store = get_store()
+        self.schedule = ExpirySchedule(warn_days, initial)
+        if state_file:
+            try:
+                with open(state_file) as f:
+                    self.saved_state = json.load(f)
+                self.schedule.restore(self.saved_state)
+            except FileNotFoundError:
+                pass
+        self.store.add_listener("watch", self.schedule)
+
+    # Pick up other sessions' changes: only new journal records are
+    # applied, and a full reload happens only if licenses.json was replaced
+    def refresh(self):
+        self.store.refresh()
+        self.store.listener("watch")
+
+    # Flip the status of licenses that expired and queue their alerts; the
+    # flips are saved together as one write
+    def check(self, today):
+        flipped = []
+        for kind, lic in self.schedule.due(self.store, today):
+            if kind == "expired":
+                self.store.update(lic, 'status', 'expired')
+                flipped.append(lic)
+                self.schedule.alerts.append(make_alert("expired", lic))
+            else:
+                days_left = lic.ordinal('expiry_date') - today
+                self.schedule.alerts.append(make_alert("expiring", lic, days_left=days_left))
+        if flipped and not self.store.save():
+            print("Some status changes were not saved; they will be retried.", file=sys.stderr)
+        metrics.add("watch", "expired", len(flipped))
+
+    def send_alerts(self):
+        alerts, self.schedule.alerts = self.schedule.alerts, []
+        for alert in alerts:
+            for sink in self.sinks:
+                sink.send(alert)
+        metrics.add("watch", "alerts", len(alerts))
+
+    # Written after the alerts are sent: a crash in between repeats them
+    # rather than losing them
+    def save_state(self):
+        state = self.schedule.state()
+        if self.state_file and state != self.saved_state:
+            write_json_atomic(self.state_file, state, compact=True)
+            self.saved_state = state
+
+    def run_once(self):
+        with metrics.timer("watch"):
+            self.refresh()
+            self.check(date.today().toordinal())
+            self.send_alerts()
+            self.save_state()
+
+    def seconds_to_sleep(self):
+        next_day = self.schedule.next_day()
+        if next_day is None:
+            return self.poll
+        return min(self.poll, max(day_start(next_day) - time.time(), 0.0))
+
+    def run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.seconds_to_sleep())
+
+# ------------------ ENTRY POINT ------------------
+
+def parse_days(text):
+    try:
+        days = [int(part) for part in text.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma-separated list of days, e.g. 30,7,1")
+    if any(day < 0 for day in days):
+        raise argparse.ArgumentTypeError("days must not be negative")
+    return days
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Watch the license inventory: mark licenses expired as they expire and send alerts "
+                    "for expiries, upcoming expiries and licenses over their usage limit.")
+    parser.add_argument("--warn", type=parse_days, default=DEFAULT_WARN_DAYS, metavar="DAYS",
+                        help="days before expiry to warn, comma-separated (default: 30,7,1)")
+    parser.add_argument("--log", metavar="FILE", help="append alerts to FILE")
+    parser.add_argument("--webhook-dir", metavar="DIR", help="write each alert as a JSON file in DIR")
+    parser.add_argument("--stdout", action="store_true",
+                        help="print alerts as JSON lines (the default when no other sink is given)")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, metavar="SECONDS",
+                        help=f"how often to check for changes made elsewhere (default: {POLL_SECONDS:g})")
+    parser.add_argument("--initial", action="store_true",
+                        help="also alert about licenses already near expiry or over their limit at startup")
+    parser.add_argument("--once", action="store_true",
+                        help="check once and exit, e.g. from cron (alerts sent are kept in --state)")
+    parser.add_argument("--state", metavar="FILE",
+                        default=os.path.join(os.path.dirname(license_inventory.LICENSE_FILE), STATE_FILE_NAME),
+                        help=f"file remembering the alerts already sent (default: {STATE_FILE_NAME} next to the "
+                             "licenses file)")
+    parser.add_argument("--profile", choices=PROFILE_MODES, nargs="?", const="all", default=PROFILE_MODE or None,
+                        help="profile the watcher until it stops (also SOFTWHERE_PROFILE)")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_FILE or None,
+                        help="write operation metrics to FILE on exit (also SOFTWHERE_METRICS)")
+    args = parser.parse_args()
+
+    sinks = []
+    if args.log:
+        sinks.append(LogSink(args.log))
+    if args.webhook_dir:
+        sinks.append(WebhookDirSink(args.webhook_dir))
+    if args.stdout or not sinks:
+        sinks.append(StdoutSink())
+
+    if args.profile:
+        start_profiling(args.profile)
+    if args.metrics:
+        import atexit
+        atexit.register(write_metrics, args.metrics)
+    # Stop the same way as on Ctrl+C so the metrics/profile get written
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    watcher = LicenseWatcher(sinks, args.warn, args.poll, args.initial, args.state)
+    try:
+        if args.once:
+            watcher.run_once()
+        else:
+            watcher.run()
+    except KeyboardInterrupt:
+        pass
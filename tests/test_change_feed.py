@@ -0,0 +1,53 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+class ChangeFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE])
+        self.store = inventory.LicenseStore(inventory.JsonBackend())
+        self.store.load()
+
+    def tearDown(self):
+        inventory.CHANGE_FEED_KEEP = 0
+        shutil.rmtree(self.directory)
+
+    def set_usage(self, usage):
+        self.store.update(self.store.get("ABC-1"), 'current_usage', usage)
+        self.assertTrue(self.store.save())
+
+    # A crash between the two writes must not leave a saved change that
+    # the feed doesn't know about
+    def test_feed_is_written_before_the_journal(self):
+        def crash(changes, store):
+            raise KeyboardInterrupt
+        self.store.backend.write_changes = crash
+        self.store.update(self.store.get("ABC-1"), 'current_usage', 2)
+        with self.assertRaises(KeyboardInterrupt):
+            self.store.save()
+        self.assertEqual([rec['value'] for rec in inventory.read_change_feed()], [2])
+
+    def test_trimmed_feed_keeps_latest_changes(self):
+        inventory.CHANGE_FEED_KEEP = 3
+        for usage in range(1, 8):
+            self.set_usage(usage)
+        self.assertEqual(inventory.first_change_sequence(), 3)
+        self.assertEqual([rec['seq'] for rec in inventory.read_change_feed(3)], [4, 5, 6, 7])
+        rows, seq = inventory.changed_since(4)
+        self.assertEqual((rows[0]['current_usage'], seq), (7, 7))
+        with self.assertRaises(ValueError):
+            inventory.changed_since(2)
+        self.set_usage(8)
+        self.assertEqual(inventory.last_change_sequence(), 8)
+
+if __name__ == "__main__":
+    unittest.main()
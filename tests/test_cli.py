@@ -0,0 +1,46 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE])
+        inventory.write_json_atomic(inventory.USER_FILE, [
+            {"username": "JunLorenz", "password": inventory.hash_password("secret"), "role": "admin"}])
+        os.environ["SOFTWHERE_PASSWORD"] = "secret"
+        self.output = inventory.CLI_OUTPUT = io.StringIO()
+
+    def tearDown(self):
+        inventory.CLI_OUTPUT = sys.stdout
+        del os.environ["SOFTWHERE_PASSWORD"]
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, lines):
+        path = os.path.join(self.directory, "batch.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        code = inventory.run_cli(["--user", "JunLorenz", "--batch", path])
+        return code, [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    # Queries in a batch print their results like single commands do
+    def test_every_command_prints_its_result(self):
+        code, results = self.run_batch(["# usage check", "search matlab", "bogus", "search nothing-here"])
+        self.assertEqual(code, 1)
+        self.assertEqual([result.get("line") for result in results], [2, 3, 4, None])
+        self.assertEqual([lic["license_key"] for lic in results[0]["licenses"]], ["ABC-1"])
+        self.assertFalse(results[1]["ok"])
+        self.assertEqual(results[3]["commands"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
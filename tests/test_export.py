@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+LICENSES = [
+    dict(LICENSE, license_key="A-1", software="MATLAB", expiry_date="2020-01-01"),
+    dict(LICENSE, license_key="A-2", software="MATLAB Simulink", expiry_date="2020-6-1"),
+    dict(LICENSE, license_key="A-3", software="matlab", expiry_date="2099-01-01"),
+    dict(LICENSE, license_key="A-4", software="Tool:Pro", expiry_date="2020-02-30"),
+]
+
+class IterLicensesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, LICENSES)
+        self.store = inventory.LicenseStore(inventory.JsonBackend())
+        self.store.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def keys(self, **filters):
+        return sorted(lic['license_key'] for lic in inventory.iter_licenses(self.store, **filters))
+
+    def test_software_is_an_exact_match_in_any_case(self):
+        self.assertEqual(self.keys(software="MATLAB"), ["A-1", "A-3"])
+        self.assertEqual(self.keys(software="tool:pro"), ["A-4"])
+
+    # Compared as parsed dates: "2020-02-30" sorts before today as a string
+    # but isn't a date, so it is never expired
+    def test_expired_compares_parsed_dates(self):
+        self.assertEqual(self.keys(expired=True), ["A-1", "A-2"])
+        self.assertEqual(self.keys(software="matlab", expired=True), ["A-1"])
+
+    def test_unknown_column_is_rejected(self):
+        with self.assertRaises(ValueError):
+            inventory.export_licenses(os.path.join(self.directory, "out.csv"), columns=["software", "nope"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "out.csv")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [])
+        inventory.write_json_atomic(inventory.USER_FILE, [{"username": "JunLorenz", "password": "x", "role": "admin"}])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def stored_keys(self):
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        return sorted(store.licenses)
+
+    # Bad lines are reported by line number and the rest still imported
+    def test_bad_jsonl_lines_are_row_errors(self):
+        lines = [json.dumps(dict(LICENSE, license_key="A-1")), "{not json", "", "[1]", '"x"',
+                 json.dumps(dict(LICENSE, license_key="A-2"))]
+        report = inventory.import_licenses(self.write("in.jsonl", "\n".join(lines) + "\n"))
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 4, 5])
+        self.assertTrue(report["errors"][0]["errors"][0].startswith("invalid JSON"))
+        self.assertEqual(report["errors"][1]["errors"], ["not a JSON object"])
+        self.assertEqual(self.stored_keys(), ["A-1", "A-2"])
+
+    def test_json_file_is_one_array(self):
+        rows = [dict(LICENSE, license_key="A-1"), dict(LICENSE, license_key="A-2", user="nobody")]
+        report = inventory.import_licenses(self.write("in.json", json.dumps(rows, indent=4)))
+        self.assertEqual(report["imported"], 1)
+        self.assertEqual(report["errors"][0]["row"], 2)
+        self.assertEqual(self.stored_keys(), ["A-1"])
+        with self.assertRaises(ValueError):
+            inventory.import_licenses(self.write("bad.json", json.dumps(LICENSE)))
+
+    # Another session adds one of the keys between the checks and the save:
+    # only that row is reported as not saved
+    def test_rows_clashing_on_save_are_reported(self):
+        store = inventory.get_store()
+        save = store.save
+        def racing_save():
+            other = inventory.LicenseStore(inventory.JsonBackend())
+            other.load()
+            other.add(dict(LICENSE, license_key="A-2"))
+            other.save()
+            return save()
+        store.save = racing_save
+        lines = [json.dumps(dict(LICENSE, license_key=key)) for key in ["A-1", "A-2", "A-3"]]
+        report = inventory.import_licenses(self.write("in.jsonl", "\n".join(lines) + "\n"))
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual([(error["row"], error["license_key"]) for error in report["errors"]], [(2, "A-2")])
+        self.assertEqual(self.stored_keys(), ["A-1", "A-2", "A-3"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+
+LICENSE = {
+    "software": "MATLAB", "license_key": "ABC-1", "user": "JunLorenz", "assigned_device": "PC-1",
+    "install_date": "2024-01-01", "expiry_date": "2030-01-01", "usage_limit": 5,
+    "current_usage": 0, "status": "active",
+}
+
+# Point the module's data files at a temporary directory
+def use_data_dir(directory):
+    inventory.USER_FILE = os.path.join(directory, "users.json")
+    inventory.LICENSE_FILE = os.path.join(directory, "licenses.json")
+    inventory.JOURNAL_FILE = os.path.join(directory, "licenses.journal")
+    inventory.CHANGE_FEED_FILE = os.path.join(directory, "licenses.changes.jsonl")
+    inventory.LOCK_FILE = inventory.LICENSE_FILE + ".lock"
+    inventory.STORAGE_BACKEND = "json"
+    inventory.PLAIN = True
+    inventory._backend = None
+    inventory._store = None
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_store(self):
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        return store
+
+    def append_journal(self, data):
+        with open(inventory.JOURNAL_FILE, "ab") as f:
+            f.write(data)
+
+    def test_save_after_torn_tail_is_kept(self):
+        store = self.new_store()
+        # Another session crashed halfway through its append
+        self.append_journal(b'{"op":"set","key":"ABC-1","fie')
+
+        store.update(store.get("ABC-1"), "current_usage", 2)
+        self.assertTrue(store.save())
+        store.update(store.get("ABC-1"), "user", "KateSigue")
+        self.assertTrue(store.save())
+
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-1")["current_usage"], 2)
+        self.assertEqual(reloaded.get("ABC-1")["user"], "KateSigue")
+
+    def test_torn_tail_is_cut_on_load(self):
+        store = self.new_store()
+        store.update(store.get("ABC-1"), "current_usage", 3)
+        self.assertTrue(store.save())
+        size = os.path.getsize(inventory.JOURNAL_FILE)
+        self.append_journal(b'{"op":"del')
+
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-1")["current_usage"], 3)
+        self.assertEqual(os.path.getsize(inventory.JOURNAL_FILE), size)
+
+    def test_bad_line_does_not_hide_later_records(self):
+        store = self.new_store()
+        store.update(store.get("ABC-1"), "current_usage", 1)
+        self.assertTrue(store.save())
+        self.append_journal(b"not json\n")
+        self.append_journal(b'{"op":"set","key":"ABC-1","field":"current_usage","value":4,"old":1}\n')
+
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-1")["current_usage"], 4)
+
+    def test_other_session_sees_changes_across_compaction(self):
+        mine = self.new_store()
+        theirs = self.new_store()
+
+        theirs.update(theirs.get("ABC-1"), "current_usage", 2)
+        self.assertTrue(theirs.save())
+        mine.refresh()
+        self.assertEqual(mine.get("ABC-1")["current_usage"], 2)
+
+        theirs.add(dict(LICENSE, license_key="ABC-2"))
+        self.assertTrue(theirs.save())
+        theirs.compact()
+        mine.refresh()
+        self.assertIsNotNone(mine.get("ABC-2"))
+
+        # Saving on top of a journal from a newer generation merges too
+        mine.update(mine.get("ABC-1"), "user", "KateSigue")
+        self.assertTrue(mine.save())
+        theirs.refresh()
+        self.assertEqual(theirs.get("ABC-1")["user"], "KateSigue")
+        self.assertEqual(self.new_store().get("ABC-1")["current_usage"], 2)
+
+    def test_stale_generation_forces_reload_before_save(self):
+        mine = self.new_store()
+        theirs = self.new_store()
+        theirs.update(theirs.get("ABC-1"), "current_usage", 5)
+        self.assertTrue(theirs.save())
+        theirs.compact()
+
+        mine.update(mine.get("ABC-1"), "software", "Simulink")
+        self.assertTrue(mine.save())
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-1")["software"], "Simulink")
+        self.assertEqual(reloaded.get("ABC-1")["current_usage"], 5)
+
+    def test_rejected_lists_only_conflicting_changes(self):
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE, dict(LICENSE, license_key="ABC-2")])
+        mine = self.new_store()
+        theirs = self.new_store()
+        theirs.update(theirs.get("ABC-1"), "software", "Simulink")
+        self.assertTrue(theirs.save())
+
+        mine.update(mine.get("ABC-1"), "software", "Octave")
+        conflicting = mine.pending[-1]
+        mine.update(mine.get("ABC-2"), "current_usage", 1)
+        self.assertFalse(mine.save())
+        self.assertEqual(mine.rejected, [conflicting])
+
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-1")["software"], "Simulink")
+        self.assertEqual(reloaded.get("ABC-2")["current_usage"], 1)
+
+    # The re-keyed license moves to the end, the same way when the journal
+    # is replayed and after compaction
+    def test_rekeyed_license_moves_to_the_end(self):
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE, dict(LICENSE, license_key="ABC-2")])
+        store = self.new_store()
+        self.assertTrue(store.update(store.get("ABC-1"), "license_key", "ABC-3"))
+        self.assertTrue(store.save())
+        self.assertEqual(list(store.licenses), ["ABC-2", "ABC-3"])
+        self.assertIsNone(store.get("ABC-1"))
+
+        reloaded = self.new_store()
+        self.assertEqual(list(reloaded.licenses), ["ABC-2", "ABC-3"])
+        reloaded.compact()
+        self.assertEqual(list(self.new_store().licenses), ["ABC-2", "ABC-3"])
+
+if __name__ == "__main__":
+    unittest.main()
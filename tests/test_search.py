@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE
+
+def make(key, device, software="MATLAB"):
+    return inventory.License.from_dict(dict(LICENSE, license_key=key, assigned_device=device, software=software))
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = inventory.SearchIndex()
+        self.licenses = [make("ABC-100", "LAB-PC-07"), make("ABC-101", "LAB-PC-08"), make("XYZ-200", "Office-1")]
+        self.index.rebuild(self.licenses)
+
+    # Keys and devices match exactly or by prefix, without trigrams
+    def test_key_and_device_prefix(self):
+        self.assertEqual(self.index.search("key:abc-101"), ["ABC-101"])
+        self.assertEqual(sorted(self.index.search("key:abc")), ["ABC-100", "ABC-101"])
+        self.assertEqual(sorted(self.index.search("device:lab-pc")), ["ABC-100", "ABC-101"])
+        self.assertEqual(self.index.search("key:100"), [])
+        self.assertNotIn("license_key", self.index.grams)
+
+    def test_sorted_values_follow_changes(self):
+        self.index.on_remove(self.licenses[0])
+        self.index.on_add(make("ABC-050", "LAB-PC-01"))
+        self.assertEqual(sorted(self.index.search("key:abc")), ["ABC-050", "ABC-101"])
+        self.assertEqual(self.index.sorted["license_key"], ["abc-050", "abc-101", "xyz-200"])
+
+    def test_software_keeps_substring_and_fuzzy_matches(self):
+        self.index.on_add(make("S-1", "PC", software="AutoCAD LT"))
+        self.assertEqual(self.index.search("cad"), ["S-1"])
+        self.assertEqual(self.index.search("autocda"), ["S-1"])
+
+if __name__ == "__main__":
+    unittest.main()
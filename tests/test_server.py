@@ -0,0 +1,113 @@
+import asyncio
+import base64
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+import license_server
+from test_journal import LICENSE, use_data_dir
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [LICENSE])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_server(self):
+        server = license_server.LicenseServer()
+        server.meter = inventory.UsageMeter(server.store, os.path.join(self.directory, "usage.jsonl"),
+                                            auto_flush=False)
+        return server
+
+    def set_usage(self, usage):
+        return lambda store: store.update(store.get("ABC-1"), 'current_usage', usage)
+
+    # A failing save fails its own batch with 503 and leaves the writer
+    # running for the next one
+    def test_failed_save_keeps_writer_running(self):
+        async def run():
+            server = self.new_server()
+            task = asyncio.create_task(server.writer())
+            save = server.store.save
+            def fail():
+                server.store.save = save
+                raise OSError("No space left on device")
+            server.store.save = fail
+            with self.assertRaises(license_server.HttpError) as failed:
+                await server.write(self.set_usage(2))
+            self.assertEqual(failed.exception.status, 503)
+            self.assertEqual(server.store.get("ABC-1")['current_usage'], 0)
+            await asyncio.wait_for(server.write(self.set_usage(3)), 5)
+            task.cancel()
+
+        asyncio.run(run())
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        self.assertEqual(store.get("ABC-1")['current_usage'], 3)
+
+    def request(self, body):
+        return types.SimpleNamespace(json=lambda: body, match={"key": "ABC-1"})
+
+    # Not assertRaises: it clears the frames of the caught exception's
+    # traceback, which would finalize the writer task it was raised in
+    def test_delta_must_be_a_number(self):
+        async def run():
+            server = self.new_server()
+            task = asyncio.create_task(server.writer())
+
+            async def status(body):
+                try:
+                    return (await server.set_usage(self.request(body)))[0]
+                except license_server.HttpError as e:
+                    return e.status
+
+            for body in [{"delta": "x"}, {"delta": True}, {"count": 2.5}, {"delta": -1}, {"delta": 2}]:
+                self.assertEqual(await status(body), 200 if body == {"delta": 2} else 400, body)
+            self.assertEqual(server.store.get("ABC-1")['current_usage'], 2)
+            task.cancel()
+
+        asyncio.run(run())
+
+# Logging in with a legacy hash upgrades it; with SQLite the connection
+# may only be used from the event loop's thread
+class RehashTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.STORAGE_BACKEND = "sqlite"
+        inventory._backend = inventory.SqliteBackend(os.path.join(self.directory, "softwhere.db"))
+        inventory._backend.save_users([{"username": "bob", "role": "admin",
+                                        "password": hashlib.sha256(b"secret").hexdigest()}])
+
+    def tearDown(self):
+        inventory._backend.conn.close()
+        use_data_dir(self.directory)
+        shutil.rmtree(self.directory)
+
+    def test_legacy_hash_is_upgraded_on_login(self):
+        async def run():
+            server = license_server.LicenseServer()
+            task = asyncio.create_task(server.writer())
+            header = "Basic " + base64.b64encode(b"bob:secret").decode()
+            for _ in range(2):
+                self.assertEqual(await server.authenticate(header), ("bob", "admin"))
+            self.assertIsNone(await server.authenticate("Basic " + base64.b64encode(b"bob:wrong").decode()))
+            task.cancel()
+
+        asyncio.run(run())
+        stored = inventory.find_user("bob")['password']
+        self.assertFalse(inventory.needs_rehash(stored))
+        self.assertTrue(inventory.verify_password("secret", stored))
+
+if __name__ == "__main__":
+    unittest.main()
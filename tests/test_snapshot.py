@@ -0,0 +1,45 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE
+
+class SnapshotFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "licenses.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_written_format_is_detected(self):
+        for fmt in ["pretty", "compact", "binary"]:
+            for licenses in [[], [inventory.License.from_dict(LICENSE)]]:
+                inventory.write_snapshot(self.path, licenses, fmt)
+                self.assertEqual(inventory.snapshot_format(self.path), fmt, (fmt, licenses))
+
+    def test_single_line_json_is_compact(self):
+        for text in ["[]", '[ {"software": "MATLAB"} ]']:
+            with open(self.path, "w") as f:
+                f.write(text)
+            self.assertEqual(inventory.snapshot_format(self.path), "compact")
+
+    # orjson (when installed) reads integers beyond 64 bits as floats
+    def test_huge_numbers_round_trip_exactly(self):
+        lic = inventory.License.from_dict(dict(LICENSE, usage_limit=10 ** 30, seats={"by_site": [2 ** 70]}))
+        for fmt in ["pretty", "compact"]:
+            inventory.write_snapshot(self.path, [lic], fmt)
+            with open(self.path, "rb") as f:
+                loaded = inventory.read_json_snapshot(f.read())
+            self.assertEqual(loaded[0]['usage_limit'], 10 ** 30)
+            self.assertIs(type(loaded[0]['usage_limit']), int)
+            self.assertEqual(loaded[0]['seats'], {"by_site": [2 ** 70]})
+            self.assertEqual(loaded[0].to_dict(), lic.to_dict())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+class SqliteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        self.db_file = os.path.join(self.directory, "softwhere.db")
+        inventory.SqliteBackend(self.db_file).save_licenses([inventory.License.from_dict(LICENSE)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_store(self):
+        store = inventory.LicenseStore(inventory.SqliteBackend(self.db_file))
+        store.load()
+        return store
+
+    # Another session's commits are applied from the change log, without
+    # a reload: records handed out earlier stay the live ones
+    def test_refresh_applies_other_sessions_changes(self):
+        reader, writer = self.new_store(), self.new_store()
+        lic = reader.get("ABC-1")
+        writer.update(writer.get("ABC-1"), 'current_usage', 3)
+        writer.add(dict(LICENSE, license_key="ABC-2"))
+        self.assertTrue(writer.save())
+        reader.refresh()
+        self.assertIs(reader.get("ABC-1"), lic)
+        self.assertEqual(lic['current_usage'], 3)
+        self.assertIn("ABC-2", reader.licenses)
+
+    def test_session_behind_the_change_log_reloads(self):
+        reader, writer = self.new_store(), self.new_store()
+        lic = reader.get("ABC-1")
+        old_limit = inventory.SQLITE_CHANGE_LOG_WRITES
+        inventory.SQLITE_CHANGE_LOG_WRITES = 2
+        try:
+            for usage in range(1, 5):
+                writer.update(writer.get("ABC-1"), 'current_usage', usage)
+                self.assertTrue(writer.save())
+        finally:
+            inventory.SQLITE_CHANGE_LOG_WRITES = old_limit
+        reader.refresh()
+        self.assertIsNot(reader.get("ABC-1"), lic)
+        self.assertEqual(reader.get("ABC-1")['current_usage'], 4)
+
+    # Explicit nulls come back as nulls and missing fields stay missing,
+    # including a missing field set later
+    def test_null_and_missing_fields_round_trip(self):
+        nulls = dict(LICENSE, license_key="ABC-2", user=None, assigned_device=None)
+        missing = {k: v for k, v in LICENSE.items() if k not in ["assigned_device", "install_date"]}
+        missing["license_key"] = "ABC-3"
+        store = self.new_store()
+        store.add(nulls)
+        store.add(missing)
+        self.assertTrue(store.save())
+        reloaded = self.new_store()
+        self.assertEqual(reloaded.get("ABC-2").to_dict(), nulls)
+        self.assertEqual(reloaded.get("ABC-3").to_dict(), missing)
+
+        reloaded.update(reloaded.get("ABC-3"), 'assigned_device', None)
+        self.assertTrue(reloaded.save())
+        self.assertEqual(self.new_store().get("ABC-3").to_dict(), dict(missing, assigned_device=None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+from test_journal import LICENSE, use_data_dir
+
+class UsageMeterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [dict(LICENSE, current_usage=4)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_meter(self):
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        return inventory.UsageMeter(store, os.path.join(self.directory, "usage.jsonl"), auto_flush=False)
+
+    def stored_usage(self):
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        return store.get("ABC-1")['current_usage']
+
+    # Two sessions both granted the last seat without holding the storage
+    # lock: the later flush takes its grant back instead of capping silently
+    def test_grant_past_limit_is_revoked_on_flush(self):
+        first, second = self.new_meter(), self.new_meter()
+        self.assertTrue(first.checkout("ABC-1", "a", "PC-1"))
+        self.assertTrue(second.checkout("ABC-1", "b", "PC-2"))
+        self.assertTrue(first.flush())
+        self.assertTrue(second.flush())
+        self.assertEqual(second.revoked, [("ABC-1", "b", "PC-2")])
+        self.assertFalse(second.holders["ABC-1"].get(("b", "PC-2")))
+        self.assertEqual(second.history.days_for("ABC-1")[0]["denied"], 1)
+        self.assertEqual(self.stored_usage(), 5)
+
+    # With the check and the write under one hold of the storage lock the
+    # second session sees the first one's seat and is denied outright
+    def test_checkout_under_storage_lock_sees_other_sessions(self):
+        first, second = self.new_meter(), self.new_meter()
+        for meter, user, granted in [(first, "a", True), (second, "b", False)]:
+            with meter.store.backend.lock():
+                meter.store.refresh()
+                self.assertEqual(meter.checkout("ABC-1", user, "PC"), granted)
+                self.assertTrue(meter.flush())
+        self.assertEqual(second.revoked, [])
+        self.assertEqual(self.stored_usage(), 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import license_inventory as inventory
+import license_watch as watch
+from test_journal import LICENSE, use_data_dir
+
+START = date(2030, 1, 1)
+
+class ListSink:
+    def __init__(self):
+        self.alerts = []
+
+    def send(self, alert):
+        self.alerts.append(alert)
+
+# Each run is a fresh watcher, as when cron starts license_watch.py --once
+class OnceRunTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        use_data_dir(self.directory)
+        self.state_file = os.path.join(self.directory, watch.STATE_FILE_NAME)
+        expiring = dict(LICENSE, expiry_date=(START + timedelta(days=20)).isoformat())
+        over = dict(LICENSE, license_key="ABC-2", expiry_date="2040-01-01", current_usage=6)
+        inventory.write_json_atomic(inventory.LICENSE_FILE, [expiring, over])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_on(self, day, initial=False):
+        class today(date):
+            @classmethod
+            def today(cls):
+                return day
+        use_data_dir(self.directory)
+        sink = ListSink()
+        with mock.patch.object(watch, "date", today):
+            watch.LicenseWatcher([sink], initial=initial, state_file=self.state_file).run_once()
+        return [(alert["kind"], alert.get("days_left")) for alert in sink.alerts]
+
+    # Daily runs send each warning once, on the day it is due or the first
+    # run after it; the first run without saved state only records it
+    def test_daily_runs_send_each_warning_once(self):
+        sent = []
+        for offset in range(25):
+            sent.extend(self.run_on(START + timedelta(days=offset)))
+        self.assertEqual(sent, [("expiring", 7), ("expiring", 1), ("expired", None)])
+
+    def test_missed_runs_send_the_latest_warning(self):
+        self.run_on(START)
+        self.assertEqual(self.run_on(START + timedelta(days=15)), [("expiring", 5)])
+        self.assertEqual(self.run_on(START + timedelta(days=16)), [])
+
+    def test_initial_alerts_are_not_repeated(self):
+        first = self.run_on(START, initial=True)
+        self.assertEqual(sorted(first), [("expiring", 20), ("over_limit", None)])
+        self.assertEqual(self.run_on(START), [])
+        self.assertEqual(self.run_on(START + timedelta(days=1)), [])
+
+    def test_over_limit_after_a_run_is_alerted_once(self):
+        self.run_on(START)
+        store = inventory.LicenseStore(inventory.JsonBackend())
+        store.load()
+        store.update(store.get("ABC-1"), 'current_usage', 9)
+        self.assertTrue(store.save())
+        self.assertEqual(self.run_on(START), [("over_limit", None)])
+        self.assertEqual(self.run_on(START), [])
+
+if __name__ == "__main__":
+    unittest.main()